@@ -1,11 +1,13 @@
 import logging
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 from typing import List, Dict
 import redis
 import json
 from datetime import datetime, timedelta
+from bot.utils.helpers import canonical_product_key, alert_targets, queue_alert_index_update
+from database.product_codec import decode_product, encode_product, to_api_product
 
 app = FastAPI()
 
@@ -85,6 +87,7 @@ async def save_selectors(data: SelectorsRequest):
         }))
         
         redis_client.ltrim(history_key, -5, -1)
+        redis_client.incr(f"selectors_version:{marketplace}")
         
         return {
             "status": "success",
@@ -96,8 +99,14 @@ async def save_selectors(data: SelectorsRequest):
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/api/selectors/{marketplace}")
-async def get_selectors(marketplace: str):
+async def get_selectors(marketplace: str, request: Request, response: Response):
     try:
+        version_key = f"selectors_version:{marketplace}"
+        version = redis_client.get(version_key)
+
+        if version and request.headers.get("if-none-match") == selectors_etag(marketplace, version):
+            return Response(status_code=304)
+
         history_key = f"selectors_history:{marketplace}"
         stored_data = redis_client.lrange(history_key, 0, -1)
         
@@ -106,8 +115,13 @@ async def get_selectors(marketplace: str):
                 status_code=404, 
                 detail=f"No selectors found for {marketplace}"
             )
+
+        if not version:
+            # Селекторы сохранены до появления версий — инициализируем счётчик
+            version = redis_client.incr(version_key)
             
         selectors_history = [json.loads(item) for item in stored_data]
+        response.headers["ETag"] = selectors_etag(marketplace, version)
         
         return {
             "marketplace": marketplace,
@@ -117,6 +131,9 @@ async def get_selectors(marketplace: str):
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+def selectors_etag(marketplace: str, version) -> str:
+    return f'"{marketplace}-{version}"'
+
 @app.post("/api/save-products")
 async def save_products(data: SaveProductsRequest):
     try:
@@ -124,24 +141,47 @@ async def save_products(data: SaveProductsRequest):
         token = data.token
         products = [product.dict() for product in data.products]
 
-        stored_token = redis_client.hget(f"user:{user_id}", "token")
-        if stored_token != token:
-            raise HTTPException(status_code=403, detail="Invalid token")
-
         products_key = f"products:{user_id}"
-        old_products = redis_client.lrange(products_key, 0, -1)
-        
-        if old_products:
-            history_key = f"products_history:{user_id}"
-            redis_client.rpush(history_key, json.dumps({
-                "products": [json.loads(p) for p in old_products],
-                "timestamp": datetime.now().isoformat()
-            }))
-            redis_client.ltrim(history_key, -50, -1)
-
-        redis_client.delete(products_key)
-        for product in products:
-            redis_client.rpush(products_key, json.dumps(product))
+        with redis_client.pipeline(transaction=True) as pipe:
+            while True:
+                try:
+                    # Старый список читаем под WATCH: если его перезапишут до EXEC, повторяем,
+                    # иначе из индекса целевых цен не уберутся записи исчезнувших товаров
+                    pipe.watch(products_key)
+                    stored_token = pipe.hget(f"user:{user_id}", "token")
+                    old_products = pipe.lrange(products_key, 0, -1)
+
+                    if stored_token != token:
+                        raise HTTPException(status_code=403, detail="Invalid token")
+
+                    old_products = [decode_product(p)[0] for p in old_products]
+
+                    # Всё сохранение — одна транзакция MULTI/EXEC: бот не увидит пустой или недописанный список
+                    pipe.multi()
+                    if old_products:
+                        history_key = f"products_history:{user_id}"
+                        pipe.rpush(history_key, json.dumps({
+                            "products": old_products,
+                            "timestamp": datetime.now().isoformat()
+                        }))
+                        pipe.ltrim(history_key, -50, -1)
+
+                    pipe.delete(products_key)
+                    pipe.sadd("users", user_id)
+                    if products:
+                        # Ключи нормализуются один раз здесь, а не при каждом чтении в цикле мониторинга
+                        pipe.rpush(products_key, *(encode_product(product) for product in products))
+
+                    new_targets = alert_targets(user_id, products)
+                    queue_alert_index_update(pipe, alert_targets(user_id, old_products), new_targets)
+                    if new_targets:
+                        # Новый товар сразу попадает в расписание проверок бота; у известных срок не меняется
+                        now = datetime.now().timestamp()
+                        pipe.zadd("check_schedule", {key: now for key in new_targets}, nx=True)
+                    pipe.execute()
+                    break
+                except redis.WatchError:
+                    continue
 
         return {
             "status": "success",
@@ -161,7 +201,7 @@ async def get_products(telegram_id: int, token: str):
 
         products_key = f"products:{telegram_id}"
         products = redis_client.lrange(products_key, 0, -1)
-        products = [json.loads(p) for p in products]
+        products = [to_api_product(decode_product(p)[0]) for p in products]
 
         return {
             "products": products,
@@ -182,7 +222,7 @@ async def save_price_history(data: dict):
         if not all([product_url, price, timestamp]):
             raise HTTPException(status_code=400, detail="Missing required fields")
 
-        history_key = f"price_history:{product_url}"
+        history_key = f"price_history:{canonical_product_key(product_url)}"
         
         history_data = {
             'price': price,
@@ -222,6 +262,21 @@ async def get_user_activity(token: str):
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/api/user-activity/bulk")
+async def get_users_activity(data: dict):
+    try:
+        tokens = data.get('tokens')
+        if not isinstance(tokens, list):
+            raise HTTPException(status_code=400, detail="Missing required fields")
+
+        values = redis_client.mget([f"user_activity:{token}" for token in tokens]) if tokens else []
+        return {"last_active": {token: int(value) for token, value in zip(tokens, values) if value}}
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
 @app.post("/api/user-activity")
 async def update_user_activity(data: dict):
     try:
@@ -248,8 +303,12 @@ async def save_product_updates(data: dict):
         if not all([user_token, updates]):
             raise HTTPException(status_code=400, detail="Missing required fields")
 
-        updates_key = f"product_updates:{user_token}"
-        redis_client.setex(updates_key, 600, json.dumps(updates))
+        # По полю на товар: следующая отправка дополняет ещё не забранные расширением обновления, а не затирает их
+        updates_key = f"product_updates_by_url:{user_token}"
+        pipe = redis_client.pipeline(transaction=True)
+        pipe.hset(updates_key, mapping={update['product_url']: json.dumps(update) for update in updates})
+        pipe.expire(updates_key, 600)
+        pipe.execute()
         logging.info(f"Successfully saved updates to Redis with key {updates_key}")
         return {"status": "success", "message": "Updates saved"}
     except Exception as e:
@@ -259,16 +318,19 @@ async def save_product_updates(data: dict):
 @app.get("/api/product-updates/{token}")
 async def get_product_updates(token: str):
     try:
-        updates_key = f"product_updates:{token}"
-        updates_data = redis_client.get(updates_key)
-
-        if not updates_data:
-            return {"updates": []}
+        updates_key = f"product_updates_by_url:{token}"
+        legacy_key = f"product_updates:{token}"
+        pipe = redis_client.pipeline(transaction=True)
+        pipe.hgetall(updates_key)
+        pipe.get(legacy_key)
+        pipe.delete(updates_key, legacy_key)
+        updates_data, legacy_data, _ = pipe.execute()
 
-        updates = json.loads(updates_data)
-        redis_client.delete(updates_key)
+        # Обновления, сохранённые до перехода на хеш, лежат одной строкой
+        updates = {update['product_url']: update for update in json.loads(legacy_data or '[]')}
+        updates.update((url, json.loads(value)) for url, value in updates_data.items())
 
-        return {"updates": updates}
+        return {"updates": list(updates.values())}
 
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -276,9 +338,13 @@ async def get_product_updates(token: str):
 @app.get("/api/price-history/{product_url}")
 async def get_price_history(product_url: str):
     try:
-        history_key = f"price_history:{product_url}"
+        history_key = f"price_history:{canonical_product_key(product_url)}"
         history_data = redis_client.lrange(history_key, 0, -1)
 
+        if not history_data:
+            # История, записанная до перехода на канонические ключи, лежит под исходным URL
+            history_data = redis_client.lrange(f"price_history:{product_url}", 0, -1)
+
         if not history_data:
             return {"history": []}
 
@@ -0,0 +1,142 @@
+"""Бенчмарк парсера цен на сохранённых страницах Ozon, Яндекс.Маркета и ответах API Wildberries.
+
+Запуск из корня репозитория:
+    python -m benchmarks.bench_parser                      # отчёт
+    python -m benchmarks.bench_parser --save-baseline      # сохранить эталон
+    python -m benchmarks.bench_parser --max-regression 15  # сравнить с эталоном, код 1 при регрессии
+    python -m benchmarks.bench_parser --check              # то же для CI: без эталона тоже код 1
+"""
+import argparse
+import json
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Callable, Dict, List
+from bs4 import BeautifulSoup
+from bot.services.extraction import (
+    HTML_PARSER, extract_price, extract_price_from_html, extract_structured_price_from_html, parse_wb_products
+)
+
+FIXTURES_DIR = Path(__file__).parent / 'fixtures'
+DEFAULT_BASELINE = Path(__file__).parent / 'baseline.json'
+HTML_FIXTURES = {
+    'ozon': 'ozon_product.html',
+    'yandex_market': 'yandex_market_product.html'
+}
+
+
+def load_fixtures() -> Dict:
+    selectors = json.loads((FIXTURES_DIR / 'selectors.json').read_text(encoding='utf-8'))
+    pages = {
+        marketplace: (FIXTURES_DIR / name).read_text(encoding='utf-8')
+        for marketplace, name in HTML_FIXTURES.items()
+    }
+    return {
+        'pages': pages,
+        'selectors': {
+            marketplace: [selector_set['price'] for selector_set in selectors[marketplace]]
+            for marketplace in pages
+        },
+        'wb_raw': (FIXTURES_DIR / 'wb_cards_detail.json').read_text(encoding='utf-8')
+    }
+
+
+def build_cases(fixtures: Dict) -> Dict[str, Callable[[], object]]:
+    cases = {}
+    price_texts = ['24 990 ₽', '1\xa0299,50 ₽', '8 490 ₽ с Яндекс Пэй, без: 8 990 ₽', 'Нет в наличии']
+
+    cases['extract_price'] = lambda: [extract_price(text) for text in price_texts]
+    cases['wb_json'] = lambda: parse_wb_products(json.loads(fixtures['wb_raw']))
+
+    for marketplace, html in fixtures['pages'].items():
+        selectors = fixtures['selectors'][marketplace]
+        soup = BeautifulSoup(html, HTML_PARSER)
+
+        cases[f'html_parse[{marketplace}]'] = lambda html=html: BeautifulSoup(html, HTML_PARSER)
+        cases[f'selector_match[{marketplace}]'] = lambda soup=soup, selectors=selectors: [
+            extract_price(element.text) for selector in selectors if (element := soup.select_one(selector))
+        ]
+        cases[f'structured[{marketplace}]'] = lambda html=html: extract_structured_price_from_html(html)
+        cases[f'full_extract[{marketplace}]'] = lambda html=html, selectors=selectors: extract_price_from_html(html, selectors)
+
+    return cases
+
+
+def measure(func: Callable[[], object], min_time: float) -> Dict[str, float]:
+    func()
+    iterations = 0
+    start = time.perf_counter()
+    while True:
+        func()
+        iterations += 1
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time:
+            break
+
+    # Аллокации меряем отдельным прогоном: tracemalloc сильно замедляет код
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        'ops_per_sec': iterations / elapsed,
+        'peak_kb': peak / 1024
+    }
+
+
+def compare(results: Dict, baseline: Dict, max_regression: float) -> List[str]:
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        drop = (1 - result['ops_per_sec'] / baseline[name]['ops_per_sec']) * 100
+        if drop > max_regression:
+            regressions.append(f"{name}: throughput -{drop:.1f}% (limit {max_regression}%)")
+        growth = (result['peak_kb'] / baseline[name]['peak_kb'] - 1) * 100 if baseline[name]['peak_kb'] else 0
+        if growth > max_regression:
+            regressions.append(f"{name}: peak memory +{growth:.1f}% (limit {max_regression}%)")
+    return regressions
+
+
+def main(argv=None) -> int:
+    arg_parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    arg_parser.add_argument('--baseline', type=Path, default=DEFAULT_BASELINE)
+    arg_parser.add_argument('--save-baseline', action='store_true')
+    arg_parser.add_argument('--max-regression', type=float, default=20.0, help='допустимое ухудшение, %%')
+    arg_parser.add_argument('--min-time', type=float, default=0.5, help='время на каждый замер, секунды')
+    arg_parser.add_argument('--filter', default='', help='запускать только замеры с этой подстрокой')
+    arg_parser.add_argument('--check', action='store_true',
+                            help='завершиться с кодом 1, если эталона или записи для замера в нём нет')
+    args = arg_parser.parse_args(argv)
+
+    cases = {name: func for name, func in build_cases(load_fixtures()).items() if args.filter in name}
+    results = {}
+    print(f"HTML parser: {HTML_PARSER}")
+    print(f"{'benchmark':<32}{'ops/sec':>12}{'peak KB':>12}")
+    for name, func in cases.items():
+        results[name] = measure(func, args.min_time)
+        print(f"{name:<32}{results[name]['ops_per_sec']:>12.1f}{results[name]['peak_kb']:>12.1f}")
+
+    if args.save_baseline:
+        args.baseline.write_text(json.dumps(results, indent=2), encoding='utf-8')
+        print(f"Baseline saved to {args.baseline}")
+        return 0
+
+    if not args.baseline.exists():
+        print(f"No baseline at {args.baseline}, run with --save-baseline to create one")
+        return 1 if args.check else 0
+
+    baseline = json.loads(args.baseline.read_text(encoding='utf-8'))
+    regressions = compare(results, baseline, args.max_regression)
+    if args.check:
+        # Замер без записи в эталоне в режиме проверки не должен проходить молча
+        regressions += [f"{name}: no baseline entry" for name in results if name not in baseline]
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,4 +1,5 @@
 from .parser import PriceParser
 from .price_checker import PriceChecker
 from .notification_service import NotificationService
+from .notification_dispatcher import NotificationDispatcher
 from .session_manager import SessionManager
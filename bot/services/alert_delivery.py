@@ -0,0 +1,97 @@
+import asyncio
+import logging
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError
+from config.settings import settings
+
+
+class AlertDelivery:
+    """Доставка уведомлений из outbox в Redis Stream alert_outbox.
+
+    Сообщение подтверждается только после успешной отправки. Неподтверждённые
+    сообщения, в том числе оставшиеся от упавшего процесса, забираются повторно
+    через OUTBOX_RETRY_IDLE секунд, кроме тех, что этот процесс ещё доставляет.
+    После OUTBOX_MAX_DELIVERIES попыток сообщение переносится в alert_outbox_dead.
+    """
+
+    def __init__(self, redis_client, notification_service, consumer_name: str):
+        self.redis_client = redis_client
+        self.notification_service = notification_service
+        self.consumer_name = consumer_name
+        self.batch_size = settings.OUTBOX_BATCH_SIZE
+        self.retry_idle = settings.OUTBOX_RETRY_IDLE
+        self.max_inflight = settings.OUTBOX_MAX_INFLIGHT
+        self.max_deliveries = settings.OUTBOX_MAX_DELIVERIES
+        self._inflight_ids = set()
+        self.retry_interval = 60
+
+    async def _deliver(self, alert: dict) -> bool:
+        try:
+            await self.notification_service.deliver_price_alert(**alert)
+            logging.info(f"Price alert sent for user {alert['user_id']}, product: {alert['product_title']}")
+            return True
+        except (TelegramForbiddenError, TelegramBadRequest) as e:
+            # Бот заблокирован или чат удалён — повтор не поможет, снимаем сообщение с очереди
+            logging.warning(f"Dropping price alert for user {alert['user_id']}: {e}")
+            return True
+        except Exception as e:
+            logging.error(f"Error sending price alert to user {alert['user_id']}, will retry: {e}")
+            return False
+
+    async def _fetch(self, block_ms: int) -> list:
+        claimed = await self.redis_client.claim_stale_outbox(
+            self.consumer_name, self.retry_idle * 1000, self.batch_size, exclude=self._inflight_ids
+        )
+        messages = []
+        dead = []
+        for message_id, alert, deliveries in claimed:
+            (dead if deliveries >= self.max_deliveries else messages).append((message_id, alert))
+        if dead:
+            logging.error(f"Moving {len(dead)} price alerts to dead letters after {self.max_deliveries} attempts")
+            await self.redis_client.dead_letter_outbox(dead)
+
+        if len(messages) < self.batch_size:
+            messages += await self.redis_client.read_outbox(self.consumer_name, self.batch_size - len(messages), block_ms)
+        self._inflight_ids.update(message_id for message_id, _ in messages)
+        return messages
+
+    async def _deliver_batch(self, messages: list) -> int:
+        try:
+            delivered = await asyncio.gather(*(self._deliver(alert) for _, alert in messages))
+            await self.redis_client.ack_outbox([message_id for (message_id, _), ok in zip(messages, delivered) if ok])
+            return sum(delivered)
+        finally:
+            self._inflight_ids.difference_update(message_id for message_id, _ in messages)
+
+    async def deliver_once(self, block_ms: int = 5000) -> int:
+        messages = await self._fetch(block_ms)
+        return await self._deliver_batch(messages) if messages else 0
+
+    async def _run_batch(self, messages: list, inflight: asyncio.Semaphore):
+        try:
+            await self._deliver_batch(messages)
+        except Exception as e:
+            logging.error(f"Error delivering alert batch: {e}", exc_info=True)
+        finally:
+            inflight.release()
+
+    async def run(self):
+        await self.redis_client.ensure_outbox_group()
+        # Пачки доставляются параллельно: пока одна ждёт окна сводки или лимитов Telegram, читаем следующую
+        inflight = asyncio.Semaphore(self.max_inflight)
+        tasks = set()
+        while True:
+            await inflight.acquire()
+            try:
+                messages = await self._fetch(5000)
+            except Exception as e:
+                inflight.release()
+                logging.error(f"Error reading alert outbox: {e}", exc_info=True)
+                await asyncio.sleep(self.retry_interval)
+                continue
+
+            if not messages:
+                inflight.release()
+                continue
+            task = asyncio.create_task(self._run_batch(messages, inflight))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
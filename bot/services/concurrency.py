@@ -0,0 +1,98 @@
+import asyncio
+import logging
+import time
+from contextlib import asynccontextmanager
+from typing import Dict
+from config.settings import settings
+
+
+class AdaptiveLimiter:
+    """Лимит параллельных запросов к одному маркетплейсу (AIMD).
+
+    `acquire()` отдаёт время начала запроса, а исход вызывающий сообщает сам:
+    `record_success` после полученной цены, `record_throttle` при 429, капче или
+    таймауте. Лимит растёт на единицу после каждых `limit` быстрых успешных
+    запросов подряд и уменьшается вдвое при троттлинге, но не чаще одного раза
+    на волну запросов, начатых до предыдущего снижения.
+    """
+
+    def __init__(self, name: str, initial: int = 5, minimum: int = 1, maximum: int = 20, target_latency: float = 10.0):
+        self.name = name
+        self.limit = max(minimum, min(initial, maximum))
+        self.minimum = minimum
+        self.maximum = maximum
+        self.target_latency = target_latency
+        self.active = 0
+        self._condition = asyncio.Condition()
+        self._healthy_streak = 0
+        self._last_throttle = 0.0
+        self._successes = 0
+        self._throttles = 0
+
+    @asynccontextmanager
+    async def acquire(self):
+        async with self._condition:
+            await self._condition.wait_for(lambda: self.active < self.limit)
+            self.active += 1
+        try:
+            yield time.monotonic()
+        finally:
+            async with self._condition:
+                self.active -= 1
+                self._condition.notify_all()
+
+    def record_success(self, started_at: float):
+        self._successes += 1
+        # Запросы, начатые до последнего троттлинга, не повод снова разгоняться
+        if started_at < self._last_throttle or time.monotonic() - started_at > self.target_latency:
+            self._healthy_streak = 0
+            return
+        self._healthy_streak += 1
+        if self._healthy_streak >= self.limit and self.limit < self.maximum:
+            self.limit += 1
+            self._healthy_streak = 0
+            logging.info(f"Concurrency limit for {self.name} raised to {self.limit}")
+
+    def record_throttle(self, reason: str, started_at: float = None):
+        self._throttles += 1
+        self._healthy_streak = 0
+        # Ответы запросов, ушедших до прошлого снижения, уже учтены этим снижением:
+        # иначе пачка одновременных 429 обрушила бы лимит до минимума
+        if started_at is not None and started_at < self._last_throttle:
+            return
+        self._last_throttle = time.monotonic()
+        new_limit = max(self.minimum, self.limit // 2)
+        if new_limit != self.limit:
+            self.limit = new_limit
+            logging.warning(f"Concurrency limit for {self.name} lowered to {self.limit}: {reason}")
+
+    def metrics(self) -> Dict[str, int]:
+        return {
+            'limit': self.limit,
+            'active': self.active,
+            'successes': self._successes,
+            'throttles': self._throttles
+        }
+
+
+class HostLimiters:
+    def __init__(self):
+        self._limiters: Dict[str, AdaptiveLimiter] = {}
+
+    def get(self, host: str) -> AdaptiveLimiter:
+        if host not in self._limiters:
+            self._limiters[host] = AdaptiveLimiter(
+                host,
+                initial=settings.HOST_CONCURRENCY_INITIAL,
+                minimum=settings.HOST_CONCURRENCY_MIN,
+                maximum=settings.HOST_CONCURRENCY_MAX,
+                target_latency=settings.HOST_TARGET_LATENCY
+            )
+        return self._limiters[host]
+
+    def metrics(self) -> Dict[str, Dict[str, int]]:
+        return {host: limiter.metrics() for host, limiter in self._limiters.items()}
+
+
+# Общие на процесс лимиты: все батчи и все экземпляры парсера делят одну квоту на маркетплейс
+host_limiters = HostLimiters()
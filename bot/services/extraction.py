@@ -0,0 +1,158 @@
+import html as html_lib
+import json
+import logging
+import re
+from typing import Dict, Iterable, List, Optional
+from bs4 import BeautifulSoup
+
+try:
+    import lxml  # noqa: F401
+    HTML_PARSER = 'lxml'
+except ImportError:
+    HTML_PARSER = 'html.parser'
+
+DISCOUNT_PRICE_RE = re.compile(r'без:.*?(\d[\d\s]*[.,]?\d*)\s*₽')
+NON_PRICE_CHARS_RE = re.compile(r'[^\d.,]')
+PRICE_RE = re.compile(r'\d+[.,]?\d*')
+
+# Признаки страниц капчи и антибот-защиты, после которых нужен настоящий браузер
+ANTI_BOT_URL_MARKERS = ('showcaptcha', 'captcha-api', '/abt/')
+ANTI_BOT_PAGE_MARKERS = ('smartcaptcha', 'showcaptcha', 'Доступ ограничен', 'abt-challenge', 'cf-challenge', 'Подтвердите, что запросы отправляли вы')
+
+
+def extract_price(text: str) -> Optional[float]:
+    if not text:
+        return None
+
+    if 'без:' in text:
+        # Извлекаем первую цену после 'без:'
+        match = DISCOUNT_PRICE_RE.search(text)
+        if match:
+            clean_text = match.group(1).replace('\xa0', '').replace('\u2009', '')
+            try:
+                price_str = NON_PRICE_CHARS_RE.sub('', clean_text).replace(',', '.')
+                price = float(price_str)
+                return price if price > 0 else None
+            except (ValueError, TypeError):
+                return None
+        return None
+
+    clean_text = NON_PRICE_CHARS_RE.sub('', text.replace('\xa0', '').replace('\u2009', ''))
+    match = PRICE_RE.search(clean_text)
+    if match:
+        try:
+            price_str = match.group(0).replace(',', '.')
+            price = float(price_str)
+            return price if price > 0 else None
+        except (ValueError, TypeError):
+            return None
+    return None
+
+
+JSON_LD_RE = re.compile(r'<script[^>]+type=["\']application/ld\+json["\'][^>]*>(.*?)</script>', re.S | re.I)
+MICRODATA_PRICE_TAG_RE = re.compile(r'<[^>]+itemprop=["\']price["\'][^>]*>', re.I)
+CONTENT_ATTR_RE = re.compile(r'content=["\']([^"\']+)["\']', re.I)
+# Блок цены Ozon: <div id="state-webPrice-..." data-state='{"price":"1 124 ₽","cardPrice":"1 079 ₽",...}'>
+OZON_PRICE_STATE_RE = re.compile(r'id=["\']state-webPrice[^"\']*["\'][^>]*?data-state=(["\'])(.*?)\1', re.S)
+
+
+def _iter_offers(node) -> Iterable[dict]:
+    if isinstance(node, list):
+        for item in node:
+            yield from _iter_offers(item)
+    elif isinstance(node, dict):
+        if 'offers' in node:
+            offers = node['offers']
+            yield from (offers if isinstance(offers, list) else [offers])
+        if '@graph' in node:
+            yield from _iter_offers(node['@graph'])
+
+
+def price_from_json_ld(blobs: List[str]) -> Optional[float]:
+    for blob in blobs:
+        try:
+            data = json.loads(blob)
+        except (ValueError, TypeError):
+            continue
+        for offer in _iter_offers(data):
+            if not isinstance(offer, dict):
+                continue
+            for field in ('price', 'lowPrice'):
+                if price := extract_price(str(offer.get(field) or '')):
+                    return price
+    return None
+
+
+def price_from_microdata(values: List[str]) -> Optional[float]:
+    return extract_price_from_texts(values)
+
+
+def price_from_page_state(states: List[str]) -> Optional[float]:
+    for state in states:
+        try:
+            data = json.loads(state)
+        except (ValueError, TypeError):
+            continue
+        # Как и для селекторов, берём цену без карты маркетплейса
+        for field in ('price', 'cardPrice'):
+            if price := extract_price(str(data.get(field) or '')):
+                return price
+    return None
+
+
+def extract_structured_price(json_ld: List[str], microdata: List[str], states: List[str]) -> Optional[float]:
+    return price_from_page_state(states) or price_from_json_ld(json_ld) or price_from_microdata(microdata)
+
+
+def extract_structured_price_from_html(html: str) -> Optional[float]:
+    json_ld = JSON_LD_RE.findall(html)
+    microdata = []
+    for tag in MICRODATA_PRICE_TAG_RE.findall(html):
+        if match := CONTENT_ATTR_RE.search(tag):
+            microdata.append(match.group(1))
+    states = [html_lib.unescape(match[1]) for match in OZON_PRICE_STATE_RE.findall(html)]
+    return extract_structured_price(json_ld, microdata, states)
+
+
+def is_anti_bot_page(url: str, html: str) -> bool:
+    if any(marker in url for marker in ANTI_BOT_URL_MARKERS):
+        return True
+    return any(marker in html for marker in ANTI_BOT_PAGE_MARKERS)
+
+
+def extract_price_from_texts(texts: List[Optional[str]]) -> Optional[float]:
+    for text in texts:
+        if price := extract_price(text):
+            return price
+    return None
+
+
+def extract_price_from_html(html: str, price_selectors: List[str]) -> Optional[float]:
+    if price := extract_structured_price_from_html(html):
+        return price
+
+    # Один разбор документа на все наборы селекторов
+    soup = BeautifulSoup(html, HTML_PARSER)
+    for selector in price_selectors:
+        try:
+            if element := soup.select_one(selector):
+                if price := extract_price(element.text):
+                    return price
+        except Exception as e:
+            logging.error(f"Error with selector {selector}: {e}")
+    return None
+
+
+def wb_product_price(product: dict) -> float:
+    if price := product.get('salePriceU'):
+        return price / 100
+    # В новых ответах API цена лежит в размерах товара
+    for size in product.get('sizes') or []:
+        if price := (size.get('price') or {}).get('product'):
+            return price / 100
+    return 0.0
+
+
+def parse_wb_products(data: dict) -> Dict[str, float]:
+    products = (data or {}).get('data', {}).get('products', [])
+    return {str(product.get('id')): wb_product_price(product) for product in products}
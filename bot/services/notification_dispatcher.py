@@ -0,0 +1,192 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Deque, Dict, Optional
+from aiogram import Bot
+from aiogram.exceptions import TelegramNetworkError, TelegramRetryAfter
+from config.settings import settings
+
+
+class TokenBucket:
+    """Ведро токенов: не больше `rate` операций в секунду с всплесками до `capacity`."""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self):
+        # Ожидающие встают в очередь на блокировке, поэтому токены выдаются по порядку
+        async with self._lock:
+            self._refill()
+            while self.tokens < 1:
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+                self._refill()
+            self.tokens -= 1
+
+    def try_acquire(self) -> float:
+        # Не ждёт: забирает токен и возвращает 0 или сообщает, через сколько секунд он появится
+        if self._lock.locked():
+            return 1 / self.rate
+        self._refill()
+        if self.tokens < 1:
+            return (1 - self.tokens) / self.rate
+        self.tokens -= 1
+        return 0.0
+
+    def is_full(self) -> bool:
+        self._refill()
+        return self.tokens >= self.capacity and not self._lock.locked()
+
+
+class NotificationDispatcher:
+    """Очередь сообщений в Telegram с пулом воркеров.
+
+    Отправка ограничена общим лимитом бота и лимитом на каждый чат, а при
+    RetryAfter все воркеры ждут указанное Telegram время и повторяют сообщение.
+    Сообщения в чат, исчерпавший свой лимит, откладываются по порядку до
+    появления токена, а воркер тем временем берёт следующие сообщения.
+    """
+
+    def __init__(self, bot: Bot, workers: int = None, global_rate: float = None, chat_rate: float = None,
+                 max_retries: int = 3, queue_size: int = None):
+        self.bot = bot
+        self.workers = workers or settings.NOTIFY_WORKERS
+        self.chat_rate = chat_rate or settings.TELEGRAM_CHAT_RATE
+        self.max_retries = max_retries
+        global_rate = global_rate or settings.TELEGRAM_GLOBAL_RATE
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.chat_buckets: Dict[int, TokenBucket] = {}
+        self.queue_size = queue_size or settings.NOTIFY_QUEUE_SIZE
+        # Ограничение размера проверяет submit: отложенные сообщения возвращаются в очередь без ожидания
+        self.queue = asyncio.Queue()
+        self.deferred: Dict[int, Deque[tuple]] = {}
+        self._deferred_timers: Dict[int, asyncio.TimerHandle] = {}
+        self._tasks = []
+        self._paused_until = 0.0
+        self._stats = {'sent': 0, 'failed': 0, 'retries': 0, 'dropped': 0}
+        self._latency_total = 0.0
+        self._latency_max = 0.0
+
+    def start(self):
+        if not self._tasks:
+            self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+            logging.info(f"Notification dispatcher started with {self.workers} workers")
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        for timer in self._deferred_timers.values():
+            timer.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._deferred_timers = {}
+
+    def submit(self, chat_id: int, text: str, **kwargs) -> asyncio.Future:
+        # Не ждёт отправки: результат придёт в future, когда до сообщения дойдёт очередь
+        future = asyncio.get_running_loop().create_future()
+        # Ошибка уже залогирована воркером, ждать результат вызывающему не обязательно
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        if self._depth() < self.queue_size:
+            self.queue.put_nowait((chat_id, text, kwargs, future, time.monotonic()))
+        else:
+            self._stats['dropped'] += 1
+            logging.error(f"Notification queue is full, message to {chat_id} dropped")
+            future.set_exception(RuntimeError("Notification queue is full"))
+        return future
+
+    def _chat_bucket(self, chat_id: int) -> TokenBucket:
+        if chat_id not in self.chat_buckets:
+            if len(self.chat_buckets) >= 10000:
+                # Вёдра простаивающих чатов полные, их можно пересоздать при следующем сообщении
+                self.chat_buckets = {
+                    chat: bucket for chat, bucket in self.chat_buckets.items() if not bucket.is_full()
+                }
+            self.chat_buckets[chat_id] = TokenBucket(self.chat_rate, 1)
+        return self.chat_buckets[chat_id]
+
+    def _depth(self) -> int:
+        return self.queue.qsize() + sum(len(messages) for messages in self.deferred.values())
+
+    def _defer(self, item: tuple, delay: float = None):
+        # Пока у чата есть отложенные сообщения, новые встают за ними, чтобы не нарушить порядок
+        chat_id = item[0]
+        self.deferred.setdefault(chat_id, deque()).append(item)
+        if delay is not None:
+            self._deferred_timers[chat_id] = asyncio.get_running_loop().call_later(delay, self._release, chat_id)
+
+    def _release(self, chat_id: int):
+        self._deferred_timers.pop(chat_id, None)
+        for item in self.deferred.pop(chat_id, ()):
+            self.queue.put_nowait(item)
+
+    async def _worker(self):
+        while True:
+            item = await self.queue.get()
+            chat_id, text, kwargs, future, enqueued_at = item
+            try:
+                if chat_id in self.deferred:
+                    self._defer(item)
+                    continue
+                if (wait := self._chat_bucket(chat_id).try_acquire()) > 0:
+                    self._defer(item, wait)
+                    continue
+
+                message = await self._send(chat_id, text, kwargs)
+                latency = time.monotonic() - enqueued_at
+                self._stats['sent'] += 1
+                self._latency_total += latency
+                self._latency_max = max(self._latency_max, latency)
+                if not future.done():
+                    future.set_result(message)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self._stats['failed'] += 1
+                logging.error(f"Ошибка при отправке уведомления пользователю {chat_id}: {e}")
+                if not future.done():
+                    future.set_exception(e)
+            finally:
+                self.queue.task_done()
+
+    async def _send(self, chat_id: int, text: str, kwargs: dict):
+        # Токен чата для первой попытки воркер уже взял
+        attempt = 0
+        while True:
+            if attempt:
+                await self._chat_bucket(chat_id).acquire()
+            await self.global_bucket.acquire()
+            if (pause := self._paused_until - time.monotonic()) > 0:
+                await asyncio.sleep(pause)
+
+            try:
+                return await self.bot.send_message(chat_id=chat_id, text=text, **kwargs)
+            except (TelegramRetryAfter, TelegramNetworkError) as e:
+                # Остальные ошибки (бот заблокирован, чат не найден) повтором не исправить
+                attempt += 1
+                if attempt > self.max_retries:
+                    raise
+                self._stats['retries'] += 1
+                if isinstance(e, TelegramRetryAfter):
+                    # Флуд-контроль общий для бота: останавливаем всех воркеров, а не только этот
+                    self._paused_until = max(self._paused_until, time.monotonic() + e.retry_after)
+                    logging.warning(f"Telegram asked to retry after {e.retry_after}s (chat {chat_id})")
+                else:
+                    await asyncio.sleep(attempt)
+
+    def metrics(self) -> Dict[str, Optional[float]]:
+        sent = self._stats['sent']
+        return {
+            **self._stats,
+            'queue_depth': self._depth(),
+            'avg_latency': self._latency_total / sent if sent else None,
+            'max_latency': self._latency_max if sent else None
+        }
@@ -1,19 +1,121 @@
 from aiogram import Bot
+import asyncio
 import logging
+from typing import Dict, List, Optional, Tuple
+from bot.services.notification_dispatcher import NotificationDispatcher
+from config.settings import settings
+
+# Максимальная длина текста одного сообщения в Telegram
+TELEGRAM_MESSAGE_LIMIT = 4096
+DIGEST_TITLE_LIMIT = 200
 
 class NotificationService:
-    def __init__(self, bot: Bot):
+    def __init__(self, bot: Bot, dispatcher: Optional[NotificationDispatcher] = None, digest_window: float = None):
         self.bot = bot
+        self.dispatcher = dispatcher
+        self.digest_window = settings.ALERT_DIGEST_WINDOW if digest_window is None else digest_window
+        self._digests: Dict[int, list] = {}
+        self._flush_tasks = set()
 
-    async def send_price_alert(self, user_id: int, product_title: str, current_price: float, target_price: float, product_url: str):
-        message = (
+    def format_price_alert(self, product_title: str, current_price: float, target_price: float, product_url: str) -> str:
+        return (
             f"🎉 Цена на <b>{product_title}</b> снизилась!\n\n"
             f"Текущая цена: {current_price}₽\n"
             f"Целевая цена: {target_price}₽\n\n"
             f"Ссылка на товар: {product_url}"
         )
+
+    def format_digest(self, alerts: List[dict]) -> List[str]:
+        return [message for message, _ in self._digest_parts(alerts)]
+
+    def _digest_parts(self, alerts: List[dict]) -> List[Tuple[str, int]]:
+        # Одна сводка на несколько товаров; если не влезает в лимит Telegram, делим на несколько сообщений.
+        # Для каждого сообщения возвращаем, сколько уведомлений по порядку в него вошло
+        if len(alerts) == 1:
+            return [(self.format_price_alert(**alerts[0]), 1)]
+
+        header = f"🎉 Снизились цены на {len(alerts)} товаров!\n\n"
+        parts = []
+        current = header
+        count = 0
+        for alert in alerts:
+            title = alert['product_title']
+            if len(title) > DIGEST_TITLE_LIMIT:
+                title = title[:DIGEST_TITLE_LIMIT - 1] + '…'
+            block = (
+                f"<b>{title}</b>\n"
+                f"Текущая цена: {alert['current_price']}₽ (цель {alert['target_price']}₽)\n"
+                f"{alert['product_url']}\n\n"
+            )
+            if len(current) + len(block) > TELEGRAM_MESSAGE_LIMIT and current != header:
+                parts.append((current.rstrip(), count))
+                current = ''
+                count = 0
+            current += block
+            count += 1
+        parts.append((current.rstrip(), count))
+        return parts
+
+    async def _send(self, user_id: int, message: str):
+        if self.dispatcher:
+            await self.dispatcher.submit(user_id, message, parse_mode='HTML')
+        else:
+            await self.bot.send_message(chat_id=user_id, text=message, parse_mode='HTML')
+
+    async def send_price_alert(self, user_id: int, product_title: str, current_price: float, target_price: float,
+                               product_url: str) -> Optional[asyncio.Future]:
+        message = self.format_price_alert(product_title, current_price, target_price, product_url)
+        if self.dispatcher:
+            # Сообщение встаёт в очередь диспетчера, проверка цен не ждёт Telegram
+            return self.dispatcher.submit(user_id, message, parse_mode='HTML')
+
         try:
             await self.bot.send_message(chat_id=user_id, text=message, parse_mode='HTML')
             logging.info(f"Уведомление отправлено пользователю {user_id} о продукте '{product_title}'")
         except Exception as e:
-            logging.error(f"Ошибка при отправке уведомления пользователю {user_id}: {e}")
\ No newline at end of file
+            logging.error(f"Ошибка при отправке уведомления пользователю {user_id}: {e}")
+
+    async def deliver_price_alert(self, user_id: int, product_title: str, current_price: float, target_price: float,
+                                  product_url: str):
+        # В отличие от send_price_alert дожидается отправки и пробрасывает ошибку, чтобы outbox повторил попытку
+        alert = {
+            'product_title': product_title,
+            'current_price': current_price,
+            'target_price': target_price,
+            'product_url': product_url
+        }
+        if not self.digest_window:
+            await self._send(user_id, self.format_price_alert(**alert))
+            return
+
+        # Уведомления пользователю, пришедшие в течение окна, уходят одной сводкой
+        future = asyncio.get_running_loop().create_future()
+        if user_id not in self._digests:
+            self._digests[user_id] = []
+            task = asyncio.create_task(self._flush_digest(user_id))
+            self._flush_tasks.add(task)
+            task.add_done_callback(self._flush_tasks.discard)
+        self._digests[user_id].append((alert, future))
+        await future
+
+    async def _flush_digest(self, user_id: int):
+        await asyncio.sleep(self.digest_window)
+        entries = self._digests.pop(user_id)
+        sent = 0
+        for message, count in self._digest_parts([alert for alert, _ in entries]):
+            part, entries = entries[:count], entries[count:]
+            # Каждая часть сводки подтверждает только свои уведомления: outbox повторит лишь неотправленные
+            try:
+                await self._send(user_id, message)
+                sent += count
+                error = None
+            except Exception as e:
+                error = e
+            for _, future in part:
+                if future.done():
+                    continue
+                if error:
+                    future.set_exception(error)
+                else:
+                    future.set_result(None)
+        logging.info(f"Сводка: отправлено {sent} уведомлений пользователю {user_id}")
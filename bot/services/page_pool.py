@@ -0,0 +1,156 @@
+import asyncio
+import logging
+import time
+from contextlib import asynccontextmanager
+from typing import Callable, Dict, Optional
+from playwright.async_api import Browser, BrowserContext, Page, Route
+
+CONTEXT_OPTIONS = {
+    'viewport': {'width': 1920, 'height': 1080},
+    'user_agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) Chrome/119.0.0.0 Safari/537.36'
+}
+
+INIT_SCRIPT = """
+    Object.defineProperty(navigator, 'webdriver', { get: () => undefined });
+"""
+
+JS_HEAP_SCRIPT = "() => (performance.memory ? performance.memory.usedJSHeapSize : 0)"
+
+
+class PooledPage:
+    def __init__(self, context: BrowserContext, page: Page):
+        self.context = context
+        self.page = page
+        self.navigations = 0
+        self.marketplace: Optional[str] = None
+        self.block_resources = False
+
+
+class PagePool:
+    """Ограниченный пул прогретых вкладок Chromium, каждая в своём контексте.
+
+    Вкладка пересоздаётся после max_navigations переходов или когда её
+    JS-heap превышает max_memory_mb. Если передан request_filter, на контекст
+    ставится перехватчик запросов, который отбрасывает лишние ресурсы для
+    вкладок, выданных с block_resources=True.
+    """
+
+    def __init__(self, browser: Browser, size: int = 5, max_navigations: int = 50, max_memory_mb: int = 256,
+                 request_filter: Optional[Callable[[str, str, str], bool]] = None):
+        self.browser = browser
+        self.request_filter = request_filter
+        self.size = size
+        self.max_navigations = max_navigations
+        self.max_memory_mb = max_memory_mb
+        self._idle: asyncio.Queue = asyncio.Queue()
+        self._created = 0
+        self._in_use = 0
+        self._create_lock = asyncio.Lock()
+        self._leases = 0
+        self._recycled = 0
+        self._lease_wait_total = 0.0
+        self._lease_wait_max = 0.0
+
+    async def _create_slot(self) -> PooledPage:
+        context = await self.browser.new_context(**CONTEXT_OPTIONS)
+        await context.add_init_script(INIT_SCRIPT)
+        page = await context.new_page()
+        slot = PooledPage(context, page)
+
+        if self.request_filter:
+            async def handle_route(route: Route):
+                request = route.request
+                if slot.block_resources and self.request_filter(slot.marketplace, request.resource_type, request.url):
+                    await route.abort()
+                else:
+                    await route.continue_()
+
+            await context.route("**/*", handle_route)
+
+        return slot
+
+    async def _close_slot(self, slot: PooledPage):
+        try:
+            await slot.context.close()
+        except Exception as e:
+            logging.error(f"Error closing pooled page: {e}")
+
+    async def _acquire(self) -> PooledPage:
+        while True:
+            if self._idle.empty():
+                async with self._create_lock:
+                    if self._created < self.size:
+                        self._created += 1
+                        try:
+                            return await self._create_slot()
+                        except Exception:
+                            self._created -= 1
+                            raise
+            # None вместо вкладки означает, что _release не смог её пересоздать: идём на новый круг
+            # и создаём вкладку сами (или получаем ошибку), а не ждём вечно
+            slot = await self._idle.get()
+            if slot is not None:
+                return slot
+
+    async def _needs_recycle(self, slot: PooledPage) -> bool:
+        if slot.page.is_closed():
+            return True
+        if slot.navigations >= self.max_navigations:
+            return True
+        try:
+            heap = await slot.page.evaluate(JS_HEAP_SCRIPT)
+            return heap > self.max_memory_mb * 1024 * 1024
+        except Exception:
+            return True
+
+    async def _release(self, slot: PooledPage):
+        if await self._needs_recycle(slot):
+            await self._close_slot(slot)
+            self._recycled += 1
+            try:
+                slot = await self._create_slot()
+            except Exception as e:
+                logging.error(f"Error recreating pooled page: {e}")
+                self._created -= 1
+                # Будим ожидающего в _acquire: место освободилось, пусть попробует создать вкладку сам
+                self._idle.put_nowait(None)
+                return
+        self._idle.put_nowait(slot)
+
+    @asynccontextmanager
+    async def lease(self, marketplace: Optional[str] = None, block_resources: bool = False):
+        start = time.monotonic()
+        slot = await self._acquire()
+        slot.marketplace = marketplace
+        slot.block_resources = block_resources
+        wait = time.monotonic() - start
+        self._leases += 1
+        self._lease_wait_total += wait
+        self._lease_wait_max = max(self._lease_wait_max, wait)
+        self._in_use += 1
+        try:
+            yield slot.page
+        finally:
+            slot.navigations += 1
+            self._in_use -= 1
+            await self._release(slot)
+
+    async def close(self):
+        while not self._idle.empty():
+            if slot := self._idle.get_nowait():
+                await self._close_slot(slot)
+        self._created = 0
+
+    def metrics(self) -> Dict[str, Optional[float]]:
+        return {
+            'size': self.size,
+            'created': self._created,
+            'in_use': self._in_use,
+            'idle': self._idle.qsize(),
+            'leases': self._leases,
+            'recycled': self._recycled,
+            'recycle_after_navigations': self.max_navigations,
+            'recycle_memory_mb': self.max_memory_mb,
+            'lease_wait_avg': self._lease_wait_total / self._leases if self._leases else 0.0,
+            'lease_wait_max': self._lease_wait_max
+        }
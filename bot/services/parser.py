@@ -1,15 +1,60 @@
 import aiohttp
 import asyncio
 import logging
+import multiprocessing
 import re
-from typing import Dict, List, Optional
+from collections import defaultdict
+from typing import AsyncIterator, Dict, List, Optional, Tuple
 from aiohttp import ClientTimeout, ClientSession
 from urllib.parse import urlencode
 import random
-from bs4 import BeautifulSoup
 import sys
-from playwright.async_api import async_playwright, Page, Browser
+import time
+from concurrent.futures import ProcessPoolExecutor
+from playwright.async_api import async_playwright, Page, Browser, TimeoutError as PlaywrightTimeoutError
 from datetime import datetime
+from config.settings import settings
+from bot.services.page_pool import PagePool, CONTEXT_OPTIONS
+from bot.services.request_filter import should_block_request
+from bot.services.concurrency import host_limiters
+from bot.services.extraction import (
+    extract_price, extract_price_from_html, extract_price_from_texts, extract_structured_price, is_anti_bot_page,
+    parse_wb_products
+)
+
+# Собирает структурированные данные о цене и текст первого совпадения для каждого селектора:
+# null — элемент не найден, false — селектор невалиден для querySelector
+EXTRACT_PAGE_DATA_SCRIPT = """
+    (selectors) => ({
+        jsonLd: Array.from(document.querySelectorAll('script[type="application/ld+json"]'), (s) => s.textContent),
+        microdata: Array.from(document.querySelectorAll('[itemprop="price"][content]'), (e) => e.getAttribute('content')),
+        states: Array.from(document.querySelectorAll('[id^="state-webPrice"][data-state]'), (e) => e.getAttribute('data-state')),
+        texts: selectors.map((selector) => {
+            try {
+                const element = document.querySelector(selector);
+                return element ? element.textContent : null;
+            } catch (e) {
+                return false;
+            }
+        })
+    })
+"""
+
+STATIC_FETCH_HEADERS = {
+    'User-Agent': CONTEXT_OPTIONS['user_agent'],
+    'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
+    'Accept-Language': 'ru-RU,ru;q=0.9,en;q=0.8'
+}
+
+WB_CARDS_URL = 'https://card.wb.ru/cards/detail?curr=rub&dest=-1257786&nm={ids}'
+
+# Через сколько секунд повторить запрос селекторов, если бэкенд ответил ошибкой
+SELECTORS_RETRY_INTERVAL = 30
+
+# Пользователь считается активным, если расширение отмечалось не раньше стольких секунд назад
+ACTIVITY_WINDOW = 600
+
+TIER_COUNTERS = ('http_hits', 'http_misses', 'http_blocked', 'browser_hits', 'browser_misses')
 
 logging.basicConfig(
     level=logging.INFO,
@@ -23,73 +68,164 @@ logging.basicConfig(
 class PriceParser:
     def __init__(self, api_url: str = 'http://localhost:8000'):
         self.session: Optional[ClientSession] = None
+        self.playwright = None
         self.browser: Optional[Browser] = None
-        self.context = None
+        self.page_pool: Optional[PagePool] = None
+        self.executor: Optional[ProcessPoolExecutor] = None
+        self.parser_workers = settings.PARSER_WORKERS
         self.timeout = ClientTimeout(total=30)
         self.api_url = api_url
+        self.selectors_ttl = settings.SELECTORS_CACHE_TTL
+        self._selectors_cache: Dict[str, Dict] = {}
+        self._selectors_locks: Dict[str, asyncio.Lock] = {}
+        self.resource_blocking = settings.RESOURCE_BLOCKING
+        self._navigations = 0
+        self.navigation_stats = {
+            'blocked': {'count': 0, 'total_time': 0.0},
+            'unblocked': {'count': 0, 'total_time': 0.0}
+        }
+        self.http_first = settings.HTTP_FIRST
+        self.tier_stats: Dict[str, Dict[str, int]] = defaultdict(lambda: dict.fromkeys(TIER_COUNTERS, 0))
+        self.wb_chunk_size = settings.WB_CHUNK_SIZE
+        self.wb_retries = settings.WB_RETRIES
+        self.wb_retry_backoff = settings.WB_RETRY_BACKOFF
 
     async def __aenter__(self):
         self.session = ClientSession(timeout=self.timeout)
-        playwright = await async_playwright().start()
-        self.browser = await playwright.chromium.launch(headless=True)
-        
-        self.context = await self.browser.new_context(
-            viewport={'width': 1920, 'height': 1080},
-            user_agent='Mozilla/5.0 (Windows NT 10.0; Win64; x64) Chrome/119.0.0.0 Safari/537.36'
+        if self.parser_workers > 0:
+            # fork из процесса с работающим event loop и потоками Playwright копирует их состояние
+            # (в том числе захваченные блокировки), поэтому воркеры запускаем начисто
+            start_method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+            self.executor = ProcessPoolExecutor(
+                max_workers=self.parser_workers, mp_context=multiprocessing.get_context(start_method)
+            )
+        self.playwright = await async_playwright().start()
+        self.browser = await self.playwright.chromium.launch(headless=True)
+        self.page_pool = PagePool(
+            self.browser,
+            size=settings.PAGE_POOL_SIZE,
+            max_navigations=settings.PAGE_MAX_NAVIGATIONS,
+            max_memory_mb=settings.PAGE_MAX_MEMORY_MB,
+            request_filter=should_block_request if self.resource_blocking != 'off' else None
         )
         
-        await self.context.add_init_script("""
-            Object.defineProperty(navigator, 'webdriver', { get: () => undefined });
-        """)
-        
         return self
 
     async def __aexit__(self, exc_type, exc_val, exc_tb):
         if self.session:
             await self.session.close()
-        if self.context:
-            await self.context.close()
+        if self.page_pool:
+            await self.page_pool.close()
         if self.browser:
             await self.browser.close()
+        if self.playwright:
+            await self.playwright.stop()
+        if self.executor:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+
+    def get_metrics(self) -> Dict[str, Dict]:
+        navigation = {}
+        for mode, stats in self.navigation_stats.items():
+            navigation[mode] = {
+                'count': stats['count'],
+                'avg_load_time': stats['total_time'] / stats['count'] if stats['count'] else 0.0
+            }
+        tiers = {}
+        for marketplace, stats in self.tier_stats.items():
+            http_total = stats['http_hits'] + stats['http_misses']
+            browser_total = stats['browser_hits'] + stats['browser_misses']
+            tiers[marketplace] = {
+                **stats,
+                'http_hit_rate': stats['http_hits'] / http_total if http_total else 0.0,
+                'browser_hit_rate': stats['browser_hits'] / browser_total if browser_total else 0.0
+            }
+        return {
+            'page_pool': self.page_pool.metrics() if self.page_pool else {},
+            'navigation': navigation,
+            'tiers': tiers,
+            'concurrency': host_limiters.metrics()
+        }
+
+    def _marketplace_for(self, url: str) -> str:
+        return 'ozon' if 'ozon.ru' in url else 'yandex_market'
+
+    def _should_block_resources(self) -> bool:
+        if self.resource_blocking == 'compare':
+            # Чередуем режимы, чтобы сравнить время загрузки на одном и том же потоке URL
+            self._navigations += 1
+            return self._navigations % 2 == 0
+        return self.resource_blocking == 'on'
+
+    def _record_navigation(self, blocked: bool, load_time: float):
+        stats = self.navigation_stats['blocked' if blocked else 'unblocked']
+        stats['count'] += 1
+        stats['total_time'] += load_time
 
     def _extract_price(self, text: str) -> Optional[float]:
-        if not text:
-            return None
-            
-        if 'без:' in text:
-            # Извлекаем первую цену после 'без:'
-            match = re.search(r'без:.*?(\d[\d\s]*[.,]?\d*)\s*₽', text)
-            if match:
-                clean_text = match.group(1).replace('\xa0', '').replace('\u2009', '')
-                try:
-                    price_str = re.sub(r'[^\d.,]', '', clean_text).replace(',', '.')
-                    price = float(price_str)
-                    return price if price > 0 else None
-                except (ValueError, TypeError):
-                    return None
-            return None
-            
-        clean_text = re.sub(r'[^\d.,]', '', text.replace('\xa0', '').replace('\u2009', ''))
-        match = re.search(r'\d+[.,]?\d*', clean_text)
-        if match:
-            try:
-                price_str = match.group(0).replace(',', '.')
-                price = float(price_str)
-                return price if price > 0 else None
-            except (ValueError, TypeError):
-                return None
-        return None
+        return extract_price(text)
 
     async def get_selectors(self, marketplace: str) -> List[Dict[str, str]]:
+        cached = self._selectors_cache.get(marketplace)
+        if cached and cached['expires_at'] > time.monotonic():
+            return cached['selectors']
+
+        lock = self._selectors_locks.setdefault(marketplace, asyncio.Lock())
+        async with lock:
+            # Пока ждали блокировку, кэш мог обновить другой запрос
+            cached = self._selectors_cache.get(marketplace)
+            if cached and cached['expires_at'] > time.monotonic():
+                return cached['selectors']
+            return await self._refresh_selectors(marketplace, cached)
+
+    async def _refresh_selectors(self, marketplace: str, cached: Optional[Dict]) -> List[Dict[str, str]]:
+        headers = {}
+        if cached and cached.get('etag'):
+            headers['If-None-Match'] = cached['etag']
+
         try:
-            async with self.session.get(f'{self.api_url}/api/selectors/{marketplace}') as response:
+            async with self.session.get(
+                f'{self.api_url}/api/selectors/{marketplace}',
+                headers=headers
+            ) as response:
+                if response.status == 304 and cached:
+                    cached['expires_at'] = time.monotonic() + self.selectors_ttl
+                    return cached['selectors']
+
                 if response.status == 200:
                     data = await response.json()
-                    return [item['selectors'] for item in data.get('selectors_history', [])]
-                return []
+                    selectors = [item['selectors'] for item in data.get('selectors_history', [])]
+                    self._selectors_cache[marketplace] = {
+                        'selectors': selectors,
+                        'etag': response.headers.get('ETag'),
+                        'expires_at': time.monotonic() + self.selectors_ttl
+                    }
+                    return selectors
+
+                if response.status == 404 and not cached:
+                    # Для маркетплейса селекторов действительно нет — не спрашиваем до конца TTL
+                    self._selectors_cache[marketplace] = {
+                        'selectors': [],
+                        'etag': None,
+                        'expires_at': time.monotonic() + self.selectors_ttl
+                    }
+                    return []
+
+                logging.error(f"Selectors API returned {response.status} for {marketplace}")
         except Exception as e:
             logging.error(f"Error fetching selectors for {marketplace}: {e}")
-            return []
+
+        # Ошибка бэкенда (например, перезапуск) не повод терять рабочие селекторы:
+        # оставляем прежние и повторяем запрос раньше обычного
+        if cached:
+            cached['expires_at'] = time.monotonic() + min(self.selectors_ttl, SELECTORS_RETRY_INTERVAL)
+            return cached['selectors']
+        return []
+
+    def invalidate_selectors(self, marketplace: Optional[str] = None):
+        if marketplace is None:
+            self._selectors_cache.clear()
+        else:
+            self._selectors_cache.pop(marketplace, None)
 
     async def save_price_history(self, product_url: str, price: float):
         try:
@@ -114,13 +250,30 @@ class PriceParser:
                 if response.status == 200:
                     data = await response.json()
                     last_active = data.get('last_active', 0)
-                    return (datetime.now().timestamp() - last_active) <= 600
+                    return (datetime.now().timestamp() - last_active) <= ACTIVITY_WINDOW
                 return False
         except Exception as e:
             logging.error(f"Error checking user activity: {e}")
             return False
 
-    async def send_price_updates(self, user_token: str, updates: List[Dict]):
+    async def check_users_activity(self, tokens: List[str]) -> Optional[Dict[str, bool]]:
+        # Активность всех пользователей одним запросом; None, если узнать не удалось
+        try:
+            async with self.session.post(
+                f'{self.api_url}/api/user-activity/bulk',
+                json={'tokens': tokens}
+            ) as response:
+                if response.status != 200:
+                    logging.error(f"Failed to check activity for {len(tokens)} users: HTTP {response.status}")
+                    return None
+                last_active = (await response.json()).get('last_active', {})
+                now = datetime.now().timestamp()
+                return {token: now - last_active.get(token, 0) <= ACTIVITY_WINDOW for token in tokens}
+        except Exception as e:
+            logging.error(f"Error checking users activity: {e}")
+            return None
+
+    async def send_price_updates(self, user_token: str, updates: List[Dict]) -> bool:
         try:
             async with self.session.post(
                 f'{self.api_url}/api/product-updates',
@@ -134,115 +287,201 @@ class PriceParser:
             ) as response:
                 if response.status != 200:
                     logging.error(f"Failed to send price updates for user {user_token}")
+                    return False
+                return True
         except Exception as e:
             logging.error(f"Error sending price updates: {e}")
+            return False
+
+    async def _parse_html(self, html: str, price_selectors: List[str]) -> Optional[float]:
+        # Разбор HTML нагружает CPU, поэтому выносим его из event loop, который обслуживает и бота
+        if not self.executor:
+            return extract_price_from_html(html, price_selectors)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, extract_price_from_html, html, price_selectors)
+
+    async def _get_price_selectors(self, marketplace: str) -> List[str]:
+        selectors = await self.get_selectors(marketplace)
+        return list(dict.fromkeys(
+            selector_set['price'] for selector_set in selectors if selector_set.get('price')
+        ))
+
+    async def _get_static_price(self, url: str, marketplace: str, started_at: float = None) -> Optional[float]:
+        stats = self.tier_stats[marketplace]
+        try:
+            async with self.session.get(url, headers=STATIC_FETCH_HEADERS) as response:
+                if response.status == 429:
+                    host_limiters.get(marketplace).record_throttle('HTTP 429', started_at)
+                html = await response.text() if response.status == 200 else ''
+                final_url = str(response.url)
+        except asyncio.TimeoutError:
+            logging.error(f"Timeout fetching {url} without browser")
+            host_limiters.get(marketplace).record_throttle('timeout', started_at)
+            stats['http_misses'] += 1
+            return None
+        except Exception as e:
+            logging.error(f"Error fetching {url} without browser: {e}")
+            stats['http_misses'] += 1
+            return None
+
+        if not html:
+            stats['http_misses'] += 1
+            return None
+        if is_anti_bot_page(final_url, html):
+            stats['http_blocked'] += 1
+            stats['http_misses'] += 1
+            return None
 
-    async def _get_marketplace_price(self, url: str) -> Optional[float]:
-        page = None
+        # Без селекторов всё равно пробуем структурированные данные (JSON-LD, микроразметку)
+        price_selectors = await self._get_price_selectors(marketplace)
+        price = await self._parse_html(html, price_selectors)
+        stats['http_hits' if price else 'http_misses'] += 1
+        return price
+
+    async def _prepare_page(self, page: Page, marketplace: str, started_at: float = None):
+        if marketplace == 'ozon':
+            try:
+                refresh_button = await page.wait_for_selector('button:has-text("Обновить")', timeout=3000)
+                if refresh_button:
+                    host_limiters.get(marketplace).record_throttle('refresh challenge', started_at)
+                    await refresh_button.click()
+                    await page.wait_for_load_state('networkidle', timeout=5000)
+            except:
+                pass
+        elif marketplace == 'yandex_market':
+            try:
+                captcha = await page.wait_for_selector('#js-button', timeout=3000)
+                if captcha:
+                    host_limiters.get(marketplace).record_throttle('captcha', started_at)
+                    await captcha.click()
+                    await asyncio.sleep(2)
+                    await page.wait_for_load_state('networkidle')
+            except:
+                pass
+
+    async def _extract_price_from_page(self, page: Page, price_selectors: List[str]) -> Optional[float]:
+        data = await page.evaluate(EXTRACT_PAGE_DATA_SCRIPT, price_selectors)
+        if price := extract_structured_price(data['jsonLd'], data['microdata'], data['states']):
+            return price
+
+        texts = data['texts']
+        if price := extract_price_from_texts([text for text in texts if text]):
+            return price
+
+        # Селекторы, которые браузер не понял (например, расширения soupsieve), проверяем по HTML
+        unsupported = [selector for selector, text in zip(price_selectors, texts) if text is False]
+        if unsupported:
+            return await self._parse_html(await page.content(), unsupported)
+        return None
+
+    async def _get_marketplace_price(self, url: str, page: Page, blocked: bool = False,
+                                     started_at: float = None) -> Optional[float]:
         try:
-            page = await self.context.new_page()
-            await page.route("**/*", lambda route: route.continue_())
-            
+            start = time.monotonic()
             await page.goto(url, wait_until='domcontentloaded', timeout=15000)
-            marketplace = 'ozon' if 'ozon.ru' in url else 'yandex_market'
-            selectors = await self.get_selectors(marketplace)
-            
-            if not selectors:
-                return None
-
-            for selector_set in selectors:
-                try:
-                    price_selector = selector_set.get('price')
-                    if not price_selector:
-                        continue
-
-                    if marketplace == 'ozon':
-                        try:
-                            refresh_button = await page.wait_for_selector('button:has-text("Обновить")', timeout=3000)
-                            if refresh_button:
-                                await refresh_button.click()
-                                await page.wait_for_load_state('networkidle', timeout=5000)
-                        except:
-                            pass
-                    elif marketplace == 'yandex_market':
-                        try:
-                            captcha = await page.wait_for_selector('#js-button', timeout=3000)
-                            if captcha:
-                                await captcha.click()
-                                await asyncio.sleep(2)
-                                await page.wait_for_load_state('networkidle')
-                        except:
-                            pass
-
-                    content = await page.content()
-                    soup = BeautifulSoup(content, 'html.parser')
-                    
-                    if element := soup.select_one(price_selector):
-                        if price := self._extract_price(element.text):
-                            await self.save_price_history(url, price)
-                            logging.info(f"Found price {price} for {url}")
-                            return price
-                except Exception as e:
-                    logging.error(f"Error with selector {selector_set}: {e}")
-                    continue
+            self._record_navigation(blocked, time.monotonic() - start)
+            marketplace = self._marketplace_for(url)
+            price_selectors = await self._get_price_selectors(marketplace)
+
+            await self._prepare_page(page, marketplace, started_at)
+
+            if price := await self._extract_price_from_page(page, price_selectors):
+                logging.info(f"Found price {price} for {url}")
+                return price
+
+            return None
 
+        except PlaywrightTimeoutError:
+            logging.error(f"Timeout loading {url}")
+            host_limiters.get(self._marketplace_for(url)).record_throttle('timeout', started_at)
             return None
-            
         except Exception as e:
             logging.error(f"Error processing {url}: {e}")
             return None
-        finally:
-            if page:
-                await page.close()
+
+    async def _fetch_marketplace_price(self, url: str, started_at: float = None) -> Optional[float]:
+        marketplace = self._marketplace_for(url)
+
+        if self.http_first:
+            if price := await self._get_static_price(url, marketplace, started_at):
+                logging.info(f"Found price {price} for {url} without browser")
+                return price
+
+        blocked = self._should_block_resources()
+        async with self.page_pool.lease(marketplace, blocked) as page:
+            price = await self._get_marketplace_price(url, page, blocked, started_at)
+        self.tier_stats[marketplace]['browser_hits' if price else 'browser_misses'] += 1
+        return price
+
+    async def _fetch_wb_chunk(self, product_ids: List[str]) -> Optional[Dict[str, float]]:
+        api_url = WB_CARDS_URL.format(ids=';'.join(product_ids))
+        limiter = host_limiters.get('wildberries')
+
+        for attempt in range(self.wb_retries + 1):
+            try:
+                started_at = None
+                async with limiter.acquire() as started_at:
+                    async with self.session.get(api_url) as response:
+                        if response.status == 200:
+                            prices = parse_wb_products(await response.json(content_type=None))
+                            limiter.record_success(started_at)
+                            return prices
+                        if response.status == 429:
+                            limiter.record_throttle('HTTP 429', started_at)
+                        logging.warning(f"WB API returned {response.status} for {len(product_ids)} products")
+            except asyncio.TimeoutError:
+                limiter.record_throttle('timeout', started_at)
+                logging.error(f"Timeout fetching {len(product_ids)} WB products")
+            except Exception as e:
+                logging.error(f"Error fetching WB prices: {e}")
+
+            if attempt < self.wb_retries:
+                await asyncio.sleep(self.wb_retry_backoff * 2 ** attempt)
+
+        return None
 
     async def _get_wb_prices(self, urls: List[str]) -> Dict[str, Optional[float]]:
         results = {}
-        product_ids = []
-        url_map = {}
+        url_map: Dict[str, List[str]] = defaultdict(list)
 
         for url in urls:
             if match := re.search(r'/catalog/(\d+)/', url):
-                product_id = match.group(1)
-                product_ids.append(product_id)
-                url_map[product_id] = url
+                url_map[match.group(1)].append(url)
 
-        if not product_ids:
+        if not url_map:
             return {}
 
-        try:
-            api_url = f'https://card.wb.ru/cards/detail?curr=rub&dest=-1257786&nm={";".join(product_ids)}'
-            
-            async with self.session.get(api_url) as response:
-                if response.status == 200:
-                    data = await response.json()
-                    products = data.get('data', {}).get('products', [])
-                    
-                    for product in products:
-                        product_id = str(product.get('id'))
-                        if product_id in url_map:
-                            url = url_map[product_id]
-                            price = product.get('salePriceU', 0) / 100
-                            if price > 0:
-                                await self.save_price_history(url, price)
-                                results[url] = price
-                                logging.info(f"Got WB price {price} for {url}")
-                            else:
-                                results[url] = None
+        product_ids = list(url_map)
+        chunks = [product_ids[i:i + self.wb_chunk_size] for i in range(0, len(product_ids), self.wb_chunk_size)]
+        prices: Dict[str, float] = {}
+        missing = []
+
+        for chunk, chunk_prices in zip(chunks, await asyncio.gather(*(self._fetch_wb_chunk(chunk) for chunk in chunks))):
+            if chunk_prices is None:
+                logging.error(f"Failed to fetch WB chunk of {len(chunk)} products after retries")
+                continue
+            prices.update(chunk_prices)
+            missing.extend(product_id for product_id in chunk if product_id not in chunk_prices)
+
+        if missing:
+            # Товары, пропавшие из ответа на пачку, запрашиваем по одному
+            logging.info(f"Retrying {len(missing)} WB products missing from chunk responses")
+            for single_prices in await asyncio.gather(*(self._fetch_wb_chunk([product_id]) for product_id in missing)):
+                prices.update(single_prices or {})
+
+        for product_id, product_urls in url_map.items():
+            price = prices.get(product_id)
+            for url in product_urls:
+                if price and price > 0:
+                    results[url] = price
+                    logging.info(f"Got WB price {price} for {url}")
                 else:
-                    for url in url_map.values():
-                        results[url] = None
-                    
-        except Exception as e:
-            logging.error(f"Error fetching WB prices: {e}")
-            for url in url_map.values():
-                results[url] = None
+                    results[url] = None
 
         return results
 
-    async def get_prices_batch(self, urls: List[str]) -> Dict[str, Optional[float]]:
-        if not urls:
-            return {}
-
+    async def iter_prices(self, urls: List[str]) -> AsyncIterator[Tuple[str, Optional[float]]]:
+        # Отдаёт цены по мере получения: URL маркетплейсов по одному, Wildberries — всей пачкой
         wb_urls = []
         other_urls = []
         
@@ -252,26 +491,37 @@ class PriceParser:
             else:
                 other_urls.append(url)
 
-        results = {}
-        
-        if wb_urls:
+        async def process_wb():
             logging.info(f"Processing {len(wb_urls)} Wildberries URLs")
-            wb_results = await self._get_wb_prices(wb_urls)
-            results.update(wb_results)
+            return list((await self._get_wb_prices(wb_urls)).items())
 
+        async def process_url(url: str):
+            limiter = host_limiters.get(self._marketplace_for(url))
+            async with limiter.acquire() as started_at:
+                price = await self._fetch_marketplace_price(url, started_at)
+            # Промах без цены не говорит о здоровье площадки и лимит не разгоняет
+            if price is not None:
+                limiter.record_success(started_at)
+            return [(url, price)]
+
+        tasks = [asyncio.create_task(process_url(url)) for url in other_urls]
+        if wb_urls:
+            tasks.append(asyncio.create_task(process_wb()))
         if other_urls:
             logging.info(f"Processing {len(other_urls)} marketplace URLs")
-            semaphore = asyncio.Semaphore(5)
-            
-            async def process_url(url: str):
-                async with semaphore:
-                    price = await self._get_marketplace_price(url)
-                    return url, price
-
-            tasks = [process_url(url) for url in other_urls]
-            marketplace_results = await asyncio.gather(*tasks)
-            
-            for url, price in marketplace_results:
-                results[url] = price
-
-        return results
\ No newline at end of file
+
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                for url, price in await next_done:
+                    yield url, price
+        finally:
+            for task in tasks:
+                task.cancel()
+
+        if other_urls:
+            logging.info(f"Browser metrics: {self.get_metrics()}")
+
+    async def get_prices_batch(self, urls: List[str]) -> Dict[str, Optional[float]]:
+        if not urls:
+            return {}
+        return {url: price async for url, price in self.iter_prices(urls)}
@@ -1,8 +1,17 @@
 import asyncio
+import hashlib
 import logging
+import time
 from datetime import datetime
-from typing import Dict, List
+from typing import Awaitable, Callable, Dict, List, Optional
+from bot.services.alert_delivery import AlertDelivery
 from bot.services.parser import PriceParser
+from bot.services.scheduler import CheckScheduler
+from bot.utils.helpers import canonical_product_key
+from config.settings import settings
+
+# Маркер конца потока в очередях конвейера
+STOP = None
 
 class PriceChecker:
     def __init__(self, redis_client, notification_service, batch_size: int = 50):
@@ -10,113 +19,411 @@ class PriceChecker:
         self.notification_service = notification_service
         self.batch_size = batch_size
         self.parser = None
-        self.monitoring_interval = 600
+        self.scheduler = CheckScheduler(redis_client)
+        self.monitoring_interval = settings.SCHEDULER_TICK
+        self.products_refresh_interval = settings.PRODUCTS_REFRESH_INTERVAL
         self.retry_interval = 60
-        self.pending_updates = {}
+        self.fetch_workers = settings.FETCH_WORKERS
+        self.queue_size = settings.PIPELINE_QUEUE_SIZE
+        self.push_buffer_size = settings.PUSH_BUFFER_SIZE
+        self.mode = settings.CHECKER_MODE
+        self.consumer_name = settings.CHECKER_CONSUMER
+        self.claim_idle = settings.CHECK_CLAIM_IDLE
+        self.heartbeat_interval = settings.PRICE_HEARTBEAT_INTERVAL
+        self.pending_limit = settings.PENDING_UPDATES_LIMIT
+        self.pending_ttl = settings.PENDING_UPDATES_TTL
+        self.activity_ttl = settings.ACTIVITY_CACHE_TTL
+        self.alert_dedup_ttl = settings.ALERT_DEDUP_TTL
+        # Без notification_service процесс только кладёт уведомления в outbox, а отправляет их бот:
+        # так лимит Telegram делит один NotificationDispatcher, сколько бы воркеров ни было
+        self.alert_delivery = (
+            AlertDelivery(redis_client, notification_service, self.consumer_name) if notification_service else None
+        )
+        self._activity_cache: Dict[str, tuple] = {}
+        self._products_cache = (0.0, {})
         logging.info("PriceChecker initialized")
 
-    async def process_batch(self, batch_urls: List[str], user_product_map: Dict[str, list]):
+    async def run_pipeline(self, due_keys: List[str], products_by_key: Dict[str, dict],
+                           on_evaluated: Optional[Callable[[str], Awaitable]] = None):
+        # Источник -> загрузчики цен -> оценка -> уведомления и отправка в расширение.
+        # Очереди ограничены, поэтому медленная стадия притормаживает предыдущие.
+        # on_evaluated вызывается для каждого товара, как только его цена проверена на цели
+        fetch_queue = asyncio.Queue(self.queue_size)
+        result_queue = asyncio.Queue(self.queue_size)
+        alert_queue = asyncio.Queue(self.queue_size)
+        push_queue = asyncio.Queue(self.queue_size)
+
+        tokens = {user_token for key in due_keys for _, user_token, _ in products_by_key[key]['subscribers']}
+        await self._prefetch_activity(tokens)
+
+        async def source():
+            for key in due_keys:
+                await fetch_queue.put(key)
+            for _ in range(self.fetch_workers):
+                await fetch_queue.put(STOP)
+
+        tasks = [asyncio.create_task(stage) for stage in (
+            source(),
+            *(self._fetch_stage(fetch_queue, result_queue, products_by_key) for _ in range(self.fetch_workers)),
+            self._evaluate_stage(result_queue, alert_queue, push_queue, products_by_key, on_evaluated),
+            self._alert_sink(alert_queue),
+            self._push_sink(push_queue, tokens)
+        )]
         try:
-            logging.info(f"Processing batch of {len(batch_urls)} URLs")
-            prices = await self.parser.get_prices_batch(batch_urls)
-            
-            updates_by_user = {}
-            
-            for url, price in prices.items():
-                if price is not None and url in user_product_map:
-                    for user_id, product in user_product_map[url]:
-                        current_price = float(product.get('price', 0))
-                        user_token = await self.redis_client.get_user_token(user_id)
-                        
-                        if not user_token:
-                            continue
-
-                        update = {
-                            'product_url': url,
-                            'current_price': price
-                        }
-
-                        if user_token not in updates_by_user:
-                            updates_by_user[user_token] = []
-                        updates_by_user[user_token].append(update)
-
-                        target_price = float(product.get('target_price', 0))
-                        if price <= target_price:
-                            is_parsed = await self.redis_client.is_already_parsed(user_id, url)
-                            if not is_parsed:
-                                await self.notification_service.send_price_alert(
-                                    user_id=user_id,
-                                    product_title=product.get('title', 'Unknown'),
-                                    current_price=price,
-                                    target_price=target_price,
-                                    product_url=url
-                                )
-                                await self.redis_client.mark_as_parsed(user_id, url)
-                                logging.info(f"Price alert sent for user {user_id}, product: {product.get('title')}")
-
-            for user_token, updates in updates_by_user.items():
-                is_active = await self.parser.check_user_activity(user_token)
-                
-                if is_active:
-                    await self.parser.send_price_updates(user_token, updates)
-                    if user_token in self.pending_updates:
-                        await self.parser.send_price_updates(user_token, self.pending_updates[user_token])
-                        del self.pending_updates[user_token]
-                else:
-                    if user_token not in self.pending_updates:
-                        self.pending_updates[user_token] = []
-                    self.pending_updates[user_token].extend(updates)
-                    
+            await asyncio.gather(*tasks)
+        except BaseException:
+            # Упавшая стадия больше не читает свою очередь, и соседи навсегда встанут
+            # на заполненных очередях — останавливаем весь конвейер
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+
+    async def _fetch_stage(self, fetch_queue: asyncio.Queue, result_queue: asyncio.Queue, products_by_key: Dict[str, dict]):
+        stopped = False
+        while not stopped:
+            key = await fetch_queue.get()
+            if key is STOP:
+                break
+
+            # Забираем то, что уже накопилось в очереди, чтобы WB ушёл пачкой
+            batch = [key]
+            while len(batch) < self.batch_size and not fetch_queue.empty():
+                next_key = fetch_queue.get_nowait()
+                if next_key is STOP:
+                    stopped = True
+                    break
+                batch.append(next_key)
+
+            await self._fetch_batch(batch, products_by_key, result_queue)
+        # При падении стадии маркер не нужен: run_pipeline отменит весь конвейер
+        await result_queue.put(STOP)
+
+    async def _fetch_batch(self, batch_keys: List[str], products_by_key: Dict[str, dict], result_queue: asyncio.Queue):
+        prices = {key: None for key in batch_keys}
+        stats = None
+        changed = 0
+        try:
+            logging.info(f"Fetching batch of {len(batch_keys)} products")
+            stats = await self.redis_client.get_product_stats(batch_keys)
+            keys_by_url = {products_by_key[key]['url']: key for key in batch_keys}
+            async for fetch_url, price in self.parser.iter_prices(list(keys_by_url)):
+                key = keys_by_url.get(fetch_url)
+                if key is not None and price is not None:
+                    prices[key] = price
+                    is_changed = await self._observe_price(key, fetch_url, price, stats, products_by_key)
+                    changed += is_changed
+                    await result_queue.put((key, price, is_changed))
+            logging.info(f"Batch done: {changed} of {len(batch_keys)} prices changed")
         except Exception as e:
-            logging.error(f"Error processing batch: {e}", exc_info=True)
+            logging.error(f"Error fetching batch: {e}", exc_info=True)
 
-    async def start_monitoring(self):
-        self.parser = PriceParser()
-        
-        async with self.parser:
+        try:
+            await self.scheduler.reschedule(prices, products_by_key, stats)
+        except Exception as e:
+            logging.error(f"Error rescheduling batch: {e}", exc_info=True)
+
+    def _subscribers_digest(self, subscribers: list) -> str:
+        entries = sorted(
+            f"{user_id}|{product.get('product_url')}|{product.get('target_price', 0)}"
+            for user_id, _, product in subscribers
+        )
+        return hashlib.md5('\n'.join(entries).encode()).hexdigest()
+
+    async def _observe_price(self, key: str, url: str, price: float, stats: Dict[str, dict],
+                             products_by_key: Dict[str, dict]) -> bool:
+        # Сравниваем с последней известной ценой: неизменная цена не пишется в историю
+        # и не отправляется в расширение. Новые подписчики или изменённые цели тоже
+        # считаются изменением
+        previous = stats.setdefault(key, {})
+        digest = self._subscribers_digest(products_by_key[key]['subscribers'])
+        changed = price != previous.get('price') or digest != previous.get('subscribers')
+        previous['subscribers'] = digest
+
+        now = time.time()
+        # Для стабильных цен изредка пишем контрольную точку, чтобы график не обрывался
+        if changed or now - previous.get('sampled_at', 0) >= self.heartbeat_interval:
+            await self.parser.save_price_history(url, price)
+            previous['sampled_at'] = now
+        return changed
+
+    async def _evaluate_stage(self, result_queue: asyncio.Queue, alert_queue: asyncio.Queue,
+                              push_queue: asyncio.Queue, products_by_key: Dict[str, dict],
+                              on_evaluated: Optional[Callable[[str], Awaitable]] = None):
+        alerted = set()
+        running = self.fetch_workers
+        while running:
+            item = await result_queue.get()
+            if item is STOP:
+                running -= 1
+                continue
+
+            key, price, changed = item
+            if price is None:
+                continue
+
+            try:
+                await self._evaluate_item(key, price, changed, alerted, alert_queue, push_queue, products_by_key)
+                if on_evaluated:
+                    await on_evaluated(key)
+            except Exception as e:
+                logging.error(f"Error evaluating price of {key}: {e}", exc_info=True)
+        await alert_queue.put(STOP)
+        await push_queue.put(STOP)
+
+    async def _evaluate_item(self, key: str, price: float, changed: bool, alerted: set, alert_queue: asyncio.Queue,
+                             push_queue: asyncio.Queue, products_by_key: Dict[str, dict]):
+        # Цели проверяем и при неизменной цене: статистика уже сохранена, и если
+        # прошлая проверка упала до outbox, неуведомлённый подписчик иначе не получит
+        # уведомление до следующего изменения цены. Повтор отсечёт ключ дедупликации
+        triggered = await self.redis_client.get_triggered_alerts(key, price)
+        for user_id, user_token, product in products_by_key[key]['subscribers']:
+            url = product.get('product_url')
+            if changed:
+                await push_queue.put((user_token, {
+                    'product_url': url,
+                    'current_price': price
+                }))
+
+            if (user_id, url) in triggered and (user_id, url) not in alerted:
+                target_price = float(product.get('target_price', 0))
+                alerted.add((user_id, url))
+                await alert_queue.put({
+                    'user_id': user_id,
+                    'product_title': product.get('title', 'Unknown'),
+                    'current_price': price,
+                    'target_price': target_price,
+                    'product_url': url
+                })
+
+    async def _alert_sink(self, alert_queue: asyncio.Queue):
+        while (alert := await alert_queue.get()) is not STOP:
+            try:
+                # Сначала запись в outbox, потом отметка: упавший процесс не потеряет уведомление,
+                # а повторную запись того же события отсечёт ключ дедупликации
+                dedup_key = f"{alert['user_id']}:{canonical_product_key(alert['product_url'])}:{alert['current_price']}"
+                if await self.redis_client.enqueue_alert(alert, dedup_key, self.alert_dedup_ttl):
+                    logging.info(f"Price alert queued for user {alert['user_id']}, product: {alert['product_title']}")
+                await self.redis_client.mark_as_parsed(alert['user_id'], alert['product_url'])
+            except Exception as e:
+                logging.error(f"Error queueing price alert: {e}", exc_info=True)
+
+    async def _push_sink(self, push_queue: asyncio.Queue, tokens=()):
+        buffers: Dict[str, list] = {}
+        flushed = set()
+        while (item := await push_queue.get()) is not STOP:
+            user_token, update = item
+            buffers.setdefault(user_token, []).append(update)
+            if len(buffers[user_token]) >= self.push_buffer_size:
+                flushed.add(user_token)
+                await self._flush_updates(user_token, buffers.pop(user_token))
+
+        for user_token, updates in buffers.items():
+            flushed.add(user_token)
+            await self._flush_updates(user_token, updates)
+
+        # Пользователь вернулся, но его цены не изменились: накопленное отдаём без свежих обновлений
+        await self._flush_pending([token for token in tokens if token not in flushed])
+
+    async def _flush_pending(self, tokens):
+        try:
+            active = [token for token in tokens if self._activity_cache.get(token, (0.0, False))[1]]
+            if not active:
+                return
+            for user_token in await self.redis_client.get_tokens_with_pending_updates(active):
+                await self._flush_updates(user_token, [])
+        except Exception as e:
+            logging.error(f"Error flushing pending updates: {e}", exc_info=True)
+
+    async def _prefetch_activity(self, tokens):
+        # Одним запросом узнаём, кто из пользователей сейчас в сети; ответ живёт activity_ttl секунд
+        now = time.monotonic()
+        self._activity_cache = {
+            token: entry for token, entry in self._activity_cache.items() if now - entry[0] < self.activity_ttl
+        }
+        stale = [token for token in tokens if token not in self._activity_cache]
+        if not stale:
+            return
+
+        activity = await self.parser.check_users_activity(stale)
+        # При ошибке запроса тоже кешируем «не в сети»: иначе каждая порция обновлений
+        # повторяла бы запрос к недоступному API, пока не истечёт activity_ttl
+        for token in stale:
+            self._activity_cache[token] = (now, activity.get(token, False) if activity is not None else False)
+
+    async def _is_active(self, user_token: str) -> bool:
+        entry = self._activity_cache.get(user_token)
+        if entry is None or time.monotonic() - entry[0] >= self.activity_ttl:
+            await self._prefetch_activity([user_token])
+        return self._activity_cache.get(user_token, (0.0, False))[1]
+
+    async def _flush_updates(self, user_token: str, updates: list):
+        try:
+            is_active = await self._is_active(user_token)
+
+            if not is_active:
+                # Неактивному пользователю копим в Redis только последнюю цену по каждому товару
+                await self.redis_client.add_pending_updates(user_token, updates, self.pending_limit, self.pending_ttl)
+                return
+
+            # Накопленное за время отсутствия и свежие цены уходят одним запросом, свежие важнее
+            merged = {update['product_url']: update for update in await self.redis_client.pop_pending_updates(user_token)}
+            merged.update((update['product_url'], update) for update in updates)
+            if not merged:
+                return
+            if not await self.parser.send_price_updates(user_token, list(merged.values())):
+                await self.redis_client.add_pending_updates(
+                    user_token, list(merged.values()), self.pending_limit, self.pending_ttl
+                )
+        except Exception as e:
+            logging.error(f"Error pushing price updates: {e}", exc_info=True)
+
+    async def collect_products(self) -> Dict[str, dict]:
+        snapshot = await self.redis_client.load_monitoring_snapshot()
+        products_by_key = {}
+
+        for user_id, products in snapshot.products.items():
+            user_token = snapshot.tokens.get(user_id)
+            if not user_token:
+                continue
+
+            for product in products:
+                url = product.get('product_url')
+                if url and not snapshot.is_parsed(user_id, url):
+                    # Товар, который отслеживают несколько пользователей, запрашиваем один раз
+                    key = canonical_product_key(url)
+                    if key not in products_by_key:
+                        products_by_key[key] = {'url': url, 'subscribers': []}
+                    products_by_key[key]['subscribers'].append((user_id, user_token, product))
+
+        return products_by_key
+
+    async def _get_cached_products(self, max_age: float = None) -> Dict[str, dict]:
+        # Полный снимок — запросы по каждому пользователю, поэтому перечитываем его редко
+        loaded_at, products_by_key = self._products_cache
+        max_age = self.products_refresh_interval if max_age is None else max_age
+        if time.monotonic() - loaded_at > max_age:
+            products_by_key = await self.collect_products()
+            self._products_cache = (time.monotonic(), products_by_key)
+            await self.scheduler.register(products_by_key)
+        return products_by_key
+
+    async def _reload_products(self) -> Dict[str, dict]:
+        # Не чаще раза за такт, даже если незнакомые снимку товары появляются постоянно
+        return await self._get_cached_products(self.monitoring_interval)
+
+    async def _get_due(self):
+        products_by_key = await self._get_cached_products()
+        due_keys = await self.scheduler.get_due(products_by_key, reload=self._reload_products)
+        return due_keys, self._products_cache[1]
+
+    async def publish_due(self) -> int:
+        # Публикует один экземпляр — тот, кто держит блокировку на этот такт
+        if not await self.redis_client.acquire_lock('check_publisher', self.consumer_name, self.monitoring_interval * 2):
+            return 0
+
+        due_keys, products_by_key = await self._get_due()
+        if not due_keys:
+            return 0
+
+        # Пока задача в очереди, переносим срок, чтобы не опубликовать её повторно
+        await self.redis_client.schedule_products({key: time.time() + self.claim_idle for key in due_keys})
+        await self.redis_client.publish_check_tasks(due_keys)
+        logging.info(f"Published {len(due_keys)} due of {len(products_by_key)} products")
+        return len(due_keys)
+
+    async def consume_tasks(self, block_ms: int = 5000) -> int:
+        count = self.batch_size * self.fetch_workers
+        tasks = await self.redis_client.claim_stale_check_tasks(self.consumer_name, self.claim_idle * 1000, count)
+        if len(tasks) < count:
+            tasks += await self.redis_client.read_check_tasks(self.consumer_name, count - len(tasks), block_ms)
+        if not tasks:
+            return 0
+
+        products_by_key = await self._get_cached_products()
+        if any(key not in products_by_key for _, key in tasks):
+            # Задачу мог опубликовать экземпляр с более свежим снимком
+            products_by_key = await self._reload_products()
+        message_ids: Dict[str, List[str]] = {}
+        for message_id, key in tasks:
+            message_ids.setdefault(key, []).append(message_id)
+
+        async def ack(key: str):
+            # Подтверждаем товар сразу после проверки, а не после всей пачки: иначе медленная
+            # пачка дольше claim_idle отдаст уже проверенные товары другому воркеру
+            await self.redis_client.ack_check_tasks(message_ids.pop(key))
+
+        due_keys = [key for key in message_ids if key in products_by_key]
+        if due_keys:
+            await self.run_pipeline(due_keys, products_by_key, on_evaluated=ack)
+        # Оставшиеся: удалённые товары и те, чью цену получить не удалось — их вернёт расписание
+        remaining = [message_id for ids in message_ids.values() for message_id in ids]
+        if remaining:
+            await self.redis_client.ack_check_tasks(remaining)
+        return len(tasks)
+
+    async def _publish_loop(self):
+        while True:
+            try:
+                await self.publish_due()
+            except Exception as e:
+                logging.error(f"Error publishing due products: {e}", exc_info=True)
+            await asyncio.sleep(self.monitoring_interval)
+
+    async def _run_distributed(self):
+        await self.redis_client.ensure_check_group()
+        logging.info(f"Checker worker {self.consumer_name} joined group")
+        publisher = asyncio.create_task(self._publish_loop())
+        try:
             while True:
                 try:
-                    users = await self.redis_client.get_all_users()
-                    all_products = []
-                    user_product_map = {}
-
-                    for user_id in users:
-                        products = await self.redis_client.get_products(user_id)
-                        if not products:
-                            continue
-
-                        for product in products:
-                            url = product.get('product_url')
-                            if url and not await self.redis_client.is_already_parsed(user_id, url):
-                                all_products.append(url)
-                                if url not in user_product_map:
-                                    user_product_map[url] = []
-                                user_product_map[url].append((user_id, product))
-
-                    if not all_products:
-                        logging.info("No products to check, waiting...")
-                        await asyncio.sleep(self.retry_interval)
-                        continue
-
-                    batches = [all_products[i:i + self.batch_size] 
-                             for i in range(0, len(all_products), self.batch_size)]
-                    
-                    logging.info(f"Processing {len(batches)} batches ({len(all_products)} products total)")
-                    start_time = datetime.now()
-                    
-                    tasks = []
-                    for batch in batches:
-                        task = asyncio.create_task(self.process_batch(batch, user_product_map))
-                        tasks.append(task)
-                    
-                    await asyncio.gather(*tasks)
-                    
-                    end_time = datetime.now()
-                    processing_time = (end_time - start_time).total_seconds()
-                    logging.info(f"Batch processing completed in {processing_time:.2f} seconds")
-                    
+                    await self.consume_tasks()
+                except Exception as e:
+                    logging.error(f"Error consuming check tasks: {e}", exc_info=True)
+                    await asyncio.sleep(self.retry_interval)
+        finally:
+            publisher.cancel()
+
+    async def _run_local(self):
+        while True:
+            try:
+                due_keys, products_by_key = await self._get_due()
+
+                if not due_keys:
+                    logging.info("No products due for check, waiting...")
                     await asyncio.sleep(self.monitoring_interval)
+                    continue
 
-                except Exception as e:
-                    logging.error(f"Error in monitoring loop: {e}", exc_info=True)
-                    await asyncio.sleep(self.retry_interval)
\ No newline at end of file
+                logging.info(f"Checking {len(due_keys)} due of {len(products_by_key)} products")
+                start_time = datetime.now()
+
+                await self.run_pipeline(due_keys, products_by_key)
+
+                end_time = datetime.now()
+                processing_time = (end_time - start_time).total_seconds()
+                logging.info(f"Check pipeline completed in {processing_time:.2f} seconds")
+
+                await asyncio.sleep(self.monitoring_interval)
+
+            except Exception as e:
+                logging.error(f"Error in monitoring loop: {e}", exc_info=True)
+                await asyncio.sleep(self.retry_interval)
+
+    async def start_monitoring(self):
+        self.parser = PriceParser()
+
+        try:
+            await self.redis_client.rebuild_alert_index()
+        except Exception as e:
+            logging.error(f"Error rebuilding alert index: {e}", exc_info=True)
+
+        delivery = asyncio.create_task(self.alert_delivery.run()) if self.alert_delivery else None
+        try:
+            async with self.parser:
+                if self.mode == 'distributed':
+                    await self._run_distributed()
+                else:
+                    await self._run_local()
+        finally:
+            if delivery:
+                delivery.cancel()
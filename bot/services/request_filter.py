@@ -0,0 +1,55 @@
+from dataclasses import dataclass, field
+from typing import Dict, FrozenSet, Tuple
+from urllib.parse import urlparse
+
+# Для извлечения цены достаточно документа, скриптов и XHR, которыми они подгружают данные
+ALLOWED_RESOURCE_TYPES = frozenset({'document', 'script', 'xhr', 'fetch'})
+
+TRACKER_HOSTS = (
+    'mc.yandex.ru',
+    'an.yandex.ru',
+    'yandex.ru/ads',
+    'ads.adfox.ru',
+    'top-fwz1.mail.ru',
+    'google-analytics.com',
+    'googletagmanager.com',
+    'doubleclick.net',
+    'vk.com/rtrg',
+    'criteo.com',
+    'criteo.net',
+    'mradx.net'
+)
+
+
+@dataclass(frozen=True)
+class RequestFilterPolicy:
+    allowed_resource_types: FrozenSet[str] = ALLOWED_RESOURCE_TYPES
+    blocked_hosts: Tuple[str, ...] = TRACKER_HOSTS
+    allowed_hosts: Tuple[str, ...] = field(default_factory=tuple)
+
+    def should_block(self, resource_type: str, url: str) -> bool:
+        parsed = urlparse(url)
+        location = f"{parsed.netloc}{parsed.path}"
+        if any(host in location for host in self.allowed_hosts):
+            return False
+        if resource_type not in self.allowed_resource_types:
+            return True
+        return any(host in location for host in self.blocked_hosts)
+
+
+POLICIES: Dict[str, RequestFilterPolicy] = {
+    'ozon': RequestFilterPolicy(
+        blocked_hosts=TRACKER_HOSTS + ('xapi.ozon.ru/dlte', 'tracker-api.ozon.ru')
+    ),
+    'yandex_market': RequestFilterPolicy(
+        blocked_hosts=TRACKER_HOSTS + ('yastatic.net/pcode', 'yandex.ru/clck'),
+        # Капча Яндекса отрисовывается с этого хоста, без неё страница не откроется
+        allowed_hosts=('captcha-api.yandex.ru',)
+    )
+}
+
+DEFAULT_POLICY = RequestFilterPolicy()
+
+
+def should_block_request(marketplace: str, resource_type: str, url: str) -> bool:
+    return POLICIES.get(marketplace, DEFAULT_POLICY).should_block(resource_type, url)
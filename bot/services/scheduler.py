@@ -0,0 +1,103 @@
+import logging
+import random
+import time
+from typing import Awaitable, Callable, Dict, List, Optional
+from config.settings import settings
+
+# Базовый интервал проверки: API Wildberries дешёвый, Ozon и Маркет требуют браузера
+MARKETPLACE_INTERVALS = {
+    'wildberries': 300,
+    'ozon': 900,
+    'yandex_market': 900
+}
+DEFAULT_INTERVAL = 600
+
+VOLATILITY_SMOOTHING = 0.3
+VOLATILITY_WEIGHT = 20
+NEAR_TARGET_GAP = 0.1
+FAR_TARGET_GAP = 0.5
+
+
+class CheckScheduler:
+    """Расписание проверок в sorted set check_schedule: товар -> время следующей проверки.
+
+    Интервал товара сокращается, если цена часто меняется или близка к самой
+    высокой целевой цене подписчиков, и растёт для стабильных товаров, далёких от цели.
+    """
+
+    def __init__(self, redis_client):
+        self.redis_client = redis_client
+        self.min_interval = settings.MIN_CHECK_INTERVAL
+        self.max_interval = settings.MAX_CHECK_INTERVAL
+        self.batch_limit = settings.SCHEDULER_BATCH_LIMIT
+
+    def next_interval(self, marketplace: str, volatility: float, price: Optional[float], target_price: float) -> float:
+        interval = MARKETPLACE_INTERVALS.get(marketplace, DEFAULT_INTERVAL)
+
+        if price is None:
+            # Цену получить не удалось — повторяем не позже базового интервала
+            return max(self.min_interval, min(interval, self.max_interval))
+
+        interval /= 1 + volatility * VOLATILITY_WEIGHT
+
+        gap = (price - target_price) / price if price > 0 else 1.0
+        if 0 < gap < NEAR_TARGET_GAP:
+            interval *= max(0.25, gap / NEAR_TARGET_GAP)
+        elif gap > FAR_TARGET_GAP and volatility < 0.01:
+            interval *= 2
+
+        # Небольшой разброс, чтобы товары не собирались в одну волну
+        interval *= random.uniform(0.9, 1.1)
+        return max(self.min_interval, min(interval, self.max_interval))
+
+    async def register(self, products_by_key: Dict[str, dict]):
+        # Сверка расписания с полным списком товаров. Обычно новые товары ставит сохранение,
+        # здесь подхватываются пропущенные; распределяем их по первому минимальному интервалу
+        now = time.time()
+        await self.redis_client.schedule_products(
+            {key: now + random.uniform(0, self.min_interval) for key in products_by_key},
+            only_new=True
+        )
+
+    async def get_due(self, products_by_key: Dict[str, dict],
+                      reload: Optional[Callable[[], Awaitable[Dict[str, dict]]]] = None) -> List[str]:
+        due_keys = await self.redis_client.get_due_products(time.time(), self.batch_limit)
+        if reload and any(key not in products_by_key for key in due_keys):
+            # Товар могли сохранить после загрузки снимка: перечитываем его, прежде чем снять товар с расписания
+            products_by_key = await reload()
+        stale = [key for key in due_keys if key not in products_by_key]
+        if stale:
+            await self.redis_client.unschedule_products(stale)
+        return [key for key in due_keys if key in products_by_key]
+
+    async def reschedule(self, prices: Dict[str, Optional[float]], products_by_key: Dict[str, dict],
+                         stats: Optional[Dict[str, dict]] = None):
+        keys = list(prices)
+        if stats is None:
+            stats = await self.redis_client.get_product_stats(keys)
+        now = time.time()
+        due_at = {}
+        new_stats = {}
+
+        for key in keys:
+            price = prices[key]
+            previous = stats.get(key, {})
+            volatility = previous.get('volatility', 0.0)
+
+            if price is not None:
+                last_price = previous.get('price')
+                if last_price:
+                    change = abs(price - last_price) / last_price
+                    volatility = (1 - VOLATILITY_SMOOTHING) * volatility + VOLATILITY_SMOOTHING * change
+                new_stats[key] = {**previous, 'price': price, 'volatility': volatility}
+
+            tightest_target = max(
+                (float(product.get('target_price', 0)) for _, _, product in products_by_key[key]['subscribers']),
+                default=0.0
+            )
+            marketplace = key.split(':', 1)[0]
+            due_at[key] = now + self.next_interval(marketplace, volatility, price, tightest_target)
+
+        await self.redis_client.schedule_products(due_at)
+        await self.redis_client.save_product_stats(new_stats)
+        logging.info(f"Rescheduled {len(due_at)} products")
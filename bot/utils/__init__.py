@@ -1 +1 @@
-from .helpers import format_price, validate_url, generate_token, normalize_keys, to_snake_case
\ No newline at end of file
+from .helpers import format_price, validate_url, generate_token, normalize_keys, to_snake_case, canonical_product_key, get_marketplace, alert_targets
\ No newline at end of file
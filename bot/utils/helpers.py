@@ -2,7 +2,7 @@ import hashlib
 from datetime import datetime
 from urllib.parse import urlparse
 import re
-from typing import Optional
+from typing import Dict, Optional
 
 def to_snake_case(s):
     return re.sub(r'(?<!^)(?=[A-Z])', '_', s).lower()
@@ -37,12 +37,18 @@ def validate_url(url: str) -> Optional[str]:
     except Exception:
         return None
 
+MARKETPLACE_DOMAINS = {
+    'ozon.ru': 'ozon',
+    'wildberries.ru': 'wildberries',
+    'market.yandex.ru': 'yandex_market'
+}
+
 def extract_product_id(url: str) -> Optional[str]:
-    # Извлечение ID продукта из URL магазина
+    # Извлечение ID продукта из URL магазина: числовой артикул без slug-а с названием
     patterns = {
-        'ozon.ru': r'/product/([^/?]+)',
+        'ozon.ru': r'/product/(?:[^/?#]*-)?(\d+)',
         'wildberries.ru': r'/catalog/(\d+)',
-        'market.yandex.ru': r'/product--([^/?]+)'
+        'market.yandex.ru': r'/(?:product--|card/)[^/?#]+/(\d+)'
     }
 
     for domain, pattern in patterns.items():
@@ -50,3 +56,41 @@ def extract_product_id(url: str) -> Optional[str]:
             match = re.search(pattern, url)
             return match.group(1) if match else None
     return None
+
+def get_marketplace(url: str) -> Optional[str]:
+    domain = urlparse(url).netloc.replace('www.', '')
+    for marketplace_domain, marketplace in MARKETPLACE_DOMAINS.items():
+        if domain.endswith(marketplace_domain):
+            return marketplace
+    return None
+
+def canonical_product_key(url: str) -> str:
+    # Один ключ на товар, независимо от query-параметров, меток и slug-а в URL
+    marketplace = get_marketplace(url)
+    product_id = extract_product_id(url)
+    if marketplace and product_id:
+        return f"{marketplace}:{product_id}"
+    parsed = urlparse(url)
+    return f"url:{parsed.netloc.replace('www.', '')}{parsed.path.rstrip('/')}"
+
+def alert_targets(user_id: int, products: list) -> Dict[str, Dict[str, float]]:
+    # Записи индекса целевых цен: ключ товара -> {"user_id|url": целевая цена}
+    targets = {}
+    for product in products:
+        if not isinstance(product, dict):
+            continue
+        product = normalize_keys(product)
+        url = product.get('product_url')
+        if url:
+            targets.setdefault(canonical_product_key(url), {})[f"{user_id}|{url}"] = float(product.get('target_price', 0))
+    return targets
+
+def queue_alert_index_update(pipe, old_targets: dict, new_targets: dict):
+    # Индекс alert_targets:{товар} — sorted set подписчиков по целевой цене; общий для бота и backend API.
+    # Удаляем только исчезнувшие записи, остальные ZADD обновит на месте
+    for key, members in old_targets.items():
+        removed = [member for member in members if member not in new_targets.get(key, {})]
+        if removed:
+            pipe.zrem(f"alert_targets:{key}", *removed)
+    for key, members in new_targets.items():
+        pipe.zadd(f"alert_targets:{key}", members)
@@ -0,0 +1,26 @@
+import asyncio
+import logging
+from dotenv import load_dotenv
+from database.redis_client import RedisClient
+from bot.services.price_checker import PriceChecker
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+load_dotenv()
+
+# Отдельный процесс проверки цен без приёма сообщений бота: таких воркеров можно запустить несколько.
+# Уведомления воркер только кладёт в outbox — в Telegram их отправляет процесс бота
+async def main():
+    try:
+        price_checker = PriceChecker(redis_client=RedisClient(), notification_service=None)
+        await price_checker.start_monitoring()
+    except Exception as e:
+        logging.error(f"Critical error in checker: {e}", exc_info=True)
+
+if __name__ == '__main__':
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        logging.info("Received KeyboardInterrupt")
+    finally:
+        logging.info("Checker terminated")
@@ -1,4 +1,5 @@
 import os
+import socket
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -9,5 +10,63 @@ class Settings:
     REDIS_PORT = int(os.getenv("REDIS_PORT", 6379))
     REDIS_DB = int(os.getenv("REDIS_DB", 0))
     SESSION_API_URL = os.getenv("SESSION_API_URL", "http://localhost:8000")
+    # Время жизни кэша селекторов маркетплейсов в парсере (секунды)
+    SELECTORS_CACHE_TTL = int(os.getenv("SELECTORS_CACHE_TTL", 300))
+    # Пул вкладок Chromium: размер и пороги пересоздания вкладки
+    PAGE_POOL_SIZE = int(os.getenv("PAGE_POOL_SIZE", 5))
+    PAGE_MAX_NAVIGATIONS = int(os.getenv("PAGE_MAX_NAVIGATIONS", 50))
+    PAGE_MAX_MEMORY_MB = int(os.getenv("PAGE_MAX_MEMORY_MB", 256))
+    # Блокировка картинок, шрифтов и трекеров при загрузке страниц: on, off или compare
+    RESOURCE_BLOCKING = os.getenv("RESOURCE_BLOCKING", "on")
+    # Число процессов для разбора HTML; 0 — разбирать в основном процессе
+    PARSER_WORKERS = int(os.getenv("PARSER_WORKERS", 2))
+    # Сначала пробовать получить цену обычным HTTP-запросом, браузер — только при неудаче
+    HTTP_FIRST = os.getenv("HTTP_FIRST", "1") == "1"
+    # Адаптивный лимит параллельных запросов к одному маркетплейсу
+    HOST_CONCURRENCY_INITIAL = int(os.getenv("HOST_CONCURRENCY_INITIAL", 5))
+    HOST_CONCURRENCY_MIN = int(os.getenv("HOST_CONCURRENCY_MIN", 1))
+    HOST_CONCURRENCY_MAX = int(os.getenv("HOST_CONCURRENCY_MAX", 20))
+    HOST_TARGET_LATENCY = float(os.getenv("HOST_TARGET_LATENCY", 10.0))
+    # Запросы к API карточек Wildberries: размер пачки артикулов и повторы с экспоненциальной паузой
+    WB_CHUNK_SIZE = int(os.getenv("WB_CHUNK_SIZE", 100))
+    WB_RETRIES = int(os.getenv("WB_RETRIES", 3))
+    WB_RETRY_BACKOFF = float(os.getenv("WB_RETRY_BACKOFF", 1.0))
+    # Планировщик проверок: границы интервала товара, период опроса и число товаров за такт
+    MIN_CHECK_INTERVAL = int(os.getenv("MIN_CHECK_INTERVAL", 120))
+    MAX_CHECK_INTERVAL = int(os.getenv("MAX_CHECK_INTERVAL", 3600))
+    SCHEDULER_TICK = int(os.getenv("SCHEDULER_TICK", 60))
+    SCHEDULER_BATCH_LIMIT = int(os.getenv("SCHEDULER_BATCH_LIMIT", 1000))
+    # Как часто перечитывать товары всех пользователей целиком; новые товары попадают в расписание при сохранении
+    PRODUCTS_REFRESH_INTERVAL = int(os.getenv("PRODUCTS_REFRESH_INTERVAL", 600))
+    # Конвейер проверки: число загрузчиков, размер очередей и пачки обновлений для расширения
+    FETCH_WORKERS = int(os.getenv("FETCH_WORKERS", 10))
+    PIPELINE_QUEUE_SIZE = int(os.getenv("PIPELINE_QUEUE_SIZE", 500))
+    PUSH_BUFFER_SIZE = int(os.getenv("PUSH_BUFFER_SIZE", 50))
+    # Режим проверки: local — один процесс, distributed — воркеры читают задачи из Redis Stream
+    CHECKER_MODE = os.getenv("CHECKER_MODE", "local")
+    CHECKER_CONSUMER = os.getenv("CHECKER_CONSUMER", f"{socket.gethostname()}-{os.getpid()}")
+    # Через сколько секунд без подтверждения задача упавшего воркера передаётся другому
+    CHECK_CLAIM_IDLE = int(os.getenv("CHECK_CLAIM_IDLE", 300))
+    # Как часто записывать в историю цену, которая не менялась, секунды
+    PRICE_HEARTBEAT_INTERVAL = int(os.getenv("PRICE_HEARTBEAT_INTERVAL", 6 * 3600))
+    # Отложенные обновления для неактивных пользователей: не больше товаров на пользователя и срок хранения, секунды
+    PENDING_UPDATES_LIMIT = int(os.getenv("PENDING_UPDATES_LIMIT", 500))
+    PENDING_UPDATES_TTL = int(os.getenv("PENDING_UPDATES_TTL", 7 * 24 * 3600))
+    # Сколько секунд чекер доверяет полученному статусу активности пользователя
+    ACTIVITY_CACHE_TTL = int(os.getenv("ACTIVITY_CACHE_TTL", 60))
+    # Лимиты Telegram: сообщений в секунду на бота и на один чат
+    TELEGRAM_GLOBAL_RATE = float(os.getenv("TELEGRAM_GLOBAL_RATE", 25))
+    TELEGRAM_CHAT_RATE = float(os.getenv("TELEGRAM_CHAT_RATE", 1))
+    NOTIFY_WORKERS = int(os.getenv("NOTIFY_WORKERS", 8))
+    NOTIFY_QUEUE_SIZE = int(os.getenv("NOTIFY_QUEUE_SIZE", 10000))
+    # Outbox уведомлений: размер пачки, через сколько секунд повторять неподтверждённые, срок ключа дедупликации
+    OUTBOX_BATCH_SIZE = int(os.getenv("OUTBOX_BATCH_SIZE", 50))
+    OUTBOX_RETRY_IDLE = int(os.getenv("OUTBOX_RETRY_IDLE", 60))
+    ALERT_DEDUP_TTL = int(os.getenv("ALERT_DEDUP_TTL", 24 * 3600))
+    OUTBOX_MAX_INFLIGHT = int(os.getenv("OUTBOX_MAX_INFLIGHT", 10))
+    # После стольких неудачных доставок уведомление уходит в поток alert_outbox_dead
+    OUTBOX_MAX_DELIVERIES = int(os.getenv("OUTBOX_MAX_DELIVERIES", 5))
+    # Окно, в течение которого уведомления одному пользователю собираются в одну сводку, секунды (0 — без сводок)
+    ALERT_DIGEST_WINDOW = float(os.getenv("ALERT_DIGEST_WINDOW", 10))
 
 settings = Settings()
@@ -0,0 +1,20 @@
+"""Разовые миграции данных в Redis. Повторный запуск безопасен.
+
+Запуск из корня репозитория:
+    python -m database.migrations
+"""
+import asyncio
+import logging
+from database.redis_client import RedisClient
+
+
+async def run_migrations(redis_client: RedisClient):
+    # Множество users вместо SCAN по user:*
+    await redis_client.backfill_users_index()
+    # Индекс целевых цен для товаров, сохранённых до его появления
+    await redis_client.rebuild_alert_index()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    asyncio.run(run_migrations(RedisClient()))
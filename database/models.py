@@ -1,5 +1,5 @@
-from dataclasses import dataclass
-from typing import List, Optional
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Set
 
 @dataclass
 class Product:
@@ -15,3 +15,12 @@ class User:
     token: str
     is_active: bool
     products: List[Product]
+
+@dataclass
+class MonitoringSnapshot:
+    tokens: Dict[int, str] = field(default_factory=dict)
+    products: Dict[int, List[dict]] = field(default_factory=dict)
+    parsed: Dict[int, Set[str]] = field(default_factory=dict)
+
+    def is_parsed(self, user_id: int, product_url: str) -> bool:
+        return product_url in self.parsed.get(user_id, ())
@@ -0,0 +1,46 @@
+import json
+from typing import Tuple
+from bot.utils.helpers import normalize_keys
+
+# Товар хранится JSON-массивом фиксированных полей с номером схемы в начале:
+# [1, title, price, target_price, image_url, product_url, marketplace, {прочие поля}?]
+# Ключи не повторяются в каждой записи, а camelCase -> snake_case делается один раз при записи
+PRODUCT_SCHEMA_VERSION = 1
+PRODUCT_FIELDS = ('title', 'price', 'target_price', 'image_url', 'product_url', 'marketplace')
+API_FIELDS = {
+    'title': 'title',
+    'price': 'price',
+    'target_price': 'targetPrice',
+    'image_url': 'imageUrl',
+    'product_url': 'productUrl',
+    'marketplace': 'marketplace'
+}
+
+
+def encode_product(product: dict) -> str:
+    product = normalize_keys(product)
+    record = [PRODUCT_SCHEMA_VERSION, *(product.get(field) for field in PRODUCT_FIELDS)]
+    extra = {key: value for key, value in product.items() if key not in PRODUCT_FIELDS}
+    if extra:
+        record.append(extra)
+    return json.dumps(record, ensure_ascii=False, separators=(',', ':'))
+
+
+def decode_product(raw: str) -> Tuple[dict, bool]:
+    # Возвращает товар и признак того, что запись в старом формате и её стоит перезаписать
+    data = json.loads(raw)
+    if isinstance(data, list) and data and data[0] == PRODUCT_SCHEMA_VERSION:
+        # Отсутствующие поля записаны как null; не превращаем их в ключи со значением None
+        product = {field: value for field, value in zip(PRODUCT_FIELDS, data[1:]) if value is not None}
+        if len(data) > len(PRODUCT_FIELDS) + 1:
+            product.update(data[-1])
+        return product, False
+    if isinstance(data, dict):
+        # Запись до появления схемы: JSON-объект с ключами из расширения
+        return normalize_keys(data), True
+    raise ValueError(f"Unknown product record format: {raw[:100]}")
+
+
+def to_api_product(product: dict) -> dict:
+    # Расширение ждёт товары в camelCase, как в модели Product
+    return {API_FIELDS.get(key, key): value for key, value in product.items()}
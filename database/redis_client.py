@@ -1,43 +1,191 @@
 import redis.asyncio as redis
+from redis.exceptions import ResponseError, WatchError
 import json
-from bot.utils.helpers import normalize_keys 
+import time
+from typing import Tuple
+from bot.utils.helpers import alert_targets, queue_alert_index_update
+from database.models import MonitoringSnapshot
+from database.product_codec import decode_product, encode_product
 import logging
 
+SNAPSHOT_CHUNK_SIZE = 500
+USERS_KEY = "users"
+USERS_MIGRATED_KEY = "users_index_migrated"
+CHECK_STREAM = "check_queue"
+CHECK_GROUP = "checkers"
+CHECK_STREAM_MAXLEN = 100000
+OUTBOX_STREAM = "alert_outbox"
+OUTBOX_GROUP = "notifiers"
+OUTBOX_STREAM_MAXLEN = 100000
+OUTBOX_DEAD_STREAM = "alert_outbox_dead"
+# Ключ дедупликации ставится только после успешного XADD и в том же скрипте,
+# поэтому сбой между командами не может потерять уведомление
+ENQUEUE_ALERT_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    return 0
+end
+redis.call('XADD', KEYS[2], 'MAXLEN', '~', ARGV[2], '*', 'alert', ARGV[3])
+redis.call('SET', KEYS[1], 1, 'EX', ARGV[1])
+return 1
+"""
+# Захват или продление своей блокировки одной командой: между проверкой владельца
+# и EXPIRE чужой экземпляр не успеет перехватить истёкшую блокировку
+ACQUIRE_LOCK_SCRIPT = """
+if redis.call('SET', KEYS[1], ARGV[1], 'NX', 'EX', ARGV[2]) then
+    return 1
+end
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    redis.call('EXPIRE', KEYS[1], ARGV[2])
+    return 1
+end
+return 0
+"""
+# Отложенные обновления: хеш товар -> обновление и ZSET товар -> время обновления.
+# Запись и обрезка до лимита выполняются одним скриптом, поэтому выбор самых старых
+# стоит O(log n) и не пересекается с pop_pending_updates
+ADD_PENDING_UPDATES_SCRIPT = """
+for i = 4, #ARGV, 2 do
+    redis.call('HSET', KEYS[1], ARGV[i], ARGV[i + 1])
+    redis.call('ZADD', KEYS[2], ARGV[3], ARGV[i])
+end
+redis.call('EXPIRE', KEYS[1], ARGV[1])
+redis.call('EXPIRE', KEYS[2], ARGV[1])
+local excess = redis.call('ZCARD', KEYS[2]) - tonumber(ARGV[2])
+if excess > 0 then
+    for _, url in ipairs(redis.call('ZRANGE', KEYS[2], 0, excess - 1)) do
+        redis.call('HDEL', KEYS[1], url)
+    end
+    redis.call('ZREMRANGEBYRANK', KEYS[2], 0, excess - 1)
+end
+return excess
+"""
+
 class RedisClient:
     def __init__(self, host='localhost', port=6379, db=0):
         self.client = redis.Redis(host=host, port=port, db=db, decode_responses=True)
 
     async def save_user(self, user_id: int, token: str):
         data = {"token": token, "is_active": "1"}
-        await self.client.hmset(f"user:{user_id}", data)
+        async with self.client.pipeline(transaction=True) as pipe:
+            pipe.hset(f"user:{user_id}", mapping=data)
+            pipe.sadd(USERS_KEY, user_id)
+            await pipe.execute()
 
     async def get_user_token(self, user_id: int) -> str:
         return await self.client.hget(f"user:{user_id}", "token")
 
     async def delete_user(self, user_id: int):
-        await self.client.delete(f"user:{user_id}")
-        await self.client.delete(f"products:{user_id}")
+        def queue_delete(pipe, old_products: list):
+            pipe.delete(f"user:{user_id}", f"products:{user_id}")
+            pipe.srem(USERS_KEY, user_id)
+            queue_alert_index_update(pipe, alert_targets(user_id, old_products), {})
+
+        await self._replace_products(user_id, queue_delete)
 
     async def save_products(self, user_id: int, products: list):
-        await self.client.delete(f"products:{user_id}")
-        for product in products:
-            await self.client.rpush(f"products:{user_id}", json.dumps(product))
+        # Список и индексы меняются одной транзакцией MULTI/EXEC: читатели не увидят пустой или
+        # наполовину записанный список, а число запросов не зависит от количества товаров
+        def queue_save(pipe, old_products: list):
+            pipe.delete(f"products:{user_id}")
+            pipe.sadd(USERS_KEY, user_id)
+            new_targets = alert_targets(user_id, products)
+            if products:
+                pipe.rpush(f"products:{user_id}", *(encode_product(product) for product in products))
+            queue_alert_index_update(pipe, alert_targets(user_id, old_products), new_targets)
+            if new_targets:
+                # Новый товар сразу попадает в расписание проверок; у уже известных срок не меняется
+                pipe.zadd("check_schedule", {key: time.time() for key in new_targets}, nx=True)
+
+        await self._replace_products(user_id, queue_save)
+
+    async def _replace_products(self, user_id: int, queue_writes):
+        # Старый список нужен, чтобы убрать его записи из индекса целевых цен. Следим за ним через
+        # WATCH: если его перезаписали между чтением и EXEC, читаем заново, иначе в индексе
+        # останутся записи товаров, которых у пользователя уже нет
+        key = f"products:{user_id}"
+        async with self.client.pipeline(transaction=True) as pipe:
+            while True:
+                try:
+                    await pipe.watch(key)
+                    old_products, _ = self._decode_products(await pipe.lrange(key, 0, -1))
+                    pipe.multi()
+                    queue_writes(pipe, old_products)
+                    await pipe.execute()
+                    return
+                except WatchError:
+                    # execute уже сбросил конвейер, повторяем с новым снимком списка
+                    continue
+
+    async def get_triggered_alerts(self, key: str, price: float) -> set:
+        # Подписчики, чья целевая цена не ниже текущей, одним запросом по индексу
+        members = await self.client.zrangebyscore(f"alert_targets:{key}", price, "+inf")
+        triggered = set()
+        for member in members:
+            user_id, url = member.split("|", 1)
+            triggered.add((int(user_id), url))
+        return triggered
+
+    async def rebuild_alert_index(self):
+        # Заполняет индекс для товаров, сохранённых до его появления; повторный запуск безопасен
+        snapshot = await self.load_monitoring_snapshot()
+        user_ids = list(snapshot.products)
+        keys = set()
+        # ZADD только добавляет записи, поэтому индекс можно писать кусками по пользователям,
+        # не собирая его целиком и не отправляя одним огромным конвейером
+        for i in range(0, len(user_ids), SNAPSHOT_CHUNK_SIZE):
+            async with self.client.pipeline(transaction=False) as pipe:
+                for user_id in user_ids[i:i + SNAPSHOT_CHUNK_SIZE]:
+                    targets = alert_targets(user_id, snapshot.products[user_id])
+                    keys.update(targets)
+                    queue_alert_index_update(pipe, {}, targets)
+                await pipe.execute()
+        logging.info(f"Alert index rebuilt for {len(keys)} products")
+
+    def _decode_products(self, products_data: list) -> Tuple[list, bool]:
+        # Возвращает товары и признак того, что среди записей есть старый JSON-формат
+        products = []
+        has_legacy = False
+        for p in products_data:
+            try:
+                product, legacy = decode_product(p)
+                products.append(product)
+                has_legacy = has_legacy or legacy
+            except ValueError as e:
+                logging.error(f"Ошибка декодирования товара: {p}. Ошибка: {e}")
+                continue
+        return products, has_legacy
+
+    async def migrate_products(self, user_id: int):
+        # Ленивая миграция: перезаписываем список в компактном формате, если его не изменили параллельно
+        key = f"products:{user_id}"
+        async with self.client.pipeline(transaction=True) as pipe:
+            try:
+                await pipe.watch(key)
+                records = []
+                for raw in await pipe.lrange(key, 0, -1):
+                    try:
+                        product, legacy = decode_product(raw)
+                        records.append(encode_product(product) if legacy else raw)
+                    except ValueError:
+                        # Нечитаемую запись не теряем, оставляем как есть
+                        records.append(raw)
+                pipe.multi()
+                pipe.delete(key)
+                if records:
+                    pipe.rpush(key, *records)
+                await pipe.execute()
+            except WatchError:
+                # Список успели перезаписать, новые записи уже в компактном формате
+                pass
 
     async def get_products(self, user_id: int) -> list:
         try:
             products_data = await self.client.lrange(f"products:{user_id}", 0, -1)
             
             if products_data:
-                products = []
-                for p in products_data:
-                    try:
-                        product = json.loads(p)
-                        normalized_product = normalize_keys(product)
-                        products.append(normalized_product)
-                    except json.JSONDecodeError as e:
-                        logging.error(f"Ошибка декодирования JSON для товара: {p}. Ошибка: {e}")
-                        continue
-                
+                products, has_legacy = self._decode_products(products_data)
+                if has_legacy:
+                    await self.migrate_products(user_id)
                 return products
             logging.warning(f"Товары не найдены для пользователя {user_id}")
             return []
@@ -53,19 +201,228 @@ class RedisClient:
             return {}
 
     async def get_all_users(self) -> list:
+        # Множество users ведут регистрация, удаление и сохранение товаров
+        # Решаем только по маркеру: до миграции в множестве могут быть лишь новые пользователи
+        if not await self.client.exists(USERS_MIGRATED_KEY):
+            await self.backfill_users_index()
+        user_ids = await self.client.smembers(USERS_KEY)
+        return [int(user_id) for user_id in user_ids]
+
+    async def backfill_users_index(self) -> list:
         user_ids = []
         cursor = 0
         while True:
-            cursor, keys = await self.client.scan(cursor=cursor, match='user:*', count=100)
-            for key in keys:
-                user_id = key.split(':')[1]
-                user_ids.append(int(user_id))
+            cursor, keys = await self.client.scan(cursor=cursor, match='user:*', count=1000)
+            user_ids.extend(int(key.split(':')[1]) for key in keys)
             if cursor == 0:
                 break
+        async with self.client.pipeline(transaction=True) as pipe:
+            if user_ids:
+                pipe.sadd(USERS_KEY, *user_ids)
+            pipe.set(USERS_MIGRATED_KEY, 1)
+            await pipe.execute()
+        logging.info(f"Users index backfilled with {len(user_ids)} users")
         return user_ids
 
     async def is_already_parsed(self, user_id: int, product_url: str) -> bool:
         return await self.client.sismember(f"parsed:{user_id}", product_url)
 
     async def mark_as_parsed(self, user_id: int, product_url: str):
-        await self.client.sadd(f"parsed:{user_id}", product_url)
\ No newline at end of file
+        await self.client.sadd(f"parsed:{user_id}", product_url)
+
+    async def load_monitoring_snapshot(self) -> MonitoringSnapshot:
+        # Токены, товары и отметки об уведомлениях всех пользователей за несколько конвейерных запросов
+        snapshot = MonitoringSnapshot()
+        user_ids = await self.get_all_users()
+        legacy_users = []
+
+        for i in range(0, len(user_ids), SNAPSHOT_CHUNK_SIZE):
+            chunk = user_ids[i:i + SNAPSHOT_CHUNK_SIZE]
+            async with self.client.pipeline(transaction=False) as pipe:
+                for user_id in chunk:
+                    pipe.hget(f"user:{user_id}", "token")
+                    pipe.lrange(f"products:{user_id}", 0, -1)
+                results = await pipe.execute()
+
+            urls_by_user = {}
+            for user_id, token, products_data in zip(chunk, results[::2], results[1::2]):
+                if token:
+                    snapshot.tokens[user_id] = token
+                products, has_legacy = self._decode_products(products_data)
+                if has_legacy:
+                    legacy_users.append(user_id)
+                snapshot.products[user_id] = products
+                urls = [product['product_url'] for product in products if product.get('product_url')]
+                if urls:
+                    urls_by_user[user_id] = urls
+
+            if not urls_by_user:
+                continue
+
+            async with self.client.pipeline(transaction=False) as pipe:
+                for user_id, urls in urls_by_user.items():
+                    pipe.smismember(f"parsed:{user_id}", urls)
+                flags = await pipe.execute()
+
+            for (user_id, urls), user_flags in zip(urls_by_user.items(), flags):
+                parsed = {url for url, flag in zip(urls, user_flags) if flag}
+                if parsed:
+                    snapshot.parsed[user_id] = parsed
+
+        # Списки в старом формате переписываем один раз, дальше они читаются без нормализации ключей
+        for user_id in legacy_users:
+            await self.migrate_products(user_id)
+        return snapshot
+
+    async def schedule_products(self, due_at: dict, only_new: bool = False):
+        if due_at:
+            await self.client.zadd("check_schedule", due_at, nx=only_new)
+
+    async def get_due_products(self, now: float, limit: int) -> list:
+        return await self.client.zrangebyscore("check_schedule", "-inf", now, start=0, num=limit)
+
+    async def unschedule_products(self, keys: list):
+        if keys:
+            await self.client.zrem("check_schedule", *keys)
+
+    async def get_product_stats(self, keys: list) -> dict:
+        if not keys:
+            return {}
+        values = await self.client.hmget("product_stats", keys)
+        return {key: json.loads(value) for key, value in zip(keys, values) if value}
+
+    async def save_product_stats(self, stats: dict):
+        if stats:
+            await self.client.hset("product_stats", mapping={key: json.dumps(value) for key, value in stats.items()})
+
+    async def add_pending_updates(self, token: str, updates: list, limit: int, ttl: int):
+        # Хеш pending_updates:{token}: по одному полю на товар, новая цена перезаписывает старую.
+        # Сверх лимита выкидываются самые старые обновления по ZSET pending_updates_order:{token}
+        if not updates:
+            return
+        fields = []
+        for update in updates:
+            fields.extend((update["product_url"], json.dumps(update)))
+        await self.client.eval(
+            ADD_PENDING_UPDATES_SCRIPT, 2, f"pending_updates:{token}", f"pending_updates_order:{token}",
+            ttl, limit, time.time(), *fields
+        )
+
+    async def pop_pending_updates(self, token: str) -> list:
+        key = f"pending_updates:{token}"
+        async with self.client.pipeline(transaction=True) as pipe:
+            pipe.hgetall(key)
+            pipe.delete(key, f"pending_updates_order:{token}")
+            stored, _ = await pipe.execute()
+        updates = []
+        for value in stored.values():
+            update = json.loads(value)
+            # Записи, сохранённые до появления ZSET, хранили время обновления в самом JSON
+            update.pop("updated_at", None)
+            updates.append(update)
+        return updates
+
+    async def get_tokens_with_pending_updates(self, tokens: list) -> list:
+        async with self.client.pipeline(transaction=False) as pipe:
+            for token in tokens:
+                pipe.exists(f"pending_updates:{token}")
+            exists = await pipe.execute()
+        return [token for token, found in zip(tokens, exists) if found]
+
+    async def acquire_lock(self, name: str, owner: str, ttl: int) -> bool:
+        return bool(await self.client.eval(ACQUIRE_LOCK_SCRIPT, 1, f"lock:{name}", owner, ttl))
+
+    async def _ensure_group(self, stream: str, group: str):
+        try:
+            await self.client.xgroup_create(stream, group, id="$", mkstream=True)
+        except ResponseError as e:
+            if "BUSYGROUP" not in str(e):
+                raise
+
+    async def _read_group(self, stream: str, group: str, consumer: str, field: str, count: int, block_ms: int) -> list:
+        response = await self.client.xreadgroup(group, consumer, {stream: ">"}, count=count, block=block_ms)
+        return [
+            (message_id, fields[field])
+            for _, messages in response or []
+            for message_id, fields in messages
+            if fields and field in fields
+        ]
+
+    async def _claim_stale(self, stream: str, group: str, consumer: str, field: str, min_idle_ms: int, count: int) -> list:
+        # Забираем сообщения, которые другой потребитель получил, но так и не подтвердил
+        response = await self.client.xautoclaim(
+            stream, group, consumer, min_idle_time=min_idle_ms, start_id="0-0", count=count
+        )
+        return [
+            (message_id, fields[field])
+            for message_id, fields in response[1]
+            if fields and field in fields
+        ]
+
+    async def ensure_check_group(self):
+        await self._ensure_group(CHECK_STREAM, CHECK_GROUP)
+
+    async def publish_check_tasks(self, keys: list):
+        async with self.client.pipeline(transaction=False) as pipe:
+            for key in keys:
+                pipe.xadd(CHECK_STREAM, {"key": key}, maxlen=CHECK_STREAM_MAXLEN, approximate=True)
+            await pipe.execute()
+
+    async def read_check_tasks(self, consumer: str, count: int, block_ms: int) -> list:
+        return await self._read_group(CHECK_STREAM, CHECK_GROUP, consumer, "key", count, block_ms)
+
+    async def claim_stale_check_tasks(self, consumer: str, min_idle_ms: int, count: int) -> list:
+        return await self._claim_stale(CHECK_STREAM, CHECK_GROUP, consumer, "key", min_idle_ms, count)
+
+    async def ack_check_tasks(self, message_ids: list):
+        if message_ids:
+            await self.client.xack(CHECK_STREAM, CHECK_GROUP, *message_ids)
+
+    async def enqueue_alert(self, alert: dict, dedup_key: str, dedup_ttl: int) -> bool:
+        # Одно событие цены — одна запись в outbox, даже если его нашли несколько воркеров или повторов
+        added = await self.client.eval(
+            ENQUEUE_ALERT_SCRIPT, 2, f"alert_dedup:{dedup_key}", OUTBOX_STREAM,
+            dedup_ttl, OUTBOX_STREAM_MAXLEN, json.dumps(alert)
+        )
+        return bool(added)
+
+    async def ensure_outbox_group(self):
+        await self._ensure_group(OUTBOX_STREAM, OUTBOX_GROUP)
+
+    async def read_outbox(self, consumer: str, count: int, block_ms: int) -> list:
+        messages = await self._read_group(OUTBOX_STREAM, OUTBOX_GROUP, consumer, "alert", count, block_ms)
+        return [(message_id, json.loads(alert)) for message_id, alert in messages]
+
+    async def claim_stale_outbox(self, consumer: str, min_idle_ms: int, count: int, exclude=()) -> list:
+        # В отличие от XAUTOCLAIM смотрим PEL сами: сообщения из exclude этот процесс ещё доставляет
+        # (ждёт окна сводки или лимитов Telegram), их забирать нельзя. Заодно узнаём число доставок
+        pending = await self.client.xpending_range(
+            OUTBOX_STREAM, OUTBOX_GROUP, min="-", max="+", count=count + len(exclude), idle=min_idle_ms
+        )
+        deliveries = {
+            entry["message_id"]: entry["times_delivered"]
+            for entry in pending if entry["message_id"] not in exclude
+        }
+        message_ids = list(deliveries)[:count]
+        if not message_ids:
+            return []
+        # XCLAIM с min_idle_time пропустит сообщения, которые другой процесс забрал между запросами
+        claimed = await self.client.xclaim(OUTBOX_STREAM, OUTBOX_GROUP, consumer, min_idle_ms, message_ids)
+        return [
+            (message_id, json.loads(fields["alert"]), deliveries[message_id])
+            for message_id, fields in claimed
+            if fields and "alert" in fields
+        ]
+
+    async def dead_letter_outbox(self, messages: list):
+        # Сообщения, которые так и не удалось доставить, переносим в отдельный поток для разбора
+        async with self.client.pipeline(transaction=True) as pipe:
+            for message_id, alert in messages:
+                pipe.xadd(OUTBOX_DEAD_STREAM, {"alert": json.dumps(alert), "source_id": message_id},
+                          maxlen=OUTBOX_STREAM_MAXLEN, approximate=True)
+            pipe.xack(OUTBOX_STREAM, OUTBOX_GROUP, *(message_id for message_id, _ in messages))
+            await pipe.execute()
+
+    async def ack_outbox(self, message_ids: list):
+        if message_ids:
+            await self.client.xack(OUTBOX_STREAM, OUTBOX_GROUP, *message_ids)
@@ -6,6 +6,7 @@ from dotenv import load_dotenv
 import os
 from database.redis_client import RedisClient
 from bot.services.notification_service import NotificationService
+from bot.services.notification_dispatcher import NotificationDispatcher
 from bot.services.price_checker import PriceChecker
 import logging
 import signal
@@ -69,7 +70,9 @@ async def setup_routers():
 
 async def main():
     try:
-        notification_service = NotificationService(bot=bot)
+        notification_dispatcher = NotificationDispatcher(bot)
+        notification_dispatcher.start()
+        notification_service = NotificationService(bot=bot, dispatcher=notification_dispatcher)
         price_checker = PriceChecker(
             redis_client=redis_client,
             notification_service=notification_service
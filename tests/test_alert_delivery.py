@@ -0,0 +1,90 @@
+import asyncio
+import pytest
+from unittest.mock import AsyncMock, MagicMock
+from aiogram.exceptions import TelegramForbiddenError
+from bot.services.alert_delivery import AlertDelivery
+
+def make_alert(user_id):
+    return {
+        'user_id': user_id,
+        'product_title': 'Phone',
+        'current_price': 900.0,
+        'target_price': 1000.0,
+        'product_url': 'https://www.ozon.ru/product/phone-1/'
+    }
+
+@pytest.fixture
+def redis_client():
+    mock_redis = MagicMock()
+    mock_redis.claim_stale_outbox = AsyncMock(return_value=[])
+    mock_redis.read_outbox = AsyncMock(return_value=[])
+    mock_redis.ack_outbox = AsyncMock()
+    return mock_redis
+
+@pytest.fixture
+def notification_service():
+    mock_notification = MagicMock()
+    mock_notification.deliver_price_alert = AsyncMock()
+    return mock_notification
+
+@pytest.mark.asyncio
+async def test_only_successful_sends_acked(redis_client, notification_service):
+    """Тест, что подтверждаются только отправленные уведомления, а неудачные остаются на повтор"""
+    redis_client.read_outbox = AsyncMock(return_value=[('1-0', make_alert(1)), ('2-0', make_alert(2))])
+    notification_service.deliver_price_alert = AsyncMock(side_effect=[None, RuntimeError('Telegram is down')])
+    delivery = AlertDelivery(redis_client, notification_service, 'worker-1')
+
+    assert await delivery.deliver_once(block_ms=0) == 1
+
+    redis_client.ack_outbox.assert_called_once_with(['1-0'])
+    notification_service.deliver_price_alert.assert_any_call(**make_alert(1))
+
+@pytest.mark.asyncio
+async def test_stale_messages_retried_and_permanent_errors_dropped(redis_client, notification_service):
+    """Тест повторной доставки зависших сообщений и снятия с очереди сообщений заблокировавшим бота"""
+    redis_client.claim_stale_outbox = AsyncMock(return_value=[('1-0', make_alert(1), 2)])
+    notification_service.deliver_price_alert = AsyncMock(
+        side_effect=TelegramForbiddenError(method=MagicMock(), message='bot was blocked by the user')
+    )
+    delivery = AlertDelivery(redis_client, notification_service, 'worker-1')
+    delivery.batch_size = 1
+
+    await delivery.deliver_once(block_ms=0)
+
+    redis_client.claim_stale_outbox.assert_called_once_with('worker-1', delivery.retry_idle * 1000, 1, exclude=set())
+    redis_client.read_outbox.assert_not_called()
+    redis_client.ack_outbox.assert_called_once_with(['1-0'])
+
+@pytest.mark.asyncio
+async def test_inflight_messages_not_reclaimed(redis_client, notification_service):
+    """Тест, что сообщения, которые процесс ещё доставляет, не забираются им же повторно"""
+    release = asyncio.Event()
+
+    async def slow_delivery(**alert):
+        await release.wait()
+
+    notification_service.deliver_price_alert = AsyncMock(side_effect=slow_delivery)
+    redis_client.read_outbox = AsyncMock(side_effect=[[('1-0', make_alert(1))], []])
+    delivery = AlertDelivery(redis_client, notification_service, 'worker-1')
+
+    task = asyncio.create_task(delivery._deliver_batch(await delivery._fetch(0)))
+    await asyncio.sleep(0)
+    await delivery._fetch(0)
+
+    assert redis_client.claim_stale_outbox.call_args.kwargs['exclude'] == {'1-0'}
+    release.set()
+    await task
+    assert delivery._inflight_ids == set()
+
+@pytest.mark.asyncio
+async def test_repeatedly_failing_message_dead_lettered(redis_client, notification_service):
+    """Тест, что сообщение после предельного числа доставок уходит в dead letter, а не повторяется вечно"""
+    redis_client.claim_stale_outbox = AsyncMock(return_value=[('1-0', make_alert(1), 5), ('2-0', make_alert(2), 1)])
+    redis_client.dead_letter_outbox = AsyncMock()
+    delivery = AlertDelivery(redis_client, notification_service, 'worker-1')
+    delivery.max_deliveries = 5
+
+    assert await delivery.deliver_once(block_ms=0) == 1
+
+    redis_client.dead_letter_outbox.assert_called_once_with([('1-0', make_alert(1))])
+    notification_service.deliver_price_alert.assert_called_once_with(**make_alert(2))
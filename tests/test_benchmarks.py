@@ -0,0 +1,38 @@
+import json
+from benchmarks.bench_parser import build_cases, compare, load_fixtures, main
+from bot.services.extraction import extract_price_from_html
+
+def test_fixtures_produce_expected_prices():
+    """Тест, что сохранённые страницы разбираются в ожидаемые цены"""
+    fixtures = load_fixtures()
+    cases = build_cases(fixtures)
+
+    assert extract_price_from_html(fixtures['pages']['ozon'], fixtures['selectors']['ozon']) == 26490.0
+    assert extract_price_from_html(fixtures['pages']['yandex_market'], fixtures['selectors']['yandex_market']) == 8490.0
+    assert len(cases['wb_json']()) == 100
+
+def test_compare_reports_regressions():
+    """Тест обнаружения регрессии относительно эталона"""
+    baseline = {'wb_json': {'ops_per_sec': 100.0, 'peak_kb': 10.0}}
+
+    assert compare({'wb_json': {'ops_per_sec': 90.0, 'peak_kb': 10.0}}, baseline, 20) == []
+    assert len(compare({'wb_json': {'ops_per_sec': 70.0, 'peak_kb': 10.0}}, baseline, 20)) == 1
+    assert len(compare({'wb_json': {'ops_per_sec': 100.0, 'peak_kb': 13.0}}, baseline, 20)) == 1
+
+def test_check_fails_without_baseline(tmp_path):
+    """Тест, что режим --check не проходит молча без эталона"""
+    args = ['--baseline', str(tmp_path / 'baseline.json'), '--filter', 'wb_json', '--min-time', '0.01']
+
+    assert main(args) == 0
+    assert main(args + ['--check']) == 1
+
+def test_check_fails_on_missing_baseline_entry(tmp_path):
+    """Тест, что режим --check считает ошибкой замер без записи в эталоне"""
+    baseline = tmp_path / 'baseline.json'
+    baseline.write_text(json.dumps({}), encoding='utf-8')
+    args = ['--baseline', str(baseline), '--filter', 'wb_json', '--min-time', '0.01']
+
+    assert main(args) == 0
+    assert main(args + ['--check']) == 1
+    assert main(['--save-baseline'] + args) == 0
+    assert main(args + ['--check', '--max-regression', '1000']) == 0
@@ -0,0 +1,85 @@
+import asyncio
+import pytest
+from bot.services.concurrency import AdaptiveLimiter
+
+@pytest.mark.asyncio
+async def test_limit_raised_after_healthy_requests():
+    """Тест увеличения лимита после серии быстрых успешных запросов"""
+    limiter = AdaptiveLimiter('ozon', initial=2, maximum=3)
+
+    for _ in range(2):
+        async with limiter.acquire() as started_at:
+            pass
+        limiter.record_success(started_at)
+
+    assert limiter.limit == 3
+
+@pytest.mark.asyncio
+async def test_limit_halved_on_throttle():
+    """Тест уменьшения лимита вдвое при капче или 429"""
+    limiter = AdaptiveLimiter('ozon', initial=8, minimum=1)
+
+    limiter.record_throttle('HTTP 429')
+    assert limiter.limit == 4
+    limiter.record_throttle('captcha')
+    limiter.record_throttle('captcha')
+    limiter.record_throttle('captcha')
+    assert limiter.limit == 1
+
+@pytest.mark.asyncio
+async def test_concurrent_throttles_lower_limit_once():
+    """Тест, что одновременные 429 от запросов, начатых до снижения, уменьшают лимит один раз"""
+    limiter = AdaptiveLimiter('wildberries', initial=16, maximum=16)
+
+    async def request():
+        async with limiter.acquire() as started_at:
+            await asyncio.sleep(0.01)
+        limiter.record_throttle('HTTP 429', started_at)
+
+    await asyncio.gather(*(request() for _ in range(5)))
+    assert limiter.limit == 8
+
+    # Запрос, ушедший после снижения, снова может его уменьшить
+    await request()
+    assert limiter.limit == 4
+
+@pytest.mark.asyncio
+async def test_requests_without_reported_success_do_not_raise_limit():
+    """Тест, что запросы без цены (ошибки, промахи браузера) не засчитываются как успешные"""
+    limiter = AdaptiveLimiter('wildberries', initial=1, maximum=3)
+
+    for _ in range(3):
+        async with limiter.acquire():
+            pass
+
+    assert limiter.limit == 1
+    assert limiter.metrics()['successes'] == 0
+
+@pytest.mark.asyncio
+async def test_slow_requests_do_not_raise_limit():
+    """Тест, что медленные ответы не увеличивают лимит"""
+    limiter = AdaptiveLimiter('yandex_market', initial=1, target_latency=0.0)
+
+    for _ in range(3):
+        async with limiter.acquire() as started_at:
+            await asyncio.sleep(0.01)
+        limiter.record_success(started_at)
+
+    assert limiter.limit == 1
+
+@pytest.mark.asyncio
+async def test_concurrency_bounded_by_limit():
+    """Тест, что одновременно выполняется не больше limit запросов"""
+    limiter = AdaptiveLimiter('ozon', initial=2, maximum=2)
+    peak = 0
+
+    async def task():
+        nonlocal peak
+        async with limiter.acquire():
+            peak = max(peak, limiter.active)
+            await asyncio.sleep(0.01)
+
+    await asyncio.gather(*(task() for _ in range(6)))
+
+    assert peak == 2
+    assert limiter.metrics()['active'] == 0
@@ -0,0 +1,52 @@
+from bot.services.extraction import extract_price, extract_price_from_html, extract_price_from_texts
+
+def test_extract_price_with_separators():
+    """Тест извлечения цены с неразрывными пробелами"""
+    assert extract_price('12\xa0345 ₽') == 12345.0
+    assert extract_price('1 299,50 ₽') == 1299.5
+
+def test_extract_price_without_card_discount():
+    """Тест извлечения цены без карты из строки вида 'с картой / без:'"""
+    assert extract_price('1 000 ₽ с Ozon Картой, без: 1 200 ₽') == 1200.0
+
+def test_extract_price_invalid():
+    """Тест обработки пустого и нечислового текста"""
+    assert extract_price('') is None
+    assert extract_price('Нет в наличии') is None
+    assert extract_price('0 ₽') is None
+
+def test_extract_price_from_texts_skips_non_prices():
+    """Тест, что берётся первый текст, содержащий цену"""
+    assert extract_price_from_texts([None, 'Нет в наличии', '2 500 ₽']) == 2500.0
+
+def test_extract_price_from_html_tries_selectors_in_order():
+    """Тест перебора селекторов по одному разобранному документу"""
+    html = '<div><span class="old">Скидка</span><span class="new">3 000 ₽</span></div>'
+    assert extract_price_from_html(html, ['.missing', '.old', '.new']) == 3000.0
+    assert extract_price_from_html(html, ['.missing']) is None
+
+def test_json_ld_offer_price():
+    """Тест извлечения цены из JSON-LD, включая @graph и AggregateOffer"""
+    html = (
+        '<script type="application/ld+json">{"@graph": [{"@type": "Product", '
+        '"offers": {"@type": "AggregateOffer", "lowPrice": 1990}}]}</script>'
+    )
+    assert extract_price_from_html(html, []) == 1990.0
+
+def test_microdata_price():
+    """Тест извлечения цены из микроразметки itemprop=price"""
+    html = '<div><meta content="2490.00" itemprop="price"><span class="price">9 999 ₽</span></div>'
+    assert extract_price_from_html(html, ['.price']) == 2490.0
+
+def test_ozon_page_state_price_without_card():
+    """Тест извлечения цены без Ozon Карты из состояния виджета webPrice"""
+    html = (
+        '<div id="state-webPrice-123-default-1" '
+        'data-state=\'{"cardPrice":"1 079 ₽","price":"1 124 ₽","originalPrice":"2 990 ₽"}\'></div>'
+    )
+    assert extract_price_from_html(html, []) == 1124.0
+
+def test_broken_json_ld_falls_back_to_selectors():
+    """Тест перехода к селекторам при невалидном JSON-LD"""
+    html = '<script type="application/ld+json">{broken</script><span class="price">3 000 ₽</span>'
+    assert extract_price_from_html(html, ['.price']) == 3000.0
@@ -0,0 +1,36 @@
+from bot.utils.helpers import alert_targets, canonical_product_key, extract_product_id, get_marketplace
+
+def test_extract_product_id_numeric():
+    """Тест извлечения числового артикула из URL маркетплейсов"""
+    assert extract_product_id('https://www.ozon.ru/product/smartfon-test-123456/?asb=1') == '123456'
+    assert extract_product_id('https://www.wildberries.ru/catalog/150000001/detail.aspx') == '150000001'
+    assert extract_product_id('https://market.yandex.ru/product--naushniki/102938?sku=1') == '102938'
+
+def test_get_marketplace():
+    """Тест определения маркетплейса по домену"""
+    assert get_marketplace('https://www.ozon.ru/product/123/') == 'ozon'
+    assert get_marketplace('https://market.yandex.ru/card/test/1') == 'yandex_market'
+    assert get_marketplace('https://example.com/product/1') is None
+
+def test_canonical_key_ignores_query_and_slug():
+    """Тест, что URL одного товара с разными метками дают один ключ"""
+    assert canonical_product_key('https://www.ozon.ru/product/smartfon-123456/?utm_source=a') == \
+        canonical_product_key('https://ozon.ru/product/123456/') == 'ozon:123456'
+    assert canonical_product_key('https://market.yandex.ru/product--a/102938?sku=1') == \
+        canonical_product_key('https://market.yandex.ru/card/b/102938') == 'yandex_market:102938'
+
+def test_canonical_key_fallback_to_path():
+    """Тест запасного ключа по домену и пути для нераспознанных URL"""
+    assert canonical_product_key('https://www.example.com/item/1/?ref=x') == 'url:example.com/item/1'
+
+def test_alert_targets_accepts_camel_case():
+    """Тест построения записей индекса целевых цен из товаров расширения"""
+    products = [
+        {'productUrl': 'https://www.wildberries.ru/catalog/7/detail.aspx', 'targetPrice': 990},
+        {'product_url': 'https://www.ozon.ru/product/x-3/', 'target_price': '150.5'},
+        '{"not": "a dict"}'
+    ]
+    assert alert_targets(1, products) == {
+        'wildberries:7': {'1|https://www.wildberries.ru/catalog/7/detail.aspx': 990.0},
+        'ozon:3': {'1|https://www.ozon.ru/product/x-3/': 150.5}
+    }
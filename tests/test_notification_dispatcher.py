@@ -0,0 +1,112 @@
+import asyncio
+import time
+import pytest
+from unittest.mock import AsyncMock, MagicMock
+from aiogram.exceptions import TelegramForbiddenError, TelegramRetryAfter
+from bot.services.notification_dispatcher import NotificationDispatcher, TokenBucket
+from bot.services.notification_service import NotificationService
+
+@pytest.fixture
+def bot_mock():
+    mock_bot = MagicMock()
+    mock_bot.send_message = AsyncMock(return_value='message')
+    return mock_bot
+
+@pytest.mark.asyncio
+async def test_token_bucket_limits_rate():
+    """Тест, что после исчерпания запаса ведро выдаёт токены не быстрее заданной скорости"""
+    bucket = TokenBucket(rate=50, capacity=2)
+    start = time.monotonic()
+    for _ in range(5):
+        await bucket.acquire()
+    assert time.monotonic() - start >= 3 / 50 * 0.9
+
+@pytest.mark.asyncio
+async def test_submit_does_not_block_and_delivers(bot_mock):
+    """Тест, что постановка в очередь не ждёт отправки, а future получает результат"""
+    dispatcher = NotificationDispatcher(bot_mock, workers=2, global_rate=100, chat_rate=100)
+    future = dispatcher.submit(1, 'hello', parse_mode='HTML')
+    assert not future.done()
+    assert dispatcher.metrics()['queue_depth'] == 1
+
+    dispatcher.start()
+    assert await asyncio.wait_for(future, 1) == 'message'
+    await dispatcher.stop()
+
+    bot_mock.send_message.assert_called_once_with(chat_id=1, text='hello', parse_mode='HTML')
+    metrics = dispatcher.metrics()
+    assert metrics['sent'] == 1 and metrics['queue_depth'] == 0
+    assert metrics['avg_latency'] is not None
+
+@pytest.mark.asyncio
+async def test_retry_after_is_honored(bot_mock):
+    """Тест повтора сообщения после RetryAfter с паузой не меньше указанной Telegram"""
+    bot_mock.send_message = AsyncMock(side_effect=[
+        TelegramRetryAfter(method=MagicMock(), message='Flood control', retry_after=0.05),
+        'message'
+    ])
+    dispatcher = NotificationDispatcher(bot_mock, workers=1, global_rate=100, chat_rate=100)
+    dispatcher.start()
+    start = time.monotonic()
+
+    assert await asyncio.wait_for(dispatcher.submit(1, 'hello'), 1) == 'message'
+    await dispatcher.stop()
+
+    assert time.monotonic() - start >= 0.05
+    assert bot_mock.send_message.call_count == 2
+    assert dispatcher.metrics()['retries'] == 1
+
+@pytest.mark.asyncio
+async def test_permanent_error_not_retried(bot_mock):
+    """Тест, что ошибка вроде заблокированного бота не повторяется и попадает в future"""
+    bot_mock.send_message = AsyncMock(side_effect=TelegramForbiddenError(method=MagicMock(), message='blocked'))
+    dispatcher = NotificationDispatcher(bot_mock, workers=1, global_rate=100, chat_rate=100)
+    dispatcher.start()
+
+    with pytest.raises(TelegramForbiddenError):
+        await asyncio.wait_for(dispatcher.submit(1, 'hello'), 1)
+    await dispatcher.stop()
+
+    assert bot_mock.send_message.call_count == 1
+    assert dispatcher.metrics()['failed'] == 1
+
+@pytest.mark.asyncio
+async def test_chat_over_limit_does_not_block_worker(bot_mock):
+    """Тест, что чат, исчерпавший лимит, откладывается, а единственный воркер отправляет другим чатам"""
+    dispatcher = NotificationDispatcher(bot_mock, workers=1, global_rate=100, chat_rate=2)
+    first = [dispatcher.submit(1, f'part {i}') for i in range(3)]
+    other = dispatcher.submit(2, 'hello')
+    dispatcher.start()
+    start = time.monotonic()
+
+    await asyncio.wait_for(other, 1)
+    assert time.monotonic() - start < 0.2
+    await asyncio.wait_for(asyncio.gather(*first), 3)
+    await dispatcher.stop()
+
+    # Отложенные сообщения чата уходят в исходном порядке
+    texts = [call.kwargs['text'] for call in bot_mock.send_message.call_args_list if call.kwargs['chat_id'] == 1]
+    assert texts == ['part 0', 'part 1', 'part 2']
+    assert dispatcher.metrics()['queue_depth'] == 0
+
+@pytest.mark.asyncio
+async def test_full_queue_rejects_without_blocking(bot_mock):
+    """Тест, что при переполненной очереди сообщение отклоняется сразу"""
+    dispatcher = NotificationDispatcher(bot_mock, workers=1, queue_size=1)
+    dispatcher.submit(1, 'first')
+    future = dispatcher.submit(2, 'second')
+
+    assert future.done()
+    assert dispatcher.metrics()['dropped'] == 1
+
+@pytest.mark.asyncio
+async def test_notification_service_enqueues(bot_mock):
+    """Тест, что сервис уведомлений с диспетчером ставит сообщение в очередь и сразу возвращает future"""
+    dispatcher = NotificationDispatcher(bot_mock, workers=1)
+    service = NotificationService(bot_mock, dispatcher=dispatcher)
+
+    future = await service.send_price_alert(1, 'Phone', 900.0, 1000.0, 'https://example.com')
+
+    assert isinstance(future, asyncio.Future)
+    bot_mock.send_message.assert_not_called()
+    assert dispatcher.queue.qsize() == 1
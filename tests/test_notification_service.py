@@ -1,7 +1,8 @@
+import asyncio
 import pytest
 from unittest.mock import AsyncMock, MagicMock, patch
 from aiogram import Bot
-from bot.services.notification_service import NotificationService
+from bot.services.notification_service import NotificationService, TELEGRAM_MESSAGE_LIMIT
 
 @pytest.fixture
 def bot_mock():
@@ -37,3 +38,72 @@ async def test_send_price_alert(bot_mock):
         )
 
         bot_mock.send_message.assert_called_once_with(user_id, expected_message)
+
+@pytest.mark.asyncio
+async def test_digest_coalesces_alerts_per_user(bot_mock):
+    """Тест, что уведомления одному пользователю в пределах окна уходят одним сообщением"""
+    notification_service = NotificationService(bot_mock, digest_window=0.01)
+    alerts = [
+        {'user_id': 1, 'product_title': f'Product {i}', 'current_price': 900.0, 'target_price': 1000.0,
+         'product_url': f'https://example.com/{i}'}
+        for i in range(3)
+    ]
+
+    await asyncio.gather(*(notification_service.deliver_price_alert(**alert) for alert in alerts))
+
+    bot_mock.send_message.assert_called_once()
+    text = bot_mock.send_message.call_args.kwargs['text']
+    assert 'Снизились цены на 3 товаров' in text
+    assert all(f'https://example.com/{i}' in text for i in range(3))
+
+@pytest.mark.asyncio
+async def test_digest_failure_reaches_every_caller(bot_mock):
+    """Тест, что ошибка отправки сводки получают все ожидающие уведомления, чтобы outbox их повторил"""
+    bot_mock.send_message = AsyncMock(side_effect=RuntimeError('Telegram is down'))
+    notification_service = NotificationService(bot_mock, digest_window=0.01)
+    alert = {'product_title': 'Phone', 'current_price': 900.0, 'target_price': 1000.0, 'product_url': 'https://a'}
+
+    results = await asyncio.gather(
+        notification_service.deliver_price_alert(1, **alert),
+        notification_service.deliver_price_alert(1, **alert),
+        return_exceptions=True
+    )
+
+    assert all(isinstance(result, RuntimeError) for result in results)
+
+@pytest.mark.asyncio
+async def test_digest_failure_only_fails_unsent_part(bot_mock):
+    """Тест, что при ошибке одной части сводки ошибку получают только уведомления из этой части"""
+    bot_mock.send_message = AsyncMock(side_effect=['message', RuntimeError('Telegram is down')])
+    notification_service = NotificationService(bot_mock, digest_window=0.01)
+    alerts = [
+        {'product_title': 'X' * 500, 'current_price': 900.0, 'target_price': 1000.0,
+         'product_url': f'https://example.com/{i}'}
+        for i in range(20)
+    ]
+    parts = notification_service._digest_parts(alerts)
+    assert len(parts) == 2
+
+    results = await asyncio.gather(
+        *(notification_service.deliver_price_alert(1, **alert) for alert in alerts),
+        return_exceptions=True
+    )
+
+    first_count = parts[0][1]
+    assert results[:first_count] == [None] * first_count
+    assert all(isinstance(result, RuntimeError) for result in results[first_count:])
+
+def test_digest_split_within_telegram_limit(bot_mock):
+    """Тест разбиения большой сводки на сообщения не длиннее 4096 символов"""
+    notification_service = NotificationService(bot_mock, digest_window=0)
+    alerts = [
+        {'product_title': 'X' * 500, 'current_price': 900.0, 'target_price': 1000.0,
+         'product_url': f'https://example.com/{i}'}
+        for i in range(100)
+    ]
+
+    messages = notification_service.format_digest(alerts)
+
+    assert len(messages) > 1
+    assert all(len(message) <= TELEGRAM_MESSAGE_LIMIT for message in messages)
+    assert sum(message.count('https://example.com/') for message in messages) == 100
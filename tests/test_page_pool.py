@@ -0,0 +1,109 @@
+import asyncio
+import pytest
+from unittest.mock import AsyncMock, MagicMock
+from bot.services.page_pool import PagePool
+
+def make_browser(heap=0):
+    browser = MagicMock()
+
+    async def new_context(**kwargs):
+        context = MagicMock()
+        context.add_init_script = AsyncMock()
+        context.close = AsyncMock()
+        page = MagicMock()
+        page.is_closed = MagicMock(return_value=False)
+        page.evaluate = AsyncMock(return_value=heap)
+        context.new_page = AsyncMock(return_value=page)
+        return context
+
+    browser.new_context = AsyncMock(side_effect=new_context)
+    return browser
+
+@pytest.mark.asyncio
+async def test_page_reused_between_leases():
+    """Тест повторного использования прогретой вкладки"""
+    pool = PagePool(make_browser(), size=2)
+
+    async with pool.lease() as first:
+        pass
+    async with pool.lease() as second:
+        pass
+
+    assert first is second
+    metrics = pool.metrics()
+    assert metrics['created'] == 1
+    assert metrics['leases'] == 2
+    assert metrics['recycled'] == 0
+
+@pytest.mark.asyncio
+async def test_page_recycled_after_max_navigations():
+    """Тест пересоздания вкладки после заданного числа переходов"""
+    browser = make_browser()
+    pool = PagePool(browser, size=1, max_navigations=2)
+
+    pages = []
+    for _ in range(3):
+        async with pool.lease() as page:
+            pages.append(page)
+
+    assert pages[0] is pages[1]
+    assert pages[2] is not pages[1]
+    assert pool.metrics()['recycled'] == 1
+
+@pytest.mark.asyncio
+async def test_page_recycled_when_memory_exceeded():
+    """Тест пересоздания вкладки при превышении лимита памяти"""
+    pool = PagePool(make_browser(heap=512 * 1024 * 1024), size=1, max_memory_mb=256)
+
+    async with pool.lease() as first:
+        pass
+    async with pool.lease() as second:
+        pass
+
+    assert first is not second
+    assert pool.metrics()['recycled'] == 2
+
+@pytest.mark.asyncio
+async def test_pool_is_bounded():
+    """Тест, что пул не создаёт больше вкладок, чем его размер"""
+    browser = make_browser()
+    pool = PagePool(browser, size=1)
+
+    async with pool.lease():
+        assert pool.metrics()['in_use'] == 1
+    async with pool.lease():
+        pass
+
+    assert browser.new_context.call_count == 1
+
+@pytest.mark.asyncio
+async def test_waiter_not_stuck_when_recreation_fails():
+    """Тест, что ожидающий вкладку не зависает, если освободившуюся вкладку не удалось пересоздать"""
+    browser = make_browser()
+    pool = PagePool(browser, size=1, max_navigations=1)
+    create = browser.new_context.side_effect
+    holder_inside = asyncio.Event()
+
+    async def holder():
+        async with pool.lease():
+            holder_inside.set()
+            await asyncio.sleep(0.01)
+            # Браузер упал: пересоздание после этой аренды не удастся, следующая попытка — удастся
+            failures = [RuntimeError('browser closed')]
+
+            async def new_context(**kwargs):
+                if failures:
+                    raise failures.pop()
+                return await create(**kwargs)
+
+            browser.new_context.side_effect = new_context
+
+    async def waiter():
+        await holder_inside.wait()
+        async with pool.lease() as page:
+            return page
+
+    _, page = await asyncio.wait_for(asyncio.gather(holder(), waiter()), 1)
+
+    assert page is not None
+    assert pool.metrics()['created'] == 1
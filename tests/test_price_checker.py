@@ -1,10 +1,12 @@
 import pytest
-from unittest.mock import AsyncMock, MagicMock, patch
+from unittest.mock import AsyncMock, MagicMock, call, patch
 import asyncio
+import time
 from bot.services.price_checker import PriceChecker
 from bot.services.notification_service import NotificationService
 from bot.services.parser import PriceParser
 from database.redis_client import RedisClient
+from database.models import MonitoringSnapshot
 
 @pytest.fixture
 def redis_client():
@@ -118,5 +120,488 @@ async def test_multiple_products_monitoring(redis_client, notification_service):
 
     assert notification_service.send_price_alert.call_count == 1
 
+def make_snapshot(products, tokens=None, parsed=None):
+    return MonitoringSnapshot(
+        tokens=tokens if tokens is not None else {user_id: f'token{user_id}' for user_id in products},
+        products=products,
+        parsed=parsed or {}
+    )
+
+def make_iter_prices(prices):
+    async def iter_prices(urls):
+        for url in urls:
+            if url in prices:
+                yield url, prices[url]
+    return MagicMock(side_effect=iter_prices)
+
+def make_activity(is_active):
+    return AsyncMock(side_effect=lambda tokens: {token: is_active for token in tokens})
+
+def make_alert_index(products_by_key):
+    async def get_triggered_alerts(key, price):
+        return {
+            (user_id, product['product_url'])
+            for user_id, _, product in products_by_key[key]['subscribers']
+            if price <= float(product.get('target_price', 0))
+        }
+    return AsyncMock(side_effect=get_triggered_alerts)
+
+@pytest.fixture
+def async_redis_client():
+    mock_redis = MagicMock()
+    mock_redis.mark_as_parsed = AsyncMock()
+    mock_redis.enqueue_alert = AsyncMock(return_value=True)
+    mock_redis.get_product_stats = AsyncMock(return_value={})
+    mock_redis.pop_pending_updates = AsyncMock(return_value=[])
+    mock_redis.add_pending_updates = AsyncMock()
+    mock_redis.get_tokens_with_pending_updates = AsyncMock(return_value=[])
+    mock_redis.schedule_products = AsyncMock()
+    return mock_redis
+
+@pytest.mark.asyncio
+async def test_same_product_fetched_once_for_all_users(async_redis_client, notification_service):
+    """Тест, что товар нескольких пользователей запрашивается один раз за цикл"""
+    async_redis_client.load_monitoring_snapshot = AsyncMock(return_value=make_snapshot({
+        user_id: [{
+            'title': 'Phone',
+            'target_price': 1000.0,
+            'product_url': f'https://www.ozon.ru/product/phone-123/?utm_source=user{user_id}'
+        }] for user_id in (1, 2)
+    }))
+    checker = PriceChecker(async_redis_client, notification_service)
+    checker.parser = MagicMock()
+    checker.parser.save_price_history = AsyncMock()
+    checker.parser.check_users_activity = make_activity(False)
+    checker.scheduler.reschedule = AsyncMock()
+
+    products_by_key = await checker.collect_products()
+    assert list(products_by_key) == ['ozon:123']
+    async_redis_client.get_triggered_alerts = make_alert_index(products_by_key)
+
+    fetch_url = products_by_key['ozon:123']['url']
+    checker.parser.iter_prices = make_iter_prices({fetch_url: 900.0})
+    await checker.run_pipeline(['ozon:123'], products_by_key)
+
+    checker.parser.iter_prices.assert_called_once_with([fetch_url])
+    assert async_redis_client.enqueue_alert.call_count == 2
+
+@pytest.mark.asyncio
+async def test_collect_products_skips_parsed_and_unregistered(async_redis_client, notification_service):
+    """Тест, что снимок отбрасывает уже уведомлённые товары и пользователей без токена"""
+    url = 'https://www.wildberries.ru/catalog/1/detail.aspx'
+    async_redis_client.load_monitoring_snapshot = AsyncMock(return_value=make_snapshot(
+        products={1: [{'product_url': url}], 2: [{'product_url': url}], 3: [{'product_url': url}]},
+        tokens={1: 'token1', 2: 'token2'},
+        parsed={2: {url}}
+    ))
+    checker = PriceChecker(async_redis_client, notification_service)
+
+    products_by_key = await checker.collect_products()
+
+    assert [subscriber[0] for subscriber in products_by_key['wildberries:1']['subscribers']] == [1]
+
+@pytest.mark.asyncio
+async def test_pipeline_alerts_and_pushes_updates(async_redis_client, notification_service):
+    """Тест конвейера: уведомление о снижении цены и отправка обновлений активному пользователю"""
+    urls = {key: f'https://www.wildberries.ru/catalog/{key}/detail.aspx' for key in ('1', '2', '3')}
+    products_by_key = {
+        f'wildberries:{key}': {'url': url, 'subscribers': [(7, 'token7', {
+            'title': f'Product {key}', 'target_price': 1000.0, 'product_url': url
+        })]}
+        for key, url in urls.items()
+    }
+    async_redis_client.get_triggered_alerts = make_alert_index(products_by_key)
+    checker = PriceChecker(async_redis_client, notification_service)
+    checker.fetch_workers = 2
+    checker.batch_size = 2
+    checker.scheduler.reschedule = AsyncMock()
+    checker.parser = MagicMock()
+    checker.parser.save_price_history = AsyncMock()
+    checker.parser.iter_prices = make_iter_prices({urls['1']: 900.0, urls['2']: 1500.0, urls['3']: None})
+    checker.parser.check_users_activity = make_activity(True)
+    checker.parser.send_price_updates = AsyncMock()
+
+    await checker.run_pipeline(list(products_by_key), products_by_key)
+
+    async_redis_client.enqueue_alert.assert_called_once_with({
+        'user_id': 7,
+        'product_title': 'Product 1',
+        'current_price': 900.0,
+        'target_price': 1000.0,
+        'product_url': urls['1']
+    }, '7:wildberries:1:900.0', checker.alert_dedup_ttl)
+    async_redis_client.mark_as_parsed.assert_called_once_with(7, urls['1'])
+    pushed = checker.parser.send_price_updates.call_args[0][1]
+    assert sorted(update['current_price'] for update in pushed) == [900.0, 1500.0]
+    assert checker.scheduler.reschedule.call_count == 2
+
+@pytest.mark.asyncio
+async def test_duplicate_alert_event_still_marked(async_redis_client, notification_service):
+    """Тест, что событие, уже записанное в outbox другим воркером, не мешает отметке товара"""
+    url = 'https://www.wildberries.ru/catalog/1/detail.aspx'
+    products_by_key = {'wildberries:1': {'url': url, 'subscribers': [(7, 'token7', {
+        'title': 'Product', 'target_price': 1000.0, 'product_url': url
+    })]}}
+    async_redis_client.enqueue_alert = AsyncMock(return_value=False)
+    async_redis_client.get_triggered_alerts = make_alert_index(products_by_key)
+    checker = PriceChecker(async_redis_client, notification_service)
+    checker.scheduler.reschedule = AsyncMock()
+    checker.parser = MagicMock()
+    checker.parser.save_price_history = AsyncMock()
+    checker.parser.iter_prices = make_iter_prices({url: 900.0})
+    checker.parser.check_users_activity = make_activity(False)
+
+    await checker.run_pipeline(['wildberries:1'], products_by_key)
+
+    async_redis_client.enqueue_alert.assert_called_once()
+    async_redis_client.mark_as_parsed.assert_called_once_with(7, url)
+
+@pytest.mark.asyncio
+async def test_publish_due_only_with_lock(async_redis_client, notification_service):
+    """Тест, что товары публикует только держатель блокировки и их срок переносится"""
+    url = 'https://www.wildberries.ru/catalog/1/detail.aspx'
+    async_redis_client.load_monitoring_snapshot = AsyncMock(return_value=make_snapshot({1: [{'product_url': url}]}))
+    async_redis_client.schedule_products = AsyncMock()
+    async_redis_client.publish_check_tasks = AsyncMock()
+    checker = PriceChecker(async_redis_client, notification_service)
+    checker.scheduler.get_due = AsyncMock(return_value=['wildberries:1'])
+
+    async_redis_client.acquire_lock = AsyncMock(return_value=False)
+    assert await checker.publish_due() == 0
+    async_redis_client.publish_check_tasks.assert_not_called()
+
+    async_redis_client.acquire_lock = AsyncMock(return_value=True)
+    assert await checker.publish_due() == 1
+    async_redis_client.publish_check_tasks.assert_called_once_with(['wildberries:1'])
+    assert list(async_redis_client.schedule_products.call_args[0][0]) == ['wildberries:1']
+
+@pytest.mark.asyncio
+async def test_consume_tasks_processes_and_acks(async_redis_client, notification_service):
+    """Тест, что воркер обрабатывает свои и зависшие задачи и подтверждает все, включая удалённые товары"""
+    url = 'https://www.wildberries.ru/catalog/1/detail.aspx'
+    async_redis_client.load_monitoring_snapshot = AsyncMock(return_value=make_snapshot({1: [{'product_url': url}]}))
+    async_redis_client.claim_stale_check_tasks = AsyncMock(return_value=[('1-0', 'wildberries:1')])
+    async_redis_client.read_check_tasks = AsyncMock(return_value=[('2-0', 'wildberries:1'), ('3-0', 'ozon:404')])
+    async_redis_client.ack_check_tasks = AsyncMock()
+    checker = PriceChecker(async_redis_client, notification_service)
+    checker.run_pipeline = AsyncMock()
+
+    assert await checker.consume_tasks(block_ms=0) == 3
+
+    assert checker.run_pipeline.call_args[0][0] == ['wildberries:1']
+    async_redis_client.ack_check_tasks.assert_called_once_with(['1-0', '2-0', '3-0'])
+
+@pytest.mark.asyncio
+async def test_consume_tasks_acks_each_key_when_evaluated(async_redis_client, notification_service):
+    """Тест, что задача подтверждается сразу после проверки товара, а не после всей пачки"""
+    urls = {key: f'https://www.wildberries.ru/catalog/{key}/detail.aspx' for key in ('1', '2')}
+    async_redis_client.load_monitoring_snapshot = AsyncMock(return_value=make_snapshot({
+        1: [{'product_url': url, 'target_price': 10.0} for url in urls.values()]
+    }))
+    async_redis_client.claim_stale_check_tasks = AsyncMock(return_value=[])
+    async_redis_client.read_check_tasks = AsyncMock(return_value=[('1-0', 'wildberries:1'), ('2-0', 'wildberries:2')])
+    async_redis_client.ack_check_tasks = AsyncMock()
+    async_redis_client.get_triggered_alerts = AsyncMock(return_value=set())
+    checker = PriceChecker(async_redis_client, notification_service)
+    checker.scheduler.reschedule = AsyncMock()
+    checker.parser = MagicMock()
+    checker.parser.save_price_history = AsyncMock()
+    # Цену второго товара получить не удалось: его задача подтверждается в конце
+    checker.parser.iter_prices = make_iter_prices({urls['1']: 900.0})
+    checker.parser.check_users_activity = make_activity(False)
+
+    assert await checker.consume_tasks(block_ms=0) == 2
+
+    assert async_redis_client.ack_check_tasks.call_args_list == [call(['1-0']), call(['2-0'])]
+
+@pytest.mark.asyncio
+async def test_alerts_only_for_indexed_targets(async_redis_client, notification_service):
+    """Тест, что уведомления получают только подписчики, найденные запросом к индексу целевых цен"""
+    url = 'https://www.wildberries.ru/catalog/1/detail.aspx'
+    products_by_key = {'wildberries:1': {'url': url, 'subscribers': [
+        (user_id, f'token{user_id}', {'title': 'Product', 'target_price': 1000.0, 'product_url': url})
+        for user_id in (1, 2, 3)
+    ]}}
+    async_redis_client.get_triggered_alerts = AsyncMock(return_value={(2, url)})
+    checker = PriceChecker(async_redis_client, notification_service)
+    checker.scheduler.reschedule = AsyncMock()
+    checker.parser = MagicMock()
+    checker.parser.save_price_history = AsyncMock()
+    checker.parser.iter_prices = make_iter_prices({url: 900.0})
+    checker.parser.check_users_activity = make_activity(False)
+
+    await checker.run_pipeline(['wildberries:1'], products_by_key)
+
+    async_redis_client.get_triggered_alerts.assert_called_once_with('wildberries:1', 900.0)
+    async_redis_client.enqueue_alert.assert_called_once()
+    assert async_redis_client.enqueue_alert.call_args[0][0]['user_id'] == 2
+
+@pytest.mark.asyncio
+async def test_unchanged_price_skips_updates_but_rechecks_targets(async_redis_client, notification_service):
+    """Тест, что неизменная цена не пишется в историю и не отправляется, но неуведомлённый подписчик её получит"""
+    url = 'https://www.wildberries.ru/catalog/1/detail.aspx'
+    products_by_key = {'wildberries:1': {'url': url, 'subscribers': [(7, 'token7', {
+        'title': 'Product', 'target_price': 1000.0, 'product_url': url
+    })]}}
+    checker = PriceChecker(async_redis_client, notification_service)
+    async_redis_client.get_product_stats = AsyncMock(return_value={'wildberries:1': {
+        'price': 900.0,
+        'subscribers': checker._subscribers_digest(products_by_key['wildberries:1']['subscribers']),
+        'sampled_at': time.time()
+    }})
+    async_redis_client.get_triggered_alerts = make_alert_index(products_by_key)
+    checker.scheduler.reschedule = AsyncMock()
+    checker.parser = MagicMock()
+    checker.parser.save_price_history = AsyncMock()
+    checker.parser.iter_prices = make_iter_prices({url: 900.0})
+    checker.parser.check_users_activity = make_activity(True)
+    checker.parser.send_price_updates = AsyncMock()
+
+    await checker.run_pipeline(['wildberries:1'], products_by_key)
+
+    checker.parser.save_price_history.assert_not_called()
+    checker.parser.send_price_updates.assert_not_called()
+    # Прошлая проверка могла упасть до записи в outbox, поэтому цель проверяется снова
+    async_redis_client.enqueue_alert.assert_called_once()
+    assert async_redis_client.enqueue_alert.call_args[0][1] == '7:wildberries:1:900.0'
+    assert checker.scheduler.reschedule.call_args[0][0] == {'wildberries:1': 900.0}
+
+@pytest.mark.asyncio
+async def test_heartbeat_and_new_subscriber_on_unchanged_price(async_redis_client, notification_service):
+    """Тест контрольной записи в историю и проверки цели для нового подписчика при той же цене"""
+    url = 'https://www.wildberries.ru/catalog/1/detail.aspx'
+    products_by_key = {'wildberries:1': {'url': url, 'subscribers': [(7, 'token7', {
+        'title': 'Product', 'target_price': 1000.0, 'product_url': url
+    })]}}
+    stats = {'wildberries:1': {'price': 900.0, 'subscribers': 'old', 'sampled_at': 0}}
+    async_redis_client.get_product_stats = AsyncMock(return_value=stats)
+    async_redis_client.get_triggered_alerts = make_alert_index(products_by_key)
+    checker = PriceChecker(async_redis_client, notification_service)
+    checker.scheduler.reschedule = AsyncMock()
+    checker.parser = MagicMock()
+    checker.parser.save_price_history = AsyncMock()
+    checker.parser.iter_prices = make_iter_prices({url: 900.0})
+    checker.parser.check_users_activity = make_activity(False)
+
+    await checker.run_pipeline(['wildberries:1'], products_by_key)
+
+    checker.parser.save_price_history.assert_called_once_with(url, 900.0)
+    async_redis_client.enqueue_alert.assert_called_once()
+    assert stats['wildberries:1']['sampled_at'] > 0
+
+@pytest.mark.asyncio
+async def test_pending_updates_stored_for_inactive_user(async_redis_client, notification_service):
+    """Тест, что обновления неактивного пользователя уходят в Redis, а не в память процесса"""
+    checker = PriceChecker(async_redis_client, notification_service)
+    checker.parser = MagicMock()
+    checker.parser.check_users_activity = make_activity(False)
+    checker.parser.send_price_updates = AsyncMock()
+    updates = [{'product_url': 'https://a', 'current_price': 100.0}]
+
+    await checker._flush_updates('token7', updates)
+
+    async_redis_client.add_pending_updates.assert_called_once_with('token7', updates, checker.pending_limit, checker.pending_ttl)
+    checker.parser.send_price_updates.assert_not_called()
+
+@pytest.mark.asyncio
+async def test_pending_updates_merged_into_one_request(async_redis_client, notification_service):
+    """Тест, что накопленные и свежие обновления отправляются одним запросом, свежая цена важнее"""
+    async_redis_client.pop_pending_updates = AsyncMock(return_value=[
+        {'product_url': 'https://a', 'current_price': 100.0},
+        {'product_url': 'https://b', 'current_price': 200.0}
+    ])
+    checker = PriceChecker(async_redis_client, notification_service)
+    checker.parser = MagicMock()
+    checker.parser.check_users_activity = make_activity(True)
+    checker.parser.send_price_updates = AsyncMock(return_value=False)
+
+    await checker._flush_updates('token7', [{'product_url': 'https://a', 'current_price': 90.0}])
+
+    sent = checker.parser.send_price_updates.call_args[0][1]
+    assert checker.parser.send_price_updates.call_count == 1
+    assert sorted((update['product_url'], update['current_price']) for update in sent) == [('https://a', 90.0), ('https://b', 200.0)]
+    # Неудачная отправка возвращает обновления в хранилище
+    assert async_redis_client.add_pending_updates.call_args[0][1] == sent
+
+@pytest.mark.asyncio
+async def test_activity_checked_once_per_cycle(async_redis_client, notification_service):
+    """Тест, что активность всех пользователей запрашивается одним запросом и кешируется"""
+    urls = [f'https://www.wildberries.ru/catalog/{i}/detail.aspx' for i in (1, 2)]
+    products_by_key = {
+        f'wildberries:{i}': {'url': url, 'subscribers': [
+            (user_id, f'token{user_id}', {'title': 'Product', 'target_price': 10.0, 'product_url': url})
+            for user_id in (1, 2, 3)
+        ]}
+        for i, url in zip((1, 2), urls)
+    }
+    async_redis_client.get_triggered_alerts = make_alert_index(products_by_key)
+    checker = PriceChecker(async_redis_client, notification_service)
+    checker.push_buffer_size = 1
+    checker.scheduler.reschedule = AsyncMock()
+    checker.parser = MagicMock()
+    checker.parser.save_price_history = AsyncMock()
+    checker.parser.iter_prices = make_iter_prices({url: 900.0 for url in urls})
+    checker.parser.check_users_activity = make_activity(True)
+    checker.parser.check_user_activity = AsyncMock()
+    checker.parser.send_price_updates = AsyncMock(return_value=True)
+
+    await checker.run_pipeline(list(products_by_key), products_by_key)
+    await checker.run_pipeline(list(products_by_key), products_by_key)
+
+    checker.parser.check_users_activity.assert_called_once()
+    assert sorted(checker.parser.check_users_activity.call_args[0][0]) == ['token1', 'token2', 'token3']
+    checker.parser.check_user_activity.assert_not_called()
+    assert checker.parser.send_price_updates.call_count == 12
+
+@pytest.mark.asyncio
+async def test_activity_failure_not_cached(async_redis_client, notification_service):
+    """Тест, что при ошибке запроса активности пользователь считается неактивным до истечения activity_ttl"""
+    checker = PriceChecker(async_redis_client, notification_service)
+    checker.parser = MagicMock()
+    checker.parser.check_users_activity = AsyncMock(return_value=None)
+
+    assert await checker._is_active('token1') is False
+    assert await checker._is_active('token1') is False
+    assert checker.parser.check_users_activity.call_count == 1
+
+    # После истечения срока запрос повторяется
+    checker._activity_cache['token1'] = (time.monotonic() - checker.activity_ttl - 1, False)
+    assert await checker._is_active('token1') is False
+    assert checker.parser.check_users_activity.call_count == 2
+
+@pytest.mark.asyncio
+async def test_evaluate_error_skips_only_that_product(async_redis_client, notification_service):
+    """Тест, что ошибка оценки одного товара не останавливает конвейер для остальных"""
+    urls = {key: f'https://www.wildberries.ru/catalog/{key}/detail.aspx' for key in ('1', '2')}
+    products_by_key = {
+        f'wildberries:{key}': {'url': url, 'subscribers': [(7, 'token7', {
+            'title': f'Product {key}', 'target_price': 1000.0, 'product_url': url
+        })]}
+        for key, url in urls.items()
+    }
+    index = make_alert_index(products_by_key)
+
+    async def get_triggered_alerts(key, price):
+        if key == 'wildberries:1':
+            raise ConnectionError("Redis is unavailable")
+        return await index(key, price)
+
+    async_redis_client.get_triggered_alerts = AsyncMock(side_effect=get_triggered_alerts)
+    checker = PriceChecker(async_redis_client, notification_service)
+    checker.queue_size = 1
+    checker.scheduler.reschedule = AsyncMock()
+    checker.parser = MagicMock()
+    checker.parser.save_price_history = AsyncMock()
+    checker.parser.iter_prices = make_iter_prices({url: 900.0 for url in urls.values()})
+    checker.parser.check_users_activity = make_activity(False)
+
+    await asyncio.wait_for(checker.run_pipeline(list(products_by_key), products_by_key), timeout=5)
+
+    async_redis_client.enqueue_alert.assert_called_once()
+    assert async_redis_client.enqueue_alert.call_args[0][0]['product_url'] == urls['2']
+
+@pytest.mark.asyncio
+async def test_failed_stage_cancels_pipeline(async_redis_client, notification_service):
+    """Тест, что падение стадии останавливает весь конвейер, а не оставляет соседей на полных очередях"""
+    urls = [f'https://www.wildberries.ru/catalog/{i}/detail.aspx' for i in range(10)]
+    products_by_key = {
+        f'wildberries:{i}': {'url': url, 'subscribers': [(7, 'token7', {'product_url': url})]}
+        for i, url in enumerate(urls)
+    }
+    checker = PriceChecker(async_redis_client, notification_service)
+    checker.queue_size = 1
+    checker.batch_size = 1
+    checker.scheduler.reschedule = AsyncMock()
+    checker.parser = MagicMock()
+    checker.parser.save_price_history = AsyncMock()
+    checker.parser.iter_prices = make_iter_prices({url: 900.0 for url in urls})
+    checker.parser.check_users_activity = make_activity(False)
+    checker._evaluate_stage = AsyncMock(side_effect=RuntimeError("evaluate crashed"))
+
+    with pytest.raises(RuntimeError):
+        await asyncio.wait_for(checker.run_pipeline(list(products_by_key), products_by_key), timeout=5)
+    # Загрузчики и стоки не остаются висеть на очередях
+    assert asyncio.all_tasks() == {asyncio.current_task()}
+
+@pytest.mark.asyncio
+async def test_pending_backlog_flushed_without_price_changes(async_redis_client, notification_service):
+    """Тест, что вернувшийся пользователь получает накопленные цены, даже если за цикл ничего не изменилось"""
+    url = 'https://www.wildberries.ru/catalog/1/detail.aspx'
+    products_by_key = {'wildberries:1': {'url': url, 'subscribers': [(7, 'token7', {
+        'title': 'Product', 'target_price': 100.0, 'product_url': url
+    })]}}
+    pending = [{'product_url': url, 'current_price': 900.0}]
+    checker = PriceChecker(async_redis_client, notification_service)
+    async_redis_client.get_product_stats = AsyncMock(return_value={'wildberries:1': {
+        'price': 900.0,
+        'subscribers': checker._subscribers_digest(products_by_key['wildberries:1']['subscribers']),
+        'sampled_at': time.time()
+    }})
+    async_redis_client.get_triggered_alerts = make_alert_index(products_by_key)
+    async_redis_client.get_tokens_with_pending_updates = AsyncMock(return_value=['token7'])
+    async_redis_client.pop_pending_updates = AsyncMock(return_value=pending)
+    checker.scheduler.reschedule = AsyncMock()
+    checker.parser = MagicMock()
+    checker.parser.save_price_history = AsyncMock()
+    checker.parser.iter_prices = make_iter_prices({url: 900.0})
+    checker.parser.check_users_activity = make_activity(True)
+    checker.parser.send_price_updates = AsyncMock(return_value=True)
+
+    await checker.run_pipeline(['wildberries:1'], products_by_key)
+
+    async_redis_client.get_tokens_with_pending_updates.assert_called_once_with(['token7'])
+    checker.parser.send_price_updates.assert_called_once_with('token7', pending)
+
+@pytest.mark.asyncio
+async def test_products_snapshot_not_reloaded_every_tick(async_redis_client, notification_service):
+    """Тест, что полный снимок товаров перечитывается раз в PRODUCTS_REFRESH_INTERVAL, а не на каждом такте"""
+    url = 'https://www.wildberries.ru/catalog/1/detail.aspx'
+    async_redis_client.load_monitoring_snapshot = AsyncMock(return_value=make_snapshot({1: [{'product_url': url}]}))
+    async_redis_client.get_due_products = AsyncMock(return_value=[])
+    async_redis_client.acquire_lock = AsyncMock(return_value=True)
+    checker = PriceChecker(async_redis_client, notification_service)
+
+    for _ in range(3):
+        await checker.publish_due()
+
+    async_redis_client.load_monitoring_snapshot.assert_called_once()
+    # Сверка расписания с полным списком — тоже только при перечитывании
+    async_redis_client.schedule_products.assert_called_once()
+
+@pytest.mark.asyncio
+async def test_unknown_due_product_triggers_one_reload(async_redis_client, notification_service):
+    """Тест, что товар из расписания, которого нет в снимке, перечитывает снимок не чаще раза за такт"""
+    url = 'https://www.wildberries.ru/catalog/1/detail.aspx'
+    async_redis_client.load_monitoring_snapshot = AsyncMock(side_effect=[
+        make_snapshot({}), make_snapshot({1: [{'product_url': url}]})
+    ])
+    async_redis_client.get_due_products = AsyncMock(return_value=['wildberries:1'])
+    async_redis_client.unschedule_products = AsyncMock()
+    checker = PriceChecker(async_redis_client, notification_service)
+    await checker._get_cached_products()
+    checker._products_cache = (time.monotonic() - checker.monitoring_interval - 1, checker._products_cache[1])
+
+    due_keys, products_by_key = await checker._get_due()
+
+    assert due_keys == ['wildberries:1']
+    assert 'wildberries:1' in products_by_key
+    async_redis_client.unschedule_products.assert_not_called()
+
+@pytest.mark.asyncio
+async def test_checker_without_notification_service_only_enqueues(async_redis_client):
+    """Тест, что воркер без notification_service не запускает доставку: уведомления отправляет бот из outbox"""
+    async_redis_client.rebuild_alert_index = AsyncMock()
+    checker = PriceChecker(async_redis_client, None)
+    checker.mode = 'local'
+    checker._run_local = AsyncMock()
+
+    with patch('bot.services.price_checker.PriceParser') as parser_cls:
+        parser_cls.return_value.__aenter__ = AsyncMock()
+        parser_cls.return_value.__aexit__ = AsyncMock(return_value=False)
+        await checker.start_monitoring()
+
+    assert checker.alert_delivery is None
+    checker._run_local.assert_called_once()
+
 if __name__ == "__main__":
-    pytest.main(["-v"])
\ No newline at end of file
+    pytest.main(["-v"])
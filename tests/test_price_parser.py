@@ -1,6 +1,7 @@
+import time
 import pytest
-from unittest.mock import AsyncMock, patch
-from bot.services.parser import PriceParser
+from unittest.mock import AsyncMock, MagicMock, patch
+from bot.services.parser import PriceParser, SELECTORS_RETRY_INTERVAL
 
 @pytest.mark.asyncio
 async def test_get_price_ozon():
@@ -69,3 +70,302 @@ async def test_get_price_request_error():
     with patch('aiohttp.ClientSession.get', side_effect=Exception('Network error')):
         price = await parser.get_price(url)
         assert price is None
+
+def make_session(*responses):
+    session = MagicMock()
+    contexts = []
+    for response in responses:
+        context = MagicMock()
+        context.__aenter__ = AsyncMock(return_value=response)
+        context.__aexit__ = AsyncMock(return_value=False)
+        contexts.append(context)
+    session.get = MagicMock(side_effect=contexts)
+    return session
+
+def make_response(status, data=None, headers=None):
+    response = MagicMock()
+    response.status = status
+    response.headers = headers or {}
+    response.json = AsyncMock(return_value=data)
+    return response
+
+SELECTORS_DATA = {'selectors_history': [{'selectors': {'price': '.price'}}]}
+
+@pytest.mark.asyncio
+async def test_get_selectors_cached_within_ttl():
+    """Тест, что селекторы запрашиваются у бэкенда один раз в пределах TTL"""
+    parser = PriceParser()
+    parser.session = make_session(make_response(200, SELECTORS_DATA, {'ETag': '"ozon-1"'}))
+
+    first = await parser.get_selectors('ozon')
+    second = await parser.get_selectors('ozon')
+
+    assert first == second == [{'price': '.price'}]
+    assert parser.session.get.call_count == 1
+
+@pytest.mark.asyncio
+async def test_get_selectors_conditional_refresh():
+    """Тест условного обновления селекторов по ETag после истечения TTL"""
+    parser = PriceParser()
+    parser.session = make_session(
+        make_response(200, SELECTORS_DATA, {'ETag': '"ozon-1"'}),
+        make_response(304)
+    )
+
+    await parser.get_selectors('ozon')
+    parser._selectors_cache['ozon']['expires_at'] = 0
+    selectors = await parser.get_selectors('ozon')
+
+    assert selectors == [{'price': '.price'}]
+    _, kwargs = parser.session.get.call_args
+    assert kwargs['headers'] == {'If-None-Match': '"ozon-1"'}
+
+@pytest.mark.asyncio
+async def test_get_selectors_kept_on_backend_error():
+    """Тест, что ошибка бэкенда не затирает закэшированные селекторы, а только ускоряет повторный запрос"""
+    parser = PriceParser()
+    parser.session = make_session(
+        make_response(200, SELECTORS_DATA, {'ETag': '"ozon-1"'}),
+        make_response(502)
+    )
+
+    await parser.get_selectors('ozon')
+    parser._selectors_cache['ozon']['expires_at'] = 0
+    selectors = await parser.get_selectors('ozon')
+
+    assert selectors == [{'price': '.price'}]
+    cached = parser._selectors_cache['ozon']
+    assert cached['etag'] == '"ozon-1"'
+    assert 0 < cached['expires_at'] - time.monotonic() <= SELECTORS_RETRY_INTERVAL
+
+@pytest.mark.asyncio
+async def test_get_selectors_404_cached_only_without_previous():
+    """Тест, что пустой список кэшируется на весь TTL только при 404 и пустом кэше"""
+    parser = PriceParser()
+    parser.session = make_session(make_response(404), make_response(500))
+
+    assert await parser.get_selectors('ozon') == []
+    assert await parser.get_selectors('ozon') == []
+    assert parser.session.get.call_count == 1
+
+    assert await parser.get_selectors('wildberries') == []
+    assert 'wildberries' not in parser._selectors_cache
+
+@pytest.mark.asyncio
+async def test_invalidate_selectors():
+    """Тест явного сброса кэша селекторов"""
+    parser = PriceParser()
+    parser.session = make_session(
+        make_response(200, SELECTORS_DATA, {'ETag': '"ozon-1"'}),
+        make_response(200, SELECTORS_DATA, {'ETag': '"ozon-2"'})
+    )
+
+    await parser.get_selectors('ozon')
+    parser.invalidate_selectors('ozon')
+    await parser.get_selectors('ozon')
+
+    assert parser.session.get.call_count == 2
+    assert parser._selectors_cache['ozon']['etag'] == '"ozon-2"'
+
+@pytest.mark.asyncio
+async def test_extract_price_from_page_single_evaluate():
+    """Тест извлечения цены одним вызовом page.evaluate без разбора HTML"""
+    parser = PriceParser()
+    page = MagicMock()
+    page.evaluate = AsyncMock(return_value={'jsonLd': [], 'microdata': [], 'states': [], 'texts': [None, '4 990 ₽']})
+    page.content = AsyncMock()
+
+    price = await parser._extract_price_from_page(page, ['.old-price', '.price'])
+
+    assert price == 4990.0
+    page.evaluate.assert_called_once()
+    page.content.assert_not_called()
+
+@pytest.mark.asyncio
+async def test_extract_price_from_page_html_fallback():
+    """Тест разбора HTML только для селекторов, не поддерживаемых браузером"""
+    parser = PriceParser()
+    page = MagicMock()
+    page.evaluate = AsyncMock(return_value={'jsonLd': [], 'microdata': [], 'states': [], 'texts': [None, False]})
+    page.content = AsyncMock(return_value='<span class="price">990 ₽</span>')
+
+    price = await parser._extract_price_from_page(page, ['.missing', 'span:-soup-contains("₽")'])
+
+    assert price == 990.0
+    page.content.assert_called_once()
+
+@pytest.mark.asyncio
+async def test_parse_html_in_process_pool():
+    """Тест разбора HTML в пуле процессов, запущенных без fork, как в рабочем парсере"""
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+
+    parser = PriceParser()
+    parser.executor = ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn'))
+    try:
+        price = await parser._parse_html('<span class="price">1 490 ₽</span>', ['.price'])
+    finally:
+        parser.executor.shutdown()
+
+    assert price == 1490.0
+
+def make_page_response(html, url):
+    response = make_response(200)
+    response.text = AsyncMock(return_value=html)
+    response.url = url
+    return response
+
+@pytest.mark.asyncio
+async def test_static_fetch_skips_browser():
+    """Тест получения цены из статического HTML без запуска браузера"""
+    url = 'https://www.ozon.ru/product/test-123/'
+    parser = PriceParser()
+    parser.session = make_session(make_page_response('<span class="price">1 000 ₽</span>', url))
+    parser.get_selectors = AsyncMock(return_value=[{'price': '.price'}])
+    parser.save_price_history = AsyncMock()
+    parser.page_pool = MagicMock()
+
+    price = await parser._fetch_marketplace_price(url)
+
+    assert price == 1000.0
+    parser.page_pool.lease.assert_not_called()
+    assert parser.get_metrics()['tiers']['ozon']['http_hit_rate'] == 1.0
+
+@pytest.mark.asyncio
+async def test_static_fetch_uses_structured_data_without_selectors():
+    """Тест, что цена из JSON-LD находится, даже если для маркетплейса нет селекторов"""
+    url = 'https://www.ozon.ru/product/test-123/'
+    html = '<script type="application/ld+json">{"@type": "Product", "offers": {"price": "1500"}}</script>'
+    parser = PriceParser()
+    parser.session = make_session(make_page_response(html, url))
+    parser.get_selectors = AsyncMock(return_value=[])
+    parser.page_pool = MagicMock()
+
+    assert await parser._fetch_marketplace_price(url) == 1500.0
+    parser.page_pool.lease.assert_not_called()
+
+@pytest.mark.asyncio
+async def test_browser_uses_structured_data_without_selectors():
+    """Тест, что браузер тоже читает структурированные данные при пустом списке селекторов"""
+    url = 'https://www.ozon.ru/product/test-123/'
+    parser = PriceParser()
+    parser.get_selectors = AsyncMock(return_value=[])
+    parser._prepare_page = AsyncMock()
+    page = MagicMock()
+    page.goto = AsyncMock()
+    page.evaluate = AsyncMock(return_value={'jsonLd': [], 'microdata': ['2500'], 'states': [], 'texts': []})
+
+    assert await parser._get_marketplace_price(url, page) == 2500.0
+    page.evaluate.assert_called_once()
+
+@pytest.mark.asyncio
+async def test_static_fetch_escalates_to_browser_on_captcha():
+    """Тест перехода на браузер, если вместо страницы пришла капча"""
+    url = 'https://market.yandex.ru/product--test/123'
+    parser = PriceParser()
+    parser.session = make_session(make_page_response('<div class="smartcaptcha"></div>', 'https://market.yandex.ru/showcaptcha'))
+    parser.get_selectors = AsyncMock(return_value=[{'price': '.price'}])
+    page = MagicMock()
+    lease = MagicMock()
+    lease.__aenter__ = AsyncMock(return_value=page)
+    lease.__aexit__ = AsyncMock(return_value=False)
+    parser.page_pool = MagicMock()
+    parser.page_pool.lease = MagicMock(return_value=lease)
+    parser._get_marketplace_price = AsyncMock(return_value=2500.0)
+
+    price = await parser._fetch_marketplace_price(url)
+
+    assert price == 2500.0
+    parser._get_marketplace_price.assert_called_once()
+    tiers = parser.get_metrics()['tiers']['yandex_market']
+    assert tiers['http_blocked'] == 1
+    assert tiers['browser_hits'] == 1
+
+@pytest.mark.asyncio
+async def test_extract_price_from_page_prefers_structured_data():
+    """Тест, что структурированные данные проверяются раньше CSS-селекторов"""
+    parser = PriceParser()
+    page = MagicMock()
+    page.evaluate = AsyncMock(return_value={
+        'jsonLd': ['{"@type": "Product", "offers": {"price": "7490"}}'],
+        'microdata': [],
+        'states': [],
+        'texts': ['9 999 ₽']
+    })
+
+    assert await parser._extract_price_from_page(page, ['.price']) == 7490.0
+
+def wb_url(product_id):
+    return f'https://www.wildberries.ru/catalog/{product_id}/detail.aspx'
+
+def wb_response(*product_ids):
+    return {'data': {'products': [{'id': int(product_id), 'salePriceU': 150000} for product_id in product_ids]}}
+
+@pytest.mark.asyncio
+async def test_wb_prices_fetched_in_chunks():
+    """Тест разбиения артикулов Wildberries на пачки"""
+    parser = PriceParser()
+    parser.wb_chunk_size = 2
+    parser.save_price_history = AsyncMock()
+    parser._fetch_wb_chunk = AsyncMock(side_effect=lambda ids: {product_id: 1500.0 for product_id in ids})
+
+    urls = [wb_url(product_id) for product_id in ('1', '2', '3', '4', '5')]
+    results = await parser._get_wb_prices(urls)
+
+    assert parser._fetch_wb_chunk.call_count == 3
+    assert results == {url: 1500.0 for url in urls}
+
+@pytest.mark.asyncio
+async def test_wb_missing_ids_retried_individually():
+    """Тест повторного запроса по одному артикулу, пропавшему из ответа"""
+    parser = PriceParser()
+    parser.save_price_history = AsyncMock()
+    parser._fetch_wb_chunk = AsyncMock(side_effect=[{'1': 1500.0}, {'2': 990.0}])
+
+    results = await parser._get_wb_prices([wb_url('1'), wb_url('2')])
+
+    parser._fetch_wb_chunk.assert_called_with(['2'])
+    assert results == {wb_url('1'): 1500.0, wb_url('2'): 990.0}
+
+@pytest.mark.asyncio
+async def test_wb_failed_chunk_does_not_affect_others():
+    """Тест, что ошибка одной пачки не обнуляет цены остальных"""
+    parser = PriceParser()
+    parser.wb_chunk_size = 1
+    parser.save_price_history = AsyncMock()
+    parser._fetch_wb_chunk = AsyncMock(side_effect=[{'1': 1500.0}, None])
+
+    results = await parser._get_wb_prices([wb_url('1'), wb_url('2')])
+
+    assert results == {wb_url('1'): 1500.0, wb_url('2'): None}
+
+@pytest.mark.asyncio
+async def test_wb_chunk_retried_with_backoff():
+    """Тест повтора запроса пачки после ошибки API"""
+    parser = PriceParser()
+    parser.wb_retry_backoff = 0
+    parser.session = make_session(make_response(500), make_response(200, wb_response('1')))
+
+    prices = await parser._fetch_wb_chunk(['1'])
+
+    assert prices == {'1': 1500.0}
+    assert parser.session.get.call_count == 2
+
+@pytest.mark.asyncio
+async def test_iter_prices_yields_as_completed():
+    """Тест выдачи цен по мере получения, не дожидаясь всей пачки"""
+    import asyncio
+
+    parser = PriceParser()
+    delays = {'https://www.ozon.ru/product/slow-1/': 0.05, 'https://www.ozon.ru/product/fast-2/': 0.0}
+
+    async def fetch(url, started_at=None):
+        await asyncio.sleep(delays[url])
+        return 100.0
+
+    parser._fetch_marketplace_price = fetch
+    parser.get_metrics = MagicMock(return_value={})
+
+    order = [url async for url, _ in parser.iter_prices(list(delays))]
+
+    assert order == ['https://www.ozon.ru/product/fast-2/', 'https://www.ozon.ru/product/slow-1/']
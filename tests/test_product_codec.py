@@ -0,0 +1,46 @@
+import json
+import pytest
+from database.product_codec import decode_product, encode_product, to_api_product
+
+def test_encode_normalizes_keys_once():
+    """Тест, что товар из расширения сохраняется компактным массивом со snake_case полями"""
+    raw = encode_product({
+        'title': 'Phone', 'price': 1000.0, 'targetPrice': 900.0, 'imageUrl': 'https://img',
+        'productUrl': 'https://www.ozon.ru/product/phone-1/', 'marketplace': 'ozon'
+    })
+
+    assert json.loads(raw)[0] == 1
+    assert '"targetPrice"' not in raw
+    assert decode_product(raw) == ({
+        'title': 'Phone', 'price': 1000.0, 'target_price': 900.0, 'image_url': 'https://img',
+        'product_url': 'https://www.ozon.ru/product/phone-1/', 'marketplace': 'ozon'
+    }, False)
+
+def test_extra_fields_preserved():
+    """Тест, что поля вне схемы не теряются при кодировании"""
+    product, legacy = decode_product(encode_product({'productUrl': 'https://a', 'addedAt': 5}))
+    assert product['added_at'] == 5
+    assert product['product_url'] == 'https://a'
+    assert not legacy
+
+def test_partial_product_round_trip():
+    """Тест, что поля, которых не было у товара, не появляются после декодирования со значением None"""
+    product, _ = decode_product(encode_product({'productUrl': 'https://a', 'title': 'Phone'}))
+
+    assert product == {'product_url': 'https://a', 'title': 'Phone'}
+    # Без target_price по умолчанию срабатывает .get(..., 0), а не float(None)
+    assert product.get('target_price', 0) == 0
+
+def test_legacy_json_detected():
+    """Тест чтения записи старого формата с признаком для миграции"""
+    assert decode_product('{"productUrl": "https://a", "targetPrice": 10}') == (
+        {'product_url': 'https://a', 'target_price': 10}, True
+    )
+    with pytest.raises(ValueError):
+        decode_product('"just a string"')
+
+def test_to_api_product_restores_camel_case():
+    """Тест обратного преобразования в формат расширения"""
+    assert to_api_product({'target_price': 10, 'product_url': 'https://a', 'title': 'X'}) == {
+        'targetPrice': 10, 'productUrl': 'https://a', 'title': 'X'
+    }
@@ -1,6 +1,9 @@
+import json
 import pytest
-from database.redis_client import RedisClient
-from unittest.mock import MagicMock, patch, call, ANY
+from database.models import MonitoringSnapshot
+from database.redis_client import ADD_PENDING_UPDATES_SCRIPT, RedisClient
+from redis.exceptions import WatchError
+from unittest.mock import AsyncMock, MagicMock, patch, call, ANY
 
 @pytest.fixture
 def redis_mock():
@@ -84,3 +87,331 @@ def test_mark_as_parsed(redis_client, redis_mock):
     product_url = 'http://example.com/product'
     redis_client.mark_as_parsed(user_id, product_url)
     redis_mock.sadd.assert_called_once_with(f"parsed:{user_id}", product_url)
+
+def make_pipeline(*results):
+    pipe = MagicMock()
+    pipe.__aenter__ = AsyncMock(return_value=pipe)
+    pipe.__aexit__ = AsyncMock(return_value=False)
+    pipe.execute = AsyncMock(side_effect=list(results))
+    return pipe
+
+@pytest.mark.asyncio
+async def test_load_monitoring_snapshot():
+    """Тест загрузки токенов, товаров и отметок всех пользователей конвейером"""
+    client = RedisClient()
+    client.get_all_users = AsyncMock(return_value=[1, 2])
+    pipe = make_pipeline(
+        ['token1', ['{"productUrl": "https://a", "targetPrice": 10}'], None, []],
+        [[1]]
+    )
+    client.client = MagicMock()
+    client.client.pipeline = MagicMock(return_value=pipe)
+    client.migrate_products = AsyncMock()
+
+    snapshot = await client.load_monitoring_snapshot()
+
+    assert snapshot.tokens == {1: 'token1'}
+    assert snapshot.products == {1: [{'product_url': 'https://a', 'target_price': 10}], 2: []}
+    assert snapshot.is_parsed(1, 'https://a')
+    pipe.smismember.assert_called_once_with('parsed:1', ['https://a'])
+    assert pipe.execute.call_count == 2
+    client.migrate_products.assert_called_once_with(1)
+
+@pytest.mark.asyncio
+async def test_acquire_lock():
+    """Тест блокировки публикатора: захват и продление своей выполняются одним скриптом"""
+    client = RedisClient()
+    client.client = MagicMock()
+    client.client.eval = AsyncMock(side_effect=[1, 0])
+
+    assert await client.acquire_lock('check_publisher', 'worker-1', 60) is True
+    assert await client.acquire_lock('check_publisher', 'worker-1', 60) is False
+
+    script, numkeys, key, owner, ttl = client.client.eval.call_args[0]
+    assert (numkeys, key, owner, ttl) == (1, 'lock:check_publisher', 'worker-1', 60)
+    # Владелец сверяется внутри скрипта, а не отдельным GET
+    assert "redis.call('GET', KEYS[1]) == ARGV[1]" in script
+
+@pytest.mark.asyncio
+async def test_read_and_claim_check_tasks():
+    """Тест разбора задач проверки из потока и забора зависших задач"""
+    client = RedisClient()
+    client.client = MagicMock()
+    client.client.xreadgroup = AsyncMock(return_value=[['check_queue', [('1-0', {'key': 'ozon:1'}), ('2-0', {})]]])
+    client.client.xautoclaim = AsyncMock(return_value=['0-0', [('3-0', {'key': 'wildberries:5'})], []])
+
+    assert await client.read_check_tasks('worker-1', 10, 0) == [('1-0', 'ozon:1')]
+    assert await client.claim_stale_check_tasks('worker-1', 1000, 10) == [('3-0', 'wildberries:5')]
+
+@pytest.mark.asyncio
+async def test_save_products_updates_alert_index():
+    """Тест, что сохранение товаров удаляет исчезнувшие записи индекса и добавляет новые"""
+    client = RedisClient()
+    client.client = MagicMock()
+    pipe = make_pipeline([])
+    pipe.watch = AsyncMock()
+    pipe.lrange = AsyncMock(return_value=[
+        '{"productUrl": "https://www.ozon.ru/product/old-1/", "targetPrice": 500}',
+        '{"productUrl": "https://www.ozon.ru/product/kept-2/", "targetPrice": 700}'
+    ])
+    client.client.pipeline.return_value = pipe
+
+    await client.save_products(5, [{'productUrl': 'https://www.ozon.ru/product/kept-2/', 'targetPrice': 650}])
+
+    pipe.zrem.assert_called_once_with('alert_targets:ozon:1', '5|https://www.ozon.ru/product/old-1/')
+    pipe.zadd.assert_any_call('alert_targets:ozon:2', {'5|https://www.ozon.ru/product/kept-2/': 650.0})
+    # Новые товары ставятся в расписание той же транзакцией, известные не переносятся
+    pipe.zadd.assert_any_call('check_schedule', {'ozon:2': ANY}, nx=True)
+
+@pytest.mark.asyncio
+async def test_rebuild_alert_index_in_chunks():
+    """Тест, что индекс целевых цен перестраивается конвейерами по SNAPSHOT_CHUNK_SIZE пользователей"""
+    client = RedisClient()
+    client.client = MagicMock()
+    snapshot = MonitoringSnapshot()
+    snapshot.products = {
+        user_id: [{'product_url': 'https://www.ozon.ru/product/phone-1/', 'target_price': user_id}]
+        for user_id in range(1, 4)
+    }
+    client.load_monitoring_snapshot = AsyncMock(return_value=snapshot)
+    pipes = [make_pipeline([]), make_pipeline([])]
+    client.client.pipeline = MagicMock(side_effect=pipes)
+
+    with patch('database.redis_client.SNAPSHOT_CHUNK_SIZE', 2):
+        await client.rebuild_alert_index()
+
+    assert pipes[0].zadd.call_count == 2
+    pipes[1].zadd.assert_called_once_with('alert_targets:ozon:1', {'3|https://www.ozon.ru/product/phone-1/': 3.0})
+    for pipe in pipes:
+        pipe.execute.assert_called_once()
+
+@pytest.mark.asyncio
+async def test_save_products_single_transaction():
+    """Тест, что список товаров и индексы заменяются одной транзакцией независимо от числа товаров"""
+    client = RedisClient()
+    client.client = MagicMock()
+    pipe = make_pipeline([])
+    pipe.watch = AsyncMock()
+    pipe.lrange = AsyncMock(return_value=[])
+    client.client.pipeline.return_value = pipe
+    products = [{'productUrl': f'https://www.wildberries.ru/catalog/{i}/detail.aspx', 'targetPrice': 100} for i in range(50)]
+
+    await client.save_products(5, products)
+
+    client.client.pipeline.assert_called_once_with(transaction=True)
+    pipe.delete.assert_called_once_with('products:5')
+    pipe.rpush.assert_called_once()
+    assert len(pipe.rpush.call_args[0]) == 51
+    pipe.execute.assert_called_once()
+
+@pytest.mark.asyncio
+async def test_save_products_retries_when_list_changed():
+    """Тест, что при параллельной перезаписи списка индекс чистится по заново прочитанному списку"""
+    client = RedisClient()
+    client.client = MagicMock()
+    pipe = make_pipeline(WatchError(), [])
+    pipe.watch = AsyncMock()
+    pipe.lrange = AsyncMock(side_effect=[
+        [],
+        ['{"productUrl": "https://www.ozon.ru/product/raced-3/", "targetPrice": 300}']
+    ])
+    client.client.pipeline.return_value = pipe
+
+    await client.save_products(5, [])
+
+    assert pipe.execute.call_count == 2
+    pipe.watch.assert_called_with('products:5')
+    pipe.zrem.assert_called_once_with('alert_targets:ozon:3', '5|https://www.ozon.ru/product/raced-3/')
+
+@pytest.mark.asyncio
+async def test_delete_user_watches_products():
+    """Тест, что удаление пользователя убирает из индекса товары, прочитанные под WATCH"""
+    client = RedisClient()
+    client.client = MagicMock()
+    pipe = make_pipeline([])
+    pipe.watch = AsyncMock()
+    pipe.lrange = AsyncMock(return_value=['{"productUrl": "https://www.ozon.ru/product/a-1/", "targetPrice": 100}'])
+    client.client.pipeline.return_value = pipe
+
+    await client.delete_user(5)
+
+    pipe.watch.assert_called_once_with('products:5')
+    pipe.multi.assert_called_once()
+    pipe.delete.assert_called_once_with('user:5', 'products:5')
+    pipe.zrem.assert_called_once_with('alert_targets:ozon:1', '5|https://www.ozon.ru/product/a-1/')
+    client.client.rpush.assert_not_called()
+
+@pytest.mark.asyncio
+async def test_get_triggered_alerts():
+    """Тест поиска подписчиков с целевой ценой не ниже текущей одним запросом к индексу"""
+    client = RedisClient()
+    client.client = MagicMock()
+    client.client.zrangebyscore = AsyncMock(return_value=['5|https://www.ozon.ru/product/a-1/?x=1|y'])
+
+    triggered = await client.get_triggered_alerts('ozon:1', 900.0)
+
+    client.client.zrangebyscore.assert_called_once_with('alert_targets:ozon:1', 900.0, '+inf')
+    assert triggered == {(5, 'https://www.ozon.ru/product/a-1/?x=1|y')}
+
+@pytest.mark.asyncio
+async def test_add_pending_updates_trims_oldest():
+    """Тест, что отложенные обновления хранятся по товару и обрезаются до лимита с самых старых"""
+    client = RedisClient()
+    client.client = MagicMock()
+    client.client.eval = AsyncMock(return_value=1)
+    client.client.hgetall = AsyncMock()
+
+    await client.add_pending_updates('token', [{'product_url': 'https://a', 'current_price': 10.0}], 2, 60)
+
+    script, numkeys, key, order_key, ttl, limit, _, *fields = client.client.eval.call_args.args
+    assert script == ADD_PENDING_UPDATES_SCRIPT
+    assert (numkeys, key, order_key, ttl, limit) == (2, 'pending_updates:token', 'pending_updates_order:token', 60, 2)
+    assert fields[0] == 'https://a'
+    assert json.loads(fields[1]) == {'product_url': 'https://a', 'current_price': 10.0}
+    # Обрезка идёт в скрипте по ZSET, без чтения и разбора всего хеша
+    client.client.hgetall.assert_not_called()
+
+@pytest.mark.asyncio
+async def test_pop_pending_updates():
+    """Тест атомарного чтения и удаления отложенных обновлений"""
+    client = RedisClient()
+    client.client = MagicMock()
+    pipe = make_pipeline([{'https://a': '{"product_url": "https://a", "current_price": 5.0, "updated_at": 1}'}, 1])
+    client.client.pipeline.return_value = pipe
+
+    assert await client.pop_pending_updates('token') == [{'product_url': 'https://a', 'current_price': 5.0}]
+    pipe.delete.assert_called_once_with('pending_updates:token', 'pending_updates_order:token')
+
+@pytest.mark.asyncio
+async def test_get_tokens_with_pending_updates():
+    """Тест, что из списка токенов остаются только те, у кого есть отложенные обновления"""
+    client = RedisClient()
+    client.client = MagicMock()
+    pipe = make_pipeline([1, 0, 1])
+    client.client.pipeline.return_value = pipe
+
+    assert await client.get_tokens_with_pending_updates(['t1', 't2', 't3']) == ['t1', 't3']
+    pipe.exists.assert_any_call('pending_updates:t2')
+
+@pytest.mark.asyncio
+async def test_enqueue_alert_deduplicated():
+    """Тест, что одно событие цены попадает в outbox только один раз и одним скриптом"""
+    client = RedisClient()
+    client.client = MagicMock()
+    client.client.eval = AsyncMock(side_effect=[1, 0])
+    alert = {'user_id': 1, 'product_url': 'https://a', 'current_price': 900.0}
+
+    assert await client.enqueue_alert(alert, '1:ozon:1:900.0', 60) is True
+    assert await client.enqueue_alert(alert, '1:ozon:1:900.0', 60) is False
+
+    script, numkeys, dedup_key, stream, ttl, _, payload = client.client.eval.call_args[0]
+    assert numkeys == 2
+    assert (dedup_key, stream, ttl) == ('alert_dedup:1:ozon:1:900.0', 'alert_outbox', 60)
+    assert json.loads(payload) == alert
+    # Ключ дедупликации ставится только после XADD
+    assert script.index("'XADD'") < script.index("'SET'")
+
+@pytest.mark.asyncio
+async def test_claim_stale_outbox_skips_inflight_and_reports_deliveries():
+    """Тест, что зависшие сообщения забираются с числом доставок, кроме тех, что процесс ещё доставляет"""
+    client = RedisClient()
+    client.client = MagicMock()
+    client.client.xpending_range = AsyncMock(return_value=[
+        {'message_id': '1-0', 'consumer': 'worker-1', 'time_since_delivered': 90000, 'times_delivered': 1},
+        {'message_id': '2-0', 'consumer': 'worker-2', 'time_since_delivered': 90000, 'times_delivered': 3}
+    ])
+    client.client.xclaim = AsyncMock(return_value=[('2-0', {'alert': '{"user_id": 2}'})])
+
+    assert await client.claim_stale_outbox('worker-1', 60000, 10, exclude={'1-0'}) == [('2-0', {'user_id': 2}, 3)]
+
+    client.client.xpending_range.assert_called_once_with(
+        'alert_outbox', 'notifiers', min='-', max='+', count=11, idle=60000
+    )
+    client.client.xclaim.assert_called_once_with('alert_outbox', 'notifiers', 'worker-1', 60000, ['2-0'])
+
+@pytest.mark.asyncio
+async def test_read_outbox_decodes_alerts():
+    """Тест чтения уведомлений из outbox группой потребителей"""
+    client = RedisClient()
+    client.client = MagicMock()
+    client.client.xreadgroup = AsyncMock(return_value=[['alert_outbox', [('1-0', {'alert': '{"user_id": 1}'})]]])
+
+    assert await client.read_outbox('worker-1', 10, 0) == [('1-0', {'user_id': 1})]
+    client.client.xreadgroup.assert_called_once_with('notifiers', 'worker-1', {'alert_outbox': '>'}, count=10, block=0)
+
+@pytest.mark.asyncio
+async def test_get_all_users_from_index():
+    """Тест, что пользователи берутся из множества users без обхода ключей"""
+    client = RedisClient()
+    client.client = MagicMock()
+    client.client.exists = AsyncMock(return_value=1)
+    client.client.smembers = AsyncMock(return_value={'1', '2'})
+    client.client.scan = AsyncMock()
+
+    assert sorted(await client.get_all_users()) == [1, 2]
+    client.client.scan.assert_not_called()
+
+@pytest.mark.asyncio
+async def test_get_all_users_backfills_once():
+    """Тест разового заполнения множества users из ключей user:*, пока миграция не выполнена"""
+    client = RedisClient()
+    client.client = MagicMock()
+    client.client.smembers = AsyncMock(return_value={'1', '2'})
+    client.client.exists = AsyncMock(return_value=0)
+    client.client.scan = AsyncMock(side_effect=[(5, ['user:1']), (0, ['user:2'])])
+    pipe = make_pipeline([2, True])
+    client.client.pipeline.return_value = pipe
+
+    assert sorted(await client.get_all_users()) == [1, 2]
+    pipe.sadd.assert_called_once_with('users', 1, 2)
+    pipe.set.assert_called_once_with('users_index_migrated', 1)
+
+@pytest.mark.asyncio
+async def test_get_all_users_backfills_when_set_has_new_user():
+    """Тест, что новый пользователь в множестве до миграции не отменяет заполнение из ключей user:*"""
+    client = RedisClient()
+    client.client = MagicMock()
+    client.client.exists = AsyncMock(return_value=0)
+    client.client.scan = AsyncMock(return_value=(0, ['user:1', 'user:2', 'user:3']))
+    client.client.smembers = AsyncMock(return_value={'1', '2', '3'})
+    pipe = make_pipeline([3, True])
+    client.client.pipeline.return_value = pipe
+
+    assert sorted(await client.get_all_users()) == [1, 2, 3]
+    client.client.exists.assert_called_once_with('users_index_migrated')
+    pipe.sadd.assert_called_once_with('users', 1, 2, 3)
+
+@pytest.mark.asyncio
+async def test_save_and_delete_user_update_index():
+    """Тест, что регистрация и удаление пользователя меняют множество users в той же транзакции"""
+    client = RedisClient()
+    client.client = MagicMock()
+    pipe = make_pipeline([], [])
+    pipe.watch = AsyncMock()
+    pipe.lrange = AsyncMock(return_value=[])
+    client.client.pipeline.return_value = pipe
+
+    await client.save_user(7, 'token')
+    await client.delete_user(7)
+
+    pipe.sadd.assert_called_once_with('users', 7)
+    pipe.srem.assert_called_once_with('users', 7)
+    assert all(call.kwargs == {'transaction': True} for call in client.client.pipeline.call_args_list)
+
+@pytest.mark.asyncio
+async def test_migrate_products_rewrites_legacy_records():
+    """Тест ленивой миграции: старые JSON-записи переписываются компактно, нечитаемые сохраняются"""
+    client = RedisClient()
+    client.client = MagicMock()
+    pipe = make_pipeline([])
+    pipe.watch = AsyncMock()
+    pipe.lrange = AsyncMock(return_value=['{"productUrl": "https://a", "targetPrice": 10}', 'broken'])
+    client.client.pipeline.return_value = pipe
+
+    await client.migrate_products(1)
+
+    pipe.watch.assert_called_once_with('products:1')
+    pipe.multi.assert_called_once()
+    records = pipe.rpush.call_args[0][1:]
+    assert json.loads(records[0])[0] == 1
+    assert records[1] == 'broken'
@@ -0,0 +1,21 @@
+from bot.services.request_filter import should_block_request
+
+def test_heavy_resources_blocked():
+    """Тест блокировки картинок, шрифтов, медиа и стилей"""
+    for resource_type in ('image', 'font', 'media', 'stylesheet'):
+        assert should_block_request('ozon', resource_type, 'https://cdn1.ozone.ru/file.bin')
+
+def test_document_and_scripts_allowed():
+    """Тест, что документ и скрипты страницы не блокируются"""
+    assert not should_block_request('ozon', 'document', 'https://www.ozon.ru/product/test-123/')
+    assert not should_block_request('yandex_market', 'script', 'https://yastatic.net/market/app.js')
+    assert not should_block_request('yandex_market', 'xhr', 'https://market.yandex.ru/api/resolve')
+
+def test_tracker_hosts_blocked():
+    """Тест блокировки аналитики и рекламы даже для скриптов"""
+    assert should_block_request('ozon', 'script', 'https://mc.yandex.ru/metrika/tag.js')
+    assert should_block_request('yandex_market', 'script', 'https://yastatic.net/pcode/adfox/loader.js')
+
+def test_captcha_host_allowed():
+    """Тест, что ресурсы капчи Яндекса не блокируются"""
+    assert not should_block_request('yandex_market', 'image', 'https://captcha-api.yandex.ru/image.png')
@@ -0,0 +1,96 @@
+import pytest
+from unittest.mock import AsyncMock, MagicMock
+from bot.services.scheduler import CheckScheduler
+
+@pytest.fixture
+def redis_client():
+    mock_redis = MagicMock()
+    mock_redis.schedule_products = AsyncMock()
+    mock_redis.unschedule_products = AsyncMock()
+    mock_redis.get_product_stats = AsyncMock(return_value={})
+    mock_redis.save_product_stats = AsyncMock()
+    return mock_redis
+
+@pytest.fixture
+def scheduler(redis_client):
+    scheduler = CheckScheduler(redis_client)
+    scheduler.min_interval = 60
+    scheduler.max_interval = 7200
+    return scheduler
+
+def test_volatile_product_checked_more_often(scheduler):
+    """Тест, что волатильный товар проверяется чаще стабильного"""
+    stable = scheduler.next_interval('ozon', 0.0, 1000.0, 800.0)
+    volatile = scheduler.next_interval('ozon', 0.1, 1000.0, 800.0)
+    assert volatile < stable
+
+def test_product_near_target_checked_more_often(scheduler):
+    """Тест сокращения интервала, когда цена близка к целевой"""
+    near = scheduler.next_interval('ozon', 0.0, 1000.0, 990.0)
+    normal = scheduler.next_interval('ozon', 0.0, 1000.0, 800.0)
+    assert near < normal
+
+def test_stable_far_product_checked_less_often(scheduler):
+    """Тест увеличения интервала для стабильного товара далеко от цели"""
+    assert scheduler.next_interval('ozon', 0.0, 1000.0, 100.0) > 900 * 1.1
+
+def test_interval_clamped(scheduler):
+    """Тест ограничения интервала минимальным и максимальным значением"""
+    assert scheduler.next_interval('wildberries', 10.0, 1000.0, 999.0) == 60
+    scheduler.max_interval = 600
+    assert scheduler.next_interval('ozon', 0.0, 1000.0, 100.0) == 600
+
+@pytest.mark.asyncio
+async def test_get_due_drops_untracked_products(scheduler, redis_client):
+    """Тест, что товары без подписчиков удаляются из расписания"""
+    redis_client.get_due_products = AsyncMock(return_value=['ozon:1', 'ozon:2'])
+
+    due = await scheduler.get_due({'ozon:1': {}})
+
+    assert due == ['ozon:1']
+    redis_client.unschedule_products.assert_called_once_with(['ozon:2'])
+    redis_client.schedule_products.assert_not_called()
+
+@pytest.mark.asyncio
+async def test_get_due_reloads_snapshot_before_dropping(scheduler, redis_client):
+    """Тест, что товар, сохранённый после загрузки снимка, не снимается с расписания"""
+    redis_client.get_due_products = AsyncMock(return_value=['ozon:1', 'ozon:2'])
+    reload = AsyncMock(return_value={'ozon:1': {}, 'ozon:2': {}})
+
+    due = await scheduler.get_due({'ozon:1': {}}, reload=reload)
+
+    assert due == ['ozon:1', 'ozon:2']
+    reload.assert_called_once()
+    redis_client.unschedule_products.assert_not_called()
+
+@pytest.mark.asyncio
+async def test_register_adds_only_new_products(scheduler, redis_client):
+    """Тест, что сверка ставит в расписание только новые товары, не сдвигая известные"""
+    await scheduler.register({'ozon:1': {}, 'ozon:2': {}})
+
+    due_at, = redis_client.schedule_products.call_args[0]
+    assert list(due_at) == ['ozon:1', 'ozon:2']
+    assert redis_client.schedule_products.call_args.kwargs == {'only_new': True}
+
+@pytest.mark.asyncio
+async def test_reschedule_updates_volatility(scheduler, redis_client):
+    """Тест пересчёта волатильности и времени следующей проверки"""
+    redis_client.get_product_stats = AsyncMock(return_value={'ozon:1': {'price': 1000.0, 'volatility': 0.0}})
+    products_by_key = {'ozon:1': {'subscribers': [(1, 'token', {'target_price': 500})]}}
+
+    await scheduler.reschedule({'ozon:1': 900.0}, products_by_key)
+
+    stats = redis_client.save_product_stats.call_args[0][0]
+    assert stats['ozon:1']['price'] == 900.0
+    assert stats['ozon:1']['volatility'] == pytest.approx(0.03)
+    redis_client.schedule_products.assert_called_once()
+
+@pytest.mark.asyncio
+async def test_reschedule_reuses_loaded_stats(scheduler, redis_client):
+    """Тест, что уже загруженная статистика не читается повторно и дополнительные поля сохраняются"""
+    products_by_key = {'ozon:1': {'subscribers': [(1, 'token', {'target_price': 500})]}}
+
+    await scheduler.reschedule({'ozon:1': 900.0}, products_by_key, {'ozon:1': {'price': 900.0, 'sampled_at': 10}})
+
+    redis_client.get_product_stats.assert_not_called()
+    assert redis_client.save_product_stats.call_args[0][0]['ozon:1']['sampled_at'] == 10